@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cita
+from .models import Cita, CupoGrupal, ListaEspera
 
 @admin.register(Cita)
 class CitaAdmin(admin.ModelAdmin):
@@ -19,4 +19,24 @@ class CitaAdmin(admin.ModelAdmin):
     
     def get_doctor(self, obj):
         return obj.doctor.usuario.get_full_name()
-    get_doctor.short_description = 'Doctor'
\ No newline at end of file
+    get_doctor.short_description = 'Doctor'
+
+
+@admin.register(ListaEspera)
+class ListaEsperaAdmin(admin.ModelAdmin):
+    list_display = ['paciente', 'doctor', 'especialidad', 'fecha_desde', 'fecha_hasta', 'tipo', 'estado', 'created_at']
+    list_filter = ['estado', 'tipo', 'especialidad']
+    list_select_related = ['paciente__usuario', 'doctor__usuario', 'especialidad']
+    search_fields = ['paciente__usuario__first_name', 'paciente__usuario__last_name', 'paciente__dni']
+    raw_id_fields = ['paciente', 'doctor', 'cita']
+
+
+
+@admin.register(CupoGrupal)
+class CupoGrupalAdmin(admin.ModelAdmin):
+    list_display = ['descripcion', 'doctor', 'fecha', 'hora_inicio', 'hora_fin', 'capacidad', 'disponibles', 'activo']
+    list_filter = ['activo', 'tipo', 'fecha']
+    list_select_related = ['doctor__usuario']
+    search_fields = ['descripcion', 'doctor__usuario__first_name', 'doctor__usuario__last_name']
+    readonly_fields = ['disponibles']
+    date_hierarchy = 'fecha'
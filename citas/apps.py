@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CitasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'citas'
+
+    def ready(self):
+        # Registrar los receptores de señales de la agenda
+        from . import signals, carga, ocupacion, disponibilidad, espera  # noqa: F401
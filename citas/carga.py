@@ -0,0 +1,69 @@
+"""Carga de trabajo (citas activas) por doctor y día, mantenida en caché"""
+from datetime import timedelta
+from django.core.cache import cache
+from django.db.models import Count
+from django.dispatch import receiver
+from .models import Cita
+from .signals import agenda_modificada
+
+# Los contadores se recalculan al menos cada hora
+CARGA_TTL = 3600
+
+
+def clave_carga(doctor_id, fecha):
+    """Clave de caché del contador de un doctor en un día"""
+    return f'citas:carga:{doctor_id}:{fecha.isoformat()}'
+
+
+def carga_doctores(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Citas activas de cada doctor entre las dos fechas: {doctor_id: total}.
+
+    Los contadores diarios se leen de la caché en una sola llamada; solo los
+    días que faltan se cuentan en la base de datos, con una consulta agrupada.
+    """
+    fechas = [
+        fecha_inicio + timedelta(days=i)
+        for i in range((fecha_fin - fecha_inicio).days + 1)
+    ]
+    claves = {
+        clave_carga(doctor_id, fecha): (doctor_id, fecha)
+        for doctor_id in doctor_ids
+        for fecha in fechas
+    }
+    contadores = {claves[clave]: total for clave, total in cache.get_many(claves).items()}
+
+    faltantes = [dia for dia in claves.values() if dia not in contadores]
+    if faltantes:
+        contados = dict.fromkeys(faltantes, 0)
+        for doctor_id, fecha, total in Cita.objects.filter(
+            doctor_id__in={doctor_id for doctor_id, fecha in faltantes},
+            fecha__range=[min(fecha for doctor_id, fecha in faltantes), max(fecha for doctor_id, fecha in faltantes)],
+            estado__in=Cita.ESTADOS_ACTIVOS
+        ).order_by().values('doctor_id', 'fecha').annotate(
+            total=Count('id')
+        ).values_list('doctor_id', 'fecha', 'total'):
+            if (doctor_id, fecha) in contados:
+                contados[(doctor_id, fecha)] = total
+        cache.set_many(
+            {clave_carga(*dia): total for dia, total in contados.items()},
+            CARGA_TTL
+        )
+        contadores.update(contados)
+
+    cargas = dict.fromkeys(doctor_ids, 0)
+    for (doctor_id, fecha), total in contadores.items():
+        cargas[doctor_id] += total
+    return cargas
+
+
+@receiver(agenda_modificada)
+def actualizar_carga(sender, dias, altas, **kwargs):
+    """Suma las citas nuevas a los contadores y descarta los de días modificados"""
+    for doctor_id, fecha in altas:
+        try:
+            cache.incr(clave_carga(doctor_id, fecha))
+        except ValueError:
+            # El contador no está en caché: se contará en la próxima lectura
+            pass
+    cache.delete_many([clave_carga(doctor_id, fecha) for doctor_id, fecha in dias])
@@ -0,0 +1,134 @@
+"""
+Reservas en cola por doctor (CITAS_RESERVA_EN_COLA).
+
+En horas pico cada envío del formulario se guarda como SolicitudReserva
+'en_cola' y responde enseguida; un único consumidor por doctor las aplica
+en orden de llegada y el cliente consulta el resultado. Así las reservas de
+un doctor no compiten entre sí por la base y las de los demás siguen igual.
+
+El consumidor es la tarea procesar_cola_reservas (tasks.py); un candado en
+caché por doctor garantiza que solo una instancia vacía su cola. Si un
+consumidor se cae a mitad, recuperar_solicitudes (tarea periódica) rechaza
+lo que quedó abandonado y vuelve a despertar las colas pendientes.
+"""
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .models import SolicitudReserva
+from .reservas import CAMPOS_FORMULARIO, reservar_desde_formulario, finalizar_solicitud
+
+# Segundos que dura el candado del consumidor si se cae sin liberarlo;
+# se renueva con cada solicitud procesada
+COLA_CANDADO_TTL = 60
+# Segundos tras los que una solicitud que sigue 'procesando' sin consumidor
+# activo se da por abandonada, y máximo que una solicitud espera en cola
+SOLICITUD_ABANDONADA = 300
+COLA_ESPERA_MAXIMA = 900
+
+MENSAJE_ABANDONADA = 'No se pudo confirmar la reserva. Revisa Mis Citas antes de volver a intentarlo.'
+MENSAJE_VENCIDA = 'La solicitud no se pudo procesar a tiempo. Vuelve a intentarlo.'
+
+
+def clave_candado(doctor_id):
+    """Clave de caché del candado del consumidor de la cola del doctor"""
+    return f'citas:cola:{doctor_id}'
+
+
+def encolar_reserva(solicitud, datos):
+    """
+    Guarda los datos del formulario en la solicitud, la deja en cola y
+    despierta al consumidor del doctor cuando se confirme la transacción.
+    """
+    from .tasks import procesar_cola_reservas
+    solicitud.estado = 'en_cola'
+    solicitud.datos = {campo: datos.get(campo) for campo in CAMPOS_FORMULARIO}
+    solicitud.save(update_fields=['estado', 'datos'])
+    doctor_id = solicitud.doctor_id
+    transaction.on_commit(lambda: procesar_cola_reservas.delay(doctor_id))
+
+
+def procesar_solicitud(solicitud):
+    """Aplica una solicitud en cola y guarda su resultado"""
+    try:
+        paciente = solicitud.usuario.paciente
+        mensaje, cita, avisos = reservar_desde_formulario(paciente, solicitud.doctor, solicitud.datos)
+        finalizar_solicitud(solicitud, 'completada', '\n'.join([mensaje, *avisos]), cita)
+    except ValidationError as e:
+        finalizar_solicitud(solicitud, 'rechazada', '\n'.join(e.messages))
+    except Exception as e:
+        finalizar_solicitud(solicitud, 'rechazada', f'Error al agendar la cita: {str(e)}')
+
+
+def _siguiente(doctor_id):
+    """Toma la solicitud más antigua en cola del doctor, o None si está vacía"""
+    en_cola = SolicitudReserva.objects.filter(doctor_id=doctor_id, estado='en_cola').select_related(
+        'usuario__paciente', 'doctor__usuario', 'doctor__especialidad_principal'
+    ).order_by('pk')
+    while True:
+        solicitud = en_cola.first()
+        if solicitud is None:
+            return None
+        # UPDATE condicional: si otro proceso ya la tomó se pasa a la siguiente
+        if SolicitudReserva.objects.filter(pk=solicitud.pk, estado='en_cola').update(estado='procesando'):
+            solicitud.estado = 'procesando'
+            return solicitud
+
+
+def procesar_cola(doctor_id):
+    """
+    Vacía la cola del doctor si nadie más la está procesando. Devuelve
+    cuántas solicitudes aplicó.
+    """
+    candado = clave_candado(doctor_id)
+    procesadas = 0
+    while cache.add(candado, True, COLA_CANDADO_TTL):
+        try:
+            solicitud = _siguiente(doctor_id)
+            while solicitud:
+                procesar_solicitud(solicitud)
+                procesadas += 1
+                cache.touch(candado, COLA_CANDADO_TTL)
+                solicitud = _siguiente(doctor_id)
+        finally:
+            cache.delete(candado)
+        # Una solicitud pudo encolarse justo antes de soltar el candado
+        if not SolicitudReserva.objects.filter(doctor_id=doctor_id, estado='en_cola').exists():
+            break
+    return procesadas
+
+
+def recuperar_solicitudes():
+    """
+    Rechaza las solicitudes que quedaron 'procesando' más de
+    SOLICITUD_ABANDONADA segundos sin un consumidor activo del doctor (el
+    proceso se cayó a mitad; la cita pudo quedar agendada, por eso no se
+    reintentan) y las que esperan en cola más de COLA_ESPERA_MAXIMA. Despierta
+    al consumidor de cada doctor que aún tiene solicitudes en cola. Devuelve
+    cuántas solicitudes rechazó.
+    """
+    from .tasks import procesar_cola_reservas
+    ahora = timezone.now()
+    abandonadas = SolicitudReserva.objects.filter(
+        estado='procesando',
+        created_at__lt=ahora - timedelta(seconds=SOLICITUD_ABANDONADA)
+    )
+    activos = [
+        doctor_id
+        for doctor_id in set(abandonadas.values_list('doctor_id', flat=True))
+        if cache.get(clave_candado(doctor_id))
+    ]
+    rechazadas = abandonadas.exclude(doctor_id__in=activos).update(
+        estado='rechazada', mensaje=MENSAJE_ABANDONADA
+    )
+    # UPDATE condicional: si un consumidor ya la tomó deja de estar en cola
+    rechazadas += SolicitudReserva.objects.filter(
+        estado='en_cola',
+        created_at__lt=ahora - timedelta(seconds=COLA_ESPERA_MAXIMA)
+    ).update(estado='rechazada', mensaje=MENSAJE_VENCIDA)
+
+    for doctor_id in set(SolicitudReserva.objects.filter(estado='en_cola').values_list('doctor_id', flat=True)):
+        if not cache.get(clave_candado(doctor_id)):
+            procesar_cola_reservas.delay(doctor_id)
+    return rechazadas
@@ -0,0 +1,94 @@
+"""
+Conflictos de horario de varias citas a la vez: doctor, paciente y
+consultorio o equipo se validan juntos sobre índices de intervalos.
+
+Las citas activas que pueden chocar se leen en una consulta (más otra con
+las sesiones grupales de los doctores) y quedan en un IndiceIntervalos por
+(clase, id, fecha); cada verificación es una búsqueda binaria por clase.
+"""
+from collections import defaultdict
+from django.db.models import Q
+from horarios.intervalos import IndiceIntervalos, a_minutos, a_hora
+from .models import Cita, CupoGrupal
+
+# Clases de conflicto en el orden en que se verifican. El doctor va
+# primero: una cita suya en el mismo recurso es un choque con el doctor.
+CLASES = ('doctor', 'paciente', 'recurso')
+
+
+class IndiceConflictos:
+    """Horarios ocupados de doctores, pacientes y recursos por fecha"""
+
+    def __init__(self, ocupados=()):
+        """ocupados: [(clase, id, fecha, hora_inicio, hora_fin), ...]"""
+        por_clave = defaultdict(list)
+        for clase, id_, fecha, hora_inicio, hora_fin in ocupados:
+            por_clave[(clase, id_, fecha)].append((a_minutos(hora_inicio), a_minutos(hora_fin)))
+        self.indices = {clave: IndiceIntervalos(intervalos) for clave, intervalos in por_clave.items()}
+
+    @classmethod
+    def cargar(cls, fechas, doctor_ids=(), paciente_ids=(), recurso_ids=()):
+        """
+        Índice con las citas activas de los doctores, pacientes y recursos
+        en esas fechas. Las citas de los tipos que pueden solaparse no
+        ocupan al paciente y las de sesiones grupales no ocupan al doctor:
+        lo ocupa la sesión.
+        """
+        doctor_ids, paciente_ids, recurso_ids = set(doctor_ids), set(paciente_ids), set(recurso_ids)
+        permitidos = Cita.tipos_solapamiento_paciente()
+
+        filtro = Q(doctor_id__in=doctor_ids, cupo__isnull=True) | Q(recurso_id__in=recurso_ids)
+        if paciente_ids:
+            filtro |= Q(paciente_id__in=paciente_ids) & ~Q(tipo__in=permitidos)
+        ocupados = []
+        for doctor_id, paciente_id, recurso_id, cupo_id, tipo, fecha, inicio, fin in Cita.objects.filter(
+            filtro,
+            fecha__in=fechas,
+            estado__in=Cita.ESTADOS_ACTIVOS
+        ).order_by().values_list(
+            'doctor_id', 'paciente_id', 'recurso_id', 'cupo_id', 'tipo', 'fecha', 'hora_inicio', 'hora_fin'
+        ):
+            if doctor_id in doctor_ids and cupo_id is None:
+                ocupados.append(('doctor', doctor_id, fecha, inicio, fin))
+            if paciente_id in paciente_ids and tipo not in permitidos:
+                ocupados.append(('paciente', paciente_id, fecha, inicio, fin))
+            if recurso_id in recurso_ids:
+                ocupados.append(('recurso', recurso_id, fecha, inicio, fin))
+
+        if doctor_ids:
+            ocupados.extend(
+                ('doctor', doctor_id, fecha, inicio, fin)
+                for doctor_id, fecha, inicio, fin in CupoGrupal.objects.filter(
+                    doctor_id__in=doctor_ids,
+                    fecha__in=fechas,
+                    activo=True
+                ).order_by().values_list('doctor_id', 'fecha', 'hora_inicio', 'hora_fin')
+            )
+        return cls(ocupados)
+
+    def conflicto(self, fecha, hora_inicio, hora_fin, doctor_id=None, paciente_id=None, recurso_id=None):
+        """
+        Mensaje del primer choque de [hora_inicio, hora_fin) con el doctor,
+        el paciente o el recurso en la fecha, o None si está libre.
+        """
+        inicio, fin = a_minutos(hora_inicio), a_minutos(hora_fin)
+        for clase, id_ in zip(CLASES, (doctor_id, paciente_id, recurso_id)):
+            indice = self.indices.get((clase, id_, fecha)) if id_ else None
+            tramo = indice and indice.solapado(inicio, fin)
+            if not tramo:
+                continue
+            desde, hasta = a_hora(tramo[0]).strftime('%H:%M'), a_hora(tramo[1]).strftime('%H:%M')
+            if clase == 'doctor':
+                return f'Ya existe una cita para este doctor el {fecha} de {desde} a {hasta}.'
+            if clase == 'paciente':
+                return 'El paciente ya tiene otra cita en ese horario.'
+            return f'El consultorio o equipo del turno está ocupado el {fecha} de {desde} a {hasta}.'
+        return None
+
+    def agregar(self, fecha, hora_inicio, hora_fin, doctor_id=None, paciente_id=None, recurso_id=None):
+        """Marca ocupado [hora_inicio, hora_fin) para el doctor, el paciente y el recurso"""
+        intervalo = (a_minutos(hora_inicio), a_minutos(hora_fin))
+        for clase, id_ in zip(CLASES, (doctor_id, paciente_id, recurso_id)):
+            if id_:
+                clave = (clase, id_, fecha)
+                self.indices[clave] = IndiceIntervalos([*self.indices.get(clave, ()), intervalo])
@@ -0,0 +1,379 @@
+"""Motor de disponibilidad: calcula los horarios libres de los doctores por día"""
+import hashlib
+import heapq
+import uuid
+from collections import defaultdict
+from itertools import islice
+from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils import timezone
+from horarios.models import Horario, Excepcion
+from horarios.intervalos import IndiceIntervalos, a_minutos, a_hora, cargar_indices
+from horarios.cierres import clave_version_cierres
+from .ocupacion import mascara, intervalos, ocupacion_por_doctor, ocupacion_recursos
+from .signals import agenda_modificada
+
+DURACION_POR_DEFECTO = 30
+# Días que se cargan de una vez al buscar entre varios doctores
+VENTANA_BUSQUEDA = 7
+# Vida máxima en caché de los horarios libres de un doctor en un día
+DISPONIBILIDAD_TTL = 24 * 3600
+
+
+def duracion_cita_doctor(doctor, tipo=None):
+    """
+    Duración en minutos de las citas del doctor: la propia para ese tipo de
+    cita, la de su especialidad principal o la por defecto. No consulta la
+    base si el doctor se cargó con select_related('especialidad_principal').
+    """
+    if tipo and doctor.duraciones.get(tipo):
+        return doctor.duraciones[tipo]
+    if doctor.especialidad_principal_id:
+        return doctor.especialidad_principal.duracion_cita
+    return DURACION_POR_DEFECTO
+
+
+def duraciones_por_tipo(doctor, tipos):
+    """Duración de cada tipo de cita con el doctor: {tipo: minutos}"""
+    return {tipo: duracion_cita_doctor(doctor, tipo) for tipo in tipos}
+
+
+def dividir_en_slots(intervalos, duracion, desde=0):
+    """Corta los intervalos libres en slots de la duración indicada"""
+    slots = []
+    for inicio, fin in intervalos:
+        actual = inicio
+        while actual + duracion <= fin:
+            if actual >= desde:
+                slots.append((a_hora(actual), a_hora(actual + duracion)))
+            actual += duracion
+    return slots
+
+
+def verificar_slot(horario, fecha, hora_inicio, hora_fin):
+    """
+    Aplica en memoria las reglas de horario de Cita.clean sobre el índice de
+    horario del doctor (horarios/intervalos.py) ya cargado. Devuelve el
+    mensaje de error o None si el horario está libre. Los choques con otras
+    citas los detectan conflictos.py y la base de datos.
+    """
+    if fecha < timezone.now().date():
+        return 'No se pueden agendar citas en fechas pasadas.'
+
+    if not horario.trabaja(fecha):
+        dias = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+        return f'El doctor no trabaja los {dias[fecha.weekday()]}.'
+
+    if not horario.en_turno(fecha, hora_inicio):
+        return 'La hora seleccionada está fuera del horario laboral del doctor.'
+
+    motivo = horario.excepcion(fecha)
+    if motivo:
+        return f'El doctor no está disponible en esta fecha ({dict(Excepcion.TIPOS)[motivo]}).'
+
+    cierre = horario.cierre(fecha)
+    if cierre:
+        return f'La clínica no atiende en esta fecha ({cierre}).'
+
+    return None
+
+
+def jornada_en_fecha(horario, fecha, ocupacion_recurso=None):
+    """
+    Bloques de 5 minutos en los que el doctor atiende esa fecha según su
+    índice de horario (ver ocupacion.py). Con ocupacion_recurso {(recurso_id, fecha): bitmap} se
+    quitan los bloques en que el consultorio o equipo de cada turno está
+    tomado por otra cita.
+    """
+    if horario.excepcion(fecha) or horario.cierre(fecha):
+        return 0
+    bitmap = 0
+    for inicio, fin in horario.turnos_en(fecha):
+        bitmap |= mascara(inicio, fin, exterior=False)
+    if ocupacion_recurso:
+        for inicio, fin, recurso_id in horario.recursos_en(fecha):
+            bitmap &= ~(mascara(inicio, fin, exterior=False) & ocupacion_recurso.get((recurso_id, fecha), 0))
+    return bitmap
+
+
+def _fechas(fecha_inicio, fecha_fin):
+    """Fechas entre las dos dadas (incluidas)"""
+    return [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+
+
+# Caché de horarios libres por (doctor, fecha), como mapa de bits de
+# bloques de 5 minutos: jornada AND NOT ocupación.
+#
+# La clave de cada día lleva tres versiones: la del calendario de cierres
+# (compartida con la copia en memoria de cada proceso, ver horarios/cierres.py),
+# la del doctor (cambia con su horario semanal, sus excepciones o sus
+# especialidades) y la del día (cambia con sus citas). Si los turnos del
+# doctor usan consultorios o equipos, lleva además una firma de las
+# versiones de esos recursos en el día (cambian con las citas de cualquier
+# doctor en ellos).
+# Invalidar es borrar la versión; la siguiente lectura crea otra y los
+# valores viejos quedan inalcanzables. Como las versiones se leen antes de
+# consultar la base de datos y se borran después del commit, un cálculo
+# hecho con datos viejos nunca se guarda bajo una versión vigente.
+
+def clave_version_doctor(doctor_id):
+    """Clave de la versión del horario de un doctor"""
+    return f'citas:disponibilidad:v:{doctor_id}'
+
+
+def clave_version_dia(doctor_id, fecha):
+    """Clave de la versión de las citas de un doctor en un día"""
+    return f'citas:disponibilidad:v:{doctor_id}:{fecha.isoformat()}'
+
+
+def clave_version_recurso(recurso_id, fecha):
+    """Clave de la versión de las citas de un consultorio o equipo en un día"""
+    return f'citas:disponibilidad:v:r{recurso_id}:{fecha.isoformat()}'
+
+
+def recursos_por_doctor(doctor_ids, versiones):
+    """
+    Consultorios y equipos de los turnos activos de cada doctor:
+    {doctor_id: [recurso_id, ...]}. Se guardan en caché bajo la versión del
+    doctor, que cambia al editar sus horarios.
+    """
+    claves = {
+        f'citas:disponibilidad:recursos:{doctor_id}:{versiones[clave_version_doctor(doctor_id)]}': doctor_id
+        for doctor_id in doctor_ids
+    }
+    recursos = {claves[clave]: recurso_ids for clave, recurso_ids in cache.get_many(claves).items()}
+    faltantes = {doctor_id: set() for doctor_id in doctor_ids if doctor_id not in recursos}
+    if faltantes:
+        for doctor_id, recurso_id in Horario.objects.filter(
+            doctor_id__in=faltantes,
+            activo=True,
+            recurso__isnull=False
+        ).values_list('doctor_id', 'recurso_id'):
+            faltantes[doctor_id].add(recurso_id)
+        for doctor_id, recurso_ids in faltantes.items():
+            recursos[doctor_id] = sorted(recurso_ids)
+        cache.set_many(
+            {clave: recursos[doctor_id] for clave, doctor_id in claves.items() if doctor_id in faltantes},
+            DISPONIBILIDAD_TTL
+        )
+    return recursos
+
+
+def _firma_recursos(versiones, recurso_ids, fecha):
+    """Parte de la clave de un día con las versiones de los recursos del doctor ('' si no usa)"""
+    if not recurso_ids:
+        return ''
+    datos = ':'.join(versiones[clave_version_recurso(recurso_id, fecha)] for recurso_id in recurso_ids)
+    return ':' + hashlib.md5(datos.encode()).hexdigest()
+
+
+def _versiones(claves):
+    """Versiones vigentes de las claves; crea las que no existen"""
+    versiones = cache.get_many(claves)
+    for clave in claves:
+        if clave not in versiones:
+            nueva = uuid.uuid4().hex
+            if not cache.add(clave, nueva, DISPONIBILIDAD_TTL):
+                # Otro proceso la creó a la vez: se usa la suya
+                nueva = cache.get(clave, nueva)
+            versiones[clave] = nueva
+    return versiones
+
+
+def libres_por_doctor(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Bloques libres de cada doctor y día entre las dos fechas:
+    {doctor_id: {fecha: bitmap}}.
+
+    Los días se leen de la caché y solo los que faltan se calculan, para
+    todos los doctores a la vez, con el horario, las excepciones y los
+    mapas de ocupación, sin recorrer las citas. Los bloques en que el
+    consultorio o equipo de un turno está tomado por otro doctor no quedan libres.
+    """
+    fechas = _fechas(fecha_inicio, fecha_fin)
+    versiones = _versiones(
+        [clave_version_cierres()] +
+        [clave_version_doctor(doctor_id) for doctor_id in doctor_ids] +
+        [clave_version_dia(doctor_id, fecha) for doctor_id in doctor_ids for fecha in fechas]
+    )
+    recursos = recursos_por_doctor(doctor_ids, versiones)
+    claves_recurso = {
+        clave_version_recurso(recurso_id, fecha)
+        for doctor_id in doctor_ids
+        for recurso_id in recursos[doctor_id]
+        for fecha in fechas
+    }
+    if claves_recurso:
+        versiones.update(_versiones(sorted(claves_recurso)))
+    claves = {
+        'citas:disponibilidad:{}:{}:{}:{}:{}{}'.format(
+            doctor_id,
+            fecha.isoformat(),
+            versiones[clave_version_cierres()],
+            versiones[clave_version_doctor(doctor_id)],
+            versiones[clave_version_dia(doctor_id, fecha)],
+            _firma_recursos(versiones, recursos[doctor_id], fecha)
+        ): (doctor_id, fecha)
+        for doctor_id in doctor_ids
+        for fecha in fechas
+    }
+
+    libres = {doctor_id: {} for doctor_id in doctor_ids}
+    for clave, bitmap in cache.get_many(claves).items():
+        doctor_id, fecha = claves[clave]
+        libres[doctor_id][fecha] = bitmap
+
+    faltantes = [(clave, dia) for clave, dia in claves.items() if dia[1] not in libres[dia[0]]]
+    if faltantes:
+        doctores_faltantes = list({doctor_id for clave, (doctor_id, fecha) in faltantes})
+        fechas_faltantes = [fecha for clave, (doctor_id, fecha) in faltantes]
+        desde, hasta = min(fechas_faltantes), max(fechas_faltantes)
+        horarios = cargar_indices(doctores_faltantes, desde, hasta)
+        ocupacion = ocupacion_por_doctor(doctores_faltantes, desde, hasta)
+        ocupacion_recurso = ocupacion_recursos(
+            {recurso_id for doctor_id in doctores_faltantes for recurso_id in recursos[doctor_id]},
+            desde,
+            hasta
+        )
+        nuevos = {}
+        for clave, (doctor_id, fecha) in faltantes:
+            nuevos[clave] = libres[doctor_id][fecha] = (
+                jornada_en_fecha(horarios[doctor_id], fecha, ocupacion_recurso) & ~ocupacion[doctor_id][fecha]
+            )
+        cache.set_many(nuevos, DISPONIBILIDAD_TTL)
+
+    return libres
+
+
+@receiver(agenda_modificada)
+def invalidar_disponibilidad(sender, dias, altas, doctores=(), cierres=False, recursos=(), **kwargs):
+    """
+    Descarta los días, doctores y recursos cuya agenda cambió, o todo si
+    cambió el calendario de cierres
+    """
+    cache.delete_many(
+        [clave_version_dia(doctor_id, fecha) for doctor_id, fecha in set(dias) | set(altas)] +
+        [clave_version_recurso(recurso_id, fecha) for recurso_id, fecha in recursos] +
+        [clave_version_doctor(doctor_id) for doctor_id in doctores] +
+        ([clave_version_cierres()] if cierres else [])
+    )
+
+
+def iterar_slots(libres, fecha_inicio, fecha_fin, duracion):
+    """
+    Genera en orden, día por día, los slots (fecha, hora_inicio, hora_fin)
+    a partir de los bloques libres {fecha: bitmap}.
+    """
+    ahora = timezone.localtime()
+    fecha = max(fecha_inicio, ahora.date())
+    while fecha <= fecha_fin:
+        bitmap = libres.get(fecha)
+        if bitmap:
+            # Hoy solo se ofrecen los slots que todavía no empezaron
+            desde = a_minutos(ahora.time()) + 1 if fecha == ahora.date() else 0
+            for inicio, fin in dividir_en_slots(intervalos(bitmap), duracion, desde):
+                yield fecha, inicio, fin
+        fecha += timedelta(days=1)
+
+
+def primer_slot(libres, fecha_inicio, fecha_fin, duracion):
+    """
+    Primer slot libre (fecha, hora_inicio) entre las dos fechas a partir de
+    los bloques libres {fecha: bitmap}, o None. En cada día es una búsqueda
+    binaria en el índice de tramos libres; da el mismo slot que iterar_slots.
+    """
+    ahora = timezone.localtime()
+    fecha = max(fecha_inicio, ahora.date())
+    while fecha <= fecha_fin:
+        bitmap = libres.get(fecha)
+        if bitmap:
+            desde = a_minutos(ahora.time()) + 1 if fecha == ahora.date() else 0
+            tramo = IndiceIntervalos(intervalos(bitmap)).siguiente(desde, duracion)
+            if tramo:
+                return fecha, a_hora(tramo[0])
+        fecha += timedelta(days=1)
+    return None
+
+
+def calcular_disponibilidad(doctor, fecha_inicio, fecha_fin, duracion=None):
+    """
+    Devuelve {fecha: [(hora_inicio, hora_fin), ...]} con los slots libres
+    del doctor entre las dos fechas (incluidas).
+
+    Resta las citas activas y las excepciones del horario semanal del doctor
+    y divide el resultado según la duración de sus citas.
+    Los días ya calculados salen de la caché; el resto se calcula de una
+    vez, sin importar el número de días.
+    """
+    if duracion is None:
+        duracion = duracion_cita_doctor(doctor)
+
+    libres = libres_por_doctor([doctor.pk], fecha_inicio, fecha_fin)[doctor.pk]
+
+    disponibilidad = defaultdict(list)
+    for fecha, inicio, fin in iterar_slots(libres, fecha_inicio, fecha_fin, duracion):
+        disponibilidad[fecha].append((inicio, fin))
+    return dict(disponibilidad)
+
+
+def _ventanas(dias):
+    """Divide los próximos `dias` días en ventanas de VENTANA_BUSQUEDA días"""
+    fecha = timezone.now().date()
+    limite = fecha + timedelta(days=dias)
+    while fecha <= limite:
+        fin = min(fecha + timedelta(days=VENTANA_BUSQUEDA - 1), limite)
+        yield fecha, fin
+        fecha = fin + timedelta(days=1)
+
+
+def _slots_con_doctor(doctor_id, slots):
+    """Añade el doctor a cada slot para ordenarlos por (fecha, hora_inicio, doctor)"""
+    for fecha, hora_inicio, hora_fin in slots:
+        yield fecha, hora_inicio, doctor_id, hora_fin
+
+
+def primeros_slots_libres(doctores, duracion, cantidad, dias=30):
+    """
+    Los `cantidad` slots libres más próximos entre varios doctores.
+
+    Mezcla en orden los slots de cada doctor (heapq.merge) y se detiene en
+    cuanto reúne `cantidad`. Los horarios libres se leen por ventanas de
+    una semana y casi siempre basta la primera.
+    Devuelve [(fecha, hora_inicio, hora_fin, doctor), ...].
+    """
+    doctores = {doctor.pk: doctor for doctor in doctores}
+    resultado = []
+    for inicio, fin in _ventanas(dias):
+        if len(resultado) >= cantidad or not doctores:
+            break
+        libres = libres_por_doctor(list(doctores), inicio, fin)
+        flujos = [
+            _slots_con_doctor(doctor_id, iterar_slots(libres_doctor, inicio, fin, duracion))
+            for doctor_id, libres_doctor in libres.items()
+        ]
+        for fecha, hora_inicio, doctor_id, hora_fin in islice(heapq.merge(*flujos), cantidad - len(resultado)):
+            resultado.append((fecha, hora_inicio, hora_fin, doctores[doctor_id]))
+    return resultado
+
+
+def proximo_slot_por_doctor(doctores, duracion, dias=30):
+    """
+    Primer slot libre (fecha, hora_inicio) de cada doctor, o None si no
+    tiene ninguno en los próximos `dias` días. Devuelve {doctor_id: slot}.
+    """
+    pendientes = [doctor.pk for doctor in doctores]
+    proximos = dict.fromkeys(pendientes)
+    for inicio, fin in _ventanas(dias):
+        if not pendientes:
+            break
+        libres = libres_por_doctor(pendientes, inicio, fin)
+        for doctor_id, libres_doctor in libres.items():
+            proximos[doctor_id] = primer_slot(libres_doctor, inicio, fin, duracion)
+        pendientes = [doctor_id for doctor_id in pendientes if proximos[doctor_id] is None]
+    return proximos
+
+
+def calcular_hora_fin(fecha, hora_inicio, duracion):
+    """Hora de fin de una cita que empieza a hora_inicio y dura `duracion` minutos"""
+    return (datetime.combine(fecha, hora_inicio) + timedelta(minutes=duracion)).time()
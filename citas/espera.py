@@ -0,0 +1,87 @@
+"""
+Lista de espera: cuando se cancela una cita, su horario se asigna al primer
+paciente que lo esperaba con ese doctor o con una de sus especialidades.
+
+La cancelación solo encola la tarea rellenar_huecos (tasks.py); la búsqueda
+de candidatos es una consulta sobre los índices parciales de ListaEspera.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from doctores.models import Doctor
+from .models import ListaEspera
+from .disponibilidad import calcular_hora_fin, duracion_cita_doctor
+from .reservas import reservar_cita
+from .signals import citas_canceladas
+
+
+def candidatos_espera(doctor_id, fecha):
+    """
+    Entradas vigentes que aceptan al doctor en la fecha, por orden de
+    llegada: las de ese doctor y las de cualquiera de sus especialidades.
+    """
+    especialidades = Doctor.especialidades.through.objects.filter(
+        doctor_id=doctor_id
+    ).values('especialidad_id')
+    return ListaEspera.objects.filter(
+        Q(doctor_id=doctor_id) | Q(doctor__isnull=True, especialidad_id__in=especialidades),
+        estado='esperando',
+        fecha_desde__lte=fecha,
+        fecha_hasta__gte=fecha
+    ).select_related('paciente').order_by('created_at')
+
+
+def rellenar_hueco(doctor_id, fecha, hora_inicio, hora_fin, excluir_paciente=None):
+    """
+    Agenda el horario liberado al primer paciente en espera al que le quepa
+    (según la duración de su tipo de cita) y no choque con otras citas suyas.
+    Devuelve la cita creada o None.
+
+    Las entradas se bloquean de a una con SKIP LOCKED, cada intento en su
+    propia transacción: dos huecos que se rellenan a la vez nunca asignan
+    la misma entrada y cada uno sigue con la siguiente que el otro no esté
+    probando, en vez de saltarse toda la lista.
+    """
+    ahora = timezone.localtime()
+    if (fecha, hora_inicio) <= (ahora.date(), ahora.time()):
+        return None
+
+    doctor = Doctor.objects.select_related('usuario', 'especialidad_principal').get(pk=doctor_id)
+    candidatos = candidatos_espera(doctor_id, fecha).exclude(paciente_id=excluir_paciente)
+
+    probadas = []
+    while True:
+        with transaction.atomic():
+            entrada = candidatos.exclude(pk__in=probadas).select_for_update(
+                skip_locked=True, of=('self',)
+            ).first()
+            if entrada is None:
+                return None
+            probadas.append(entrada.pk)
+            duracion = duracion_cita_doctor(doctor, entrada.tipo)
+            if calcular_hora_fin(fecha, hora_inicio, duracion) > hora_fin:
+                continue
+            try:
+                cita = reservar_cita(
+                    entrada.paciente, doctor, fecha, hora_inicio, entrada.tipo, entrada.motivo,
+                    duracion=duracion
+                )
+            except ValidationError:
+                # El paciente tiene otra cita a esa hora o el horario ya se tomó
+                continue
+            entrada.estado = 'asignada'
+            entrada.cita = cita
+            entrada.save(update_fields=['estado', 'cita'])
+            return cita
+
+
+@receiver(citas_canceladas)
+def encolar_relleno(sender, canceladas, **kwargs):
+    """Encola la búsqueda de pacientes en espera para los horarios cancelados"""
+    from .tasks import rellenar_huecos
+    rellenar_huecos.delay([
+        (doctor_id, fecha.isoformat(), hora_inicio.isoformat(), hora_fin.isoformat(), paciente_id)
+        for doctor_id, fecha, hora_inicio, hora_fin, paciente_id in canceladas
+    ])
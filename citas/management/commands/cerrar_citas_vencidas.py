@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from citas.models import Cita
+
+
+class Command(BaseCommand):
+    help = 'Cierra las citas de días pasados que siguen pendientes o confirmadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--estado',
+            default='no_asistio',
+            help='Estado final de las citas vencidas (por defecto: no_asistio)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Citas actualizadas por cada UPDATE (por defecto: 500)'
+        )
+
+    def handle(self, *args, **options):
+        estado = options['estado']
+        lote = options['lote']
+
+        # Solo se cierran los estados abiertos que pueden pasar a `estado`
+        origenes = [
+            origen for origen in Cita.ESTADOS_ACTIVOS
+            if estado in Cita.TRANSICIONES[origen]
+        ]
+        if not origenes:
+            raise CommandError(f'Ninguna cita abierta puede pasar al estado "{estado}".')
+
+        vencidas = Cita.objects.filter(
+            fecha__lt=timezone.now().date(),
+            estado__in=origenes
+        ).order_by('pk')
+
+        # UPDATEs cortos por lotes para no bloquear la tabla mucho tiempo
+        total = 0
+        while True:
+            ids = list(vencidas.values_list('pk', flat=True)[:lote])
+            if not ids:
+                break
+            actualizadas = Cita.objects.filter(pk__in=ids).transicionar(estado)
+            if not actualizadas:
+                break
+            total += actualizadas
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} cita(s) vencida(s) pasada(s) a "{estado}".'
+        ))
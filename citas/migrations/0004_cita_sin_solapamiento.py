@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:15
+
+import citas.models
+import django.contrib.postgres.constraints
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0003_initial'),
+        ('doctores', '0002_initial'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        # Necesaria para combinar doctor (=) y rango (&&) en un índice GiST
+        BtreeGistExtension(),
+        migrations.AlterUniqueTogether(
+            name='cita',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('estado__in', ['pendiente', 'confirmada', 'en_curso'])), expressions=[(models.F('doctor'), '='), (citas.models.RangoCita(), '&&')], name='cita_sin_solapamiento'),
+        ),
+    ]
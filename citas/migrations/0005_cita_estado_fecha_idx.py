@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0004_cita_sin_solapamiento'),
+        ('doctores', '0002_initial'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0006_solicitudreserva'),
+        ('doctores', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('bloques', models.BinaryField(max_length=36)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacion', to='doctores.doctor')),
+            ],
+            options={
+                'verbose_name': 'Ocupación del Día',
+                'verbose_name_plural': 'Ocupación por Día',
+                'unique_together': {('doctor', 'fecha')},
+            },
+        ),
+    ]
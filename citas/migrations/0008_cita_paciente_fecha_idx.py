@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0007_ocupaciondia'),
+        ('doctores', '0002_initial'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['paciente', 'fecha', 'hora_inicio'], name='cita_paciente_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0008_cita_paciente_fecha_idx'),
+        ('doctores', '0003_especialidad_principal_duraciones'),
+        ('especialidades', '0001_initial'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_desde', models.DateField()),
+                ('fecha_hasta', models.DateField()),
+                ('tipo', models.CharField(choices=[('primera_vez', 'Primera Vez'), ('control', 'Control'), ('urgencia', 'Urgencia'), ('telemedicina', 'Telemedicina')], default='primera_vez', max_length=20)),
+                ('motivo', models.TextField()),
+                ('estado', models.CharField(choices=[('esperando', 'Esperando'), ('asignada', 'Cita Asignada'), ('cancelada', 'Cancelada'), ('vencida', 'Vencida')], default='esperando', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='citas.cita')),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='doctores.doctor')),
+                ('especialidad', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='especialidades.especialidad')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='pacientes.paciente')),
+            ],
+            options={
+                'verbose_name': 'Lista de Espera',
+                'verbose_name_plural': 'Lista de Espera',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('estado', 'esperando')), fields=['doctor', 'fecha_desde', 'fecha_hasta'], name='espera_doctor_idx'), models.Index(condition=models.Q(('estado', 'esperando')), fields=['especialidad', 'fecha_desde', 'fecha_hasta'], name='espera_especialidad_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('doctor__isnull', False), ('especialidad__isnull', False), _connector='OR'), name='espera_doctor_o_especialidad')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0009_listaespera'),
+        ('doctores', '0003_especialidad_principal_duraciones'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solicitudreserva',
+            name='datos',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='solicitudreserva',
+            name='estado',
+            field=models.CharField(choices=[('en_cola', 'En Cola'), ('procesando', 'Procesando'), ('completada', 'Completada'), ('rechazada', 'Rechazada')], default='procesando', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='solicitudreserva',
+            index=models.Index(condition=models.Q(('estado', 'en_cola')), fields=['doctor', 'id'], name='solicitud_en_cola_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:53
+
+import citas.models
+import django.contrib.postgres.constraints
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0010_solicitudreserva_cola'),
+        ('doctores', '0003_especialidad_principal_duraciones'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CupoGrupal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('tipo', models.CharField(choices=[('primera_vez', 'Primera Vez'), ('control', 'Control'), ('urgencia', 'Urgencia'), ('telemedicina', 'Telemedicina')], default='control', max_length=20)),
+                ('descripcion', models.CharField(max_length=200)),
+                ('capacidad', models.PositiveIntegerField()),
+                ('disponibles', models.PositiveIntegerField(default=0, editable=False)),
+                ('activo', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sesión Grupal',
+                'verbose_name_plural': 'Sesiones Grupales',
+                'ordering': ['fecha', 'hora_inicio'],
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='cita',
+            name='cita_sin_solapamiento',
+        ),
+        migrations.AddField(
+            model_name='cupogrupal',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cupos', to='doctores.doctor'),
+        ),
+        migrations.AddField(
+            model_name='cita',
+            name='cupo',
+            field=models.ForeignKey(blank=True, help_text='Sesión grupal a la que pertenece la cita', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='citas', to='citas.cupogrupal'),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('cupo__isnull', True), ('estado__in', ['pendiente', 'confirmada', 'en_curso'])), expressions=[(models.F('doctor'), '='), (citas.models.RangoCita(), '&&')], name='cita_sin_solapamiento'),
+        ),
+        migrations.AddIndex(
+            model_name='cupogrupal',
+            index=models.Index(fields=['doctor', 'fecha'], name='cupo_doctor_fecha_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cupogrupal',
+            constraint=models.CheckConstraint(condition=models.Q(('disponibles__lte', models.F('capacidad'))), name='cupo_disponibles_validos'),
+        ),
+        migrations.AddConstraint(
+            model_name='cupogrupal',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('activo', True)), expressions=[(models.F('doctor'), '='), (citas.models.RangoCita(), '&&')], name='cupo_sin_solapamiento'),
+        ),
+    ]
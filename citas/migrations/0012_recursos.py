@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:00
+
+import citas.models
+import django.contrib.postgres.constraints
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0011_cupogrupal'),
+        ('doctores', '0003_especialidad_principal_duraciones'),
+        ('horarios', '0004_recursos'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='recurso',
+            field=models.ForeignKey(blank=True, help_text='Consultorio o equipo del turno en que cae la cita (lo asigna clean)', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='citas', to='horarios.recurso'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['recurso', 'fecha', 'hora_inicio'], name='cita_recurso_fecha_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('cupo__isnull', True), ('estado__in', ['pendiente', 'confirmada', 'en_curso']), ('recurso__isnull', False)), expressions=[(models.F('recurso'), '='), (citas.models.RangoCita(), '&&')], name='cita_recurso_sin_solapamiento'),
+        ),
+    ]
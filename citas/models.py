@@ -1,9 +1,73 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Func, ExpressionWrapper, OuterRef, Subquery, Exists, Value
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from datetime import datetime, timedelta
 from pacientes.models import Paciente
 from doctores.models import Doctor
+from especialidades.models import Especialidad
+from horarios.models import Recurso
+from .signals import notificar_agenda, notificar_ocupacion, notificar_cancelacion
+
+# Estados que ocupan el horario del doctor
+ESTADOS_ACTIVOS = ['pendiente', 'confirmada', 'en_curso']
+
+
+class RangoCita(Func):
+    """Rango TSRANGE(fecha + hora_inicio, fecha + hora_fin) de una cita"""
+    function = 'TSRANGE'
+    output_field = DateTimeRangeField()
+
+    def __init__(self):
+        super().__init__(
+            ExpressionWrapper(F('fecha') + F('hora_inicio'), output_field=models.DateTimeField()),
+            ExpressionWrapper(F('fecha') + F('hora_fin'), output_field=models.DateTimeField()),
+        )
+
+
+class CitaQuerySet(models.QuerySet):
+    def transicionar(self, estado, **campos):
+        """
+        Pasa a `estado` todas las citas del queryset que lo permitan con un
+        solo UPDATE condicional. Devuelve cuántas citas cambiaron.
+        """
+        origenes = [
+            origen for origen, destinos in self.model.TRANSICIONES.items()
+            if estado in destinos
+        ]
+        citas = self.filter(estado__in=origenes)
+        
+        if estado in self.model.ESTADOS_ACTIVOS:
+            return citas.update(estado=estado, updated_at=timezone.now(), **campos)
+        
+        # Las citas que dejan de ocupar la agenda se bloquean antes del
+        # UPDATE para liberar exactamente sus horarios (no dispara post_save)
+        with transaction.atomic():
+            filas = list(citas.select_for_update().order_by().values_list(
+                'doctor_id', 'fecha', 'hora_inicio', 'hora_fin', 'paciente_id', 'cupo_id', 'recurso_id'
+            ))
+            # Las citas de sesiones grupales no ocupan la agenda: devuelven su lugar
+            individuales = [fila[:5] for fila in filas if fila[5] is None]
+            liberadas = [fila[:4] for fila in individuales]
+            actualizadas = citas.update(
+                estado=estado,
+                updated_at=timezone.now(),
+                **campos
+            )
+            if actualizadas:
+                notificar_ocupacion(liberadas=liberadas)
+                notificar_agenda(
+                    dias={(fila[0], fila[1]) for fila in filas},
+                    recursos={(fila[6], fila[1]) for fila in filas if fila[6]}
+                )
+                CupoGrupal.devolver_lugares(fila[5] for fila in filas if fila[5] is not None)
+                if estado == 'cancelada':
+                    notificar_cancelacion(individuales)
+        return actualizadas
+
 
 class Cita(models.Model):
     ESTADOS = [
@@ -15,6 +79,22 @@ class Cita(models.Model):
         ('no_asistio', 'No Asistió'),
     ]
     
+    ESTADOS_ACTIVOS = ESTADOS_ACTIVOS
+    
+    # Cambios de estado permitidos
+    TRANSICIONES = {
+        'pendiente': ['confirmada', 'en_curso', 'completada', 'cancelada', 'no_asistio'],
+        'confirmada': ['en_curso', 'completada', 'cancelada', 'no_asistio'],
+        'en_curso': ['completada'],
+        'completada': [],
+        'cancelada': [],
+        'no_asistio': [],
+    }
+    
+    # Campos que obligan a revalidar el horario de la cita (también la
+    # reactivación de una cita cancelada, ver requiere_validacion)
+    CAMPOS_AGENDA = {'doctor_id', 'paciente_id', 'tipo', 'fecha', 'hora_inicio', 'hora_fin', 'cupo_id', 'recurso_id'}
+    
     TIPOS = [
         ('primera_vez', 'Primera Vez'),
         ('control', 'Control'),
@@ -30,21 +110,123 @@ class Cita(models.Model):
     tipo = models.CharField(max_length=20, choices=TIPOS, default='primera_vez')
     estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
     motivo = models.TextField()
+    cupo = models.ForeignKey(
+        'CupoGrupal',
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+        related_name='citas',
+        help_text="Sesión grupal a la que pertenece la cita"
+    )
+    recurso = models.ForeignKey(
+        Recurso,
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+        related_name='citas',
+        help_text="Consultorio o equipo del turno en que cae la cita (lo asigna clean)"
+    )
     notas = models.TextField(blank=True, null=True)
     diagnostico = models.TextField(blank=True, null=True)
     tratamiento = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CitaQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
         ordering = ['-fecha', '-hora_inicio']
-        unique_together = ['doctor', 'fecha', 'hora_inicio']
+        indexes = [
+            # Conteo de citas abiertas y cierre nocturno de las vencidas
+            models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),
+            # Citas del paciente que se cruzan con una nueva (ver citas_solapadas_paciente)
+            models.Index(fields=['paciente', 'fecha', 'hora_inicio'], name='cita_paciente_fecha_idx'),
+            # Citas de otros doctores en el mismo consultorio o equipo (ver citas_solapadas_recurso)
+            models.Index(fields=['recurso', 'fecha', 'hora_inicio'], name='cita_recurso_fecha_idx'),
+        ]
+        constraints = [
+            # PostgreSQL rechaza dos citas activas del mismo doctor que se
+            # solapen; las de una sesión grupal comparten el horario del cupo
+            ExclusionConstraint(
+                name='cita_sin_solapamiento',
+                expressions=[
+                    (F('doctor'), RangeOperators.EQUAL),
+                    (RangoCita(), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(estado__in=ESTADOS_ACTIVOS, cupo__isnull=True),
+            ),
+            # Y dos citas activas que se solapen en el mismo consultorio o equipo
+            ExclusionConstraint(
+                name='cita_recurso_sin_solapamiento',
+                expressions=[
+                    (F('recurso'), RangeOperators.EQUAL),
+                    (RangoCita(), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(estado__in=ESTADOS_ACTIVOS, cupo__isnull=True, recurso__isnull=False),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Guarda los valores cargados para saber qué campos cambian"""
+        instance = super().from_db(db, field_names, values)
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
 
     def __str__(self):
         return f"Cita: {self.paciente.usuario.get_full_name()} con {self.doctor} - {self.fecha} {self.hora_inicio}"
     
+    @staticmethod
+    def tipos_solapamiento_paciente():
+        """Tipos de cita que pueden solaparse con otras del mismo paciente (p. ej. telemedicina)"""
+        return getattr(settings, 'CITAS_TIPOS_SOLAPAMIENTO_PACIENTE', [])
+    
+    def citas_solapadas_paciente(self):
+        """
+        Otras citas activas del paciente que se cruzan con esta. Usa el
+        índice (paciente, fecha, hora_inicio); las citas de los tipos que
+        pueden solaparse no cuentan.
+        """
+        permitidos = self.tipos_solapamiento_paciente()
+        if self.tipo in permitidos:
+            return Cita.objects.none()
+        return Cita.objects.filter(
+            paciente_id=self.paciente_id,
+            fecha=self.fecha,
+            hora_inicio__lt=self.hora_fin,
+            hora_fin__gt=self.hora_inicio,
+            estado__in=self.ESTADOS_ACTIVOS
+        ).exclude(pk=self.pk).exclude(tipo__in=permitidos)
+    
+    def cupos_solapados(self):
+        """Sesiones grupales activas del doctor que se cruzan con esta cita, salvo la suya"""
+        return CupoGrupal.objects.filter(
+            doctor_id=self.doctor_id,
+            fecha=self.fecha,
+            hora_inicio__lt=self.hora_fin,
+            hora_fin__gt=self.hora_inicio,
+            activo=True
+        ).exclude(pk=self.cupo_id)
+    
+    def citas_solapadas_recurso(self, recurso=None):
+        """
+        Citas activas de otros doctores en el recurso (por defecto el de la
+        cita) que se cruzan con esta. Usa el índice (recurso, fecha,
+        hora_inicio); las de su misma sesión grupal no cuentan.
+        """
+        citas = Cita.objects.filter(
+            recurso=self.recurso_id if recurso is None else recurso,
+            fecha=self.fecha,
+            hora_inicio__lt=self.hora_fin,
+            hora_fin__gt=self.hora_inicio,
+            estado__in=self.ESTADOS_ACTIVOS
+        ).exclude(pk=self.pk).exclude(doctor_id=self.doctor_id)
+        if self.cupo_id:
+            citas = citas.exclude(cupo_id=self.cupo_id)
+        return citas
+    
     def clean(self):
         """Validaciones personalizadas"""
         
@@ -61,66 +243,500 @@ class Cita(models.Model):
                     'hora_fin': 'La hora de fin debe ser posterior a la hora de inicio.'
                 })
         
-        # 3. Validar que no haya conflicto de horarios con el mismo doctor
-        if self.doctor and self.fecha and self.hora_inicio and self.hora_fin:
-            citas_conflicto = Cita.objects.filter(
-                doctor=self.doctor,
-                fecha=self.fecha,
-                estado__in=['pendiente', 'confirmada', 'en_curso']
-            ).exclude(pk=self.pk)  # Excluir la cita actual si es edición
-            
-            for cita in citas_conflicto:
-                # Verificar solapamiento de horarios
-                if (self.hora_inicio < cita.hora_fin and self.hora_fin > cita.hora_inicio):
-                    raise ValidationError({
-                        'hora_inicio': f'Ya existe una cita para este doctor el {self.fecha} de {cita.hora_inicio.strftime("%H:%M")} a {cita.hora_fin.strftime("%H:%M")}.'
-                    })
+        # 3. El conflicto con otras citas del doctor lo valida la base de datos
+        #    (restricción cita_sin_solapamiento) al guardar
         
         # 4. Validar que la cita sea en horario laboral del doctor
-        if self.doctor and self.fecha and self.hora_inicio:
+        if self.doctor_id and self.fecha and self.hora_inicio:
             dia_semana = self.fecha.weekday()  # 0=Lunes, 6=Domingo
             
             from horarios.models import Horario, Excepcion
+            from horarios.intervalos import IndiceHorario, cierres_por_doctor, separar_horarios
+            from horarios.reglas import CAMPOS_REGLA
             
-            # Verificar si el doctor trabaja ese día
-            horarios_dia = Horario.objects.filter(
-                doctor=self.doctor,
-                dia_semana=dia_semana,
+            # Horarios del día (semanales y con regla) y excepción vigente en una sola consulta
+            excepciones = Excepcion.objects.filter(
+                doctor=OuterRef('doctor'),
+                fecha_inicio__lte=self.fecha,
+                fecha_fin__gte=self.fecha
+            )
+            # El cruce con otras citas del paciente, con las sesiones grupales
+            # del doctor y con otras citas en el recurso de cada turno viaja
+            # en la misma consulta
+            if self.paciente_id and self.hora_fin:
+                paciente_ocupado = Exists(self.citas_solapadas_paciente())
+            else:
+                paciente_ocupado = Value(False)
+            if self.hora_fin:
+                cupo_ocupado = Exists(self.cupos_solapados())
+            else:
+                cupo_ocupado = Value(False)
+            if self.hora_fin:
+                recurso_ocupado = Exists(self.citas_solapadas_recurso(OuterRef('recurso')))
+            else:
+                recurso_ocupado = Value(False)
+            horarios_dia = list(Horario.objects.filter(
+                Q(dia_semana=dia_semana) | ~Q(regla=''),
+                doctor_id=self.doctor_id,
                 activo=True
+            ).annotate(
+                excepcion_motivo=Subquery(excepciones.values('motivo')[:1]),
+                paciente_ocupado=paciente_ocupado,
+                cupo_ocupado=cupo_ocupado,
+                recurso_ocupado=recurso_ocupado
+            ).values(*CAMPOS_REGLA, 'excepcion_motivo', 'paciente_ocupado', 'cupo_ocupado', 'recurso_ocupado'))
+            
+            excepcion_motivo = horarios_dia[0]['excepcion_motivo'] if horarios_dia else None
+            turnos, turnos_fecha = separar_horarios(horarios_dia, self.fecha, self.fecha)
+            horario = IndiceHorario(
+                turnos=turnos[self.doctor_id],
+                excepciones=[(self.fecha, self.fecha, excepcion_motivo)] if excepcion_motivo else [],
+                cierres=cierres_por_doctor([self.doctor_id], self.fecha, self.fecha)[self.doctor_id],
+                turnos_fecha=turnos_fecha[self.doctor_id]
             )
             
-            if not horarios_dia.exists():
+            # Verificar si el doctor trabaja ese día
+            if not horario.trabaja(self.fecha):
                 dias = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
                 raise ValidationError({
                     'fecha': f'El doctor no trabaja los {dias[dia_semana]}.'
                 })
             
             # Verificar que la hora esté dentro del horario laboral
-            horario_valido = False
-            for horario in horarios_dia:
-                if horario.hora_inicio <= self.hora_inicio < horario.hora_fin:
-                    horario_valido = True
-                    break
-            
-            if not horario_valido:
+            if not horario.en_turno(self.fecha, self.hora_inicio):
                 raise ValidationError({
                     'hora_inicio': 'La hora seleccionada está fuera del horario laboral del doctor.'
                 })
             
             # Verificar excepciones (vacaciones, bloqueos)
-            excepciones = Excepcion.objects.filter(
-                doctor=self.doctor,
-                fecha_inicio__lte=self.fecha,
-                fecha_fin__gte=self.fecha
-            )
+            if horario.excepcion(self.fecha):
+                raise ValidationError({
+                    'fecha': f'El doctor no está disponible en esta fecha ({dict(Excepcion.TIPOS)[excepcion_motivo]}).'
+                })
+            
+            # Verificar feriados y cierres de la clínica o la especialidad
+            cierre = horario.cierre(self.fecha)
+            if cierre:
+                raise ValidationError({
+                    'fecha': f'La clínica no atiende en esta fecha ({cierre}).'
+                })
+            
+            # 5. Validar que el paciente no tenga otra cita a la misma hora
+            if horarios_dia[0]['paciente_ocupado']:
+                raise self.error_solapamiento_paciente()
             
-            if excepciones.exists():
-                excepcion = excepciones.first()
+            # 6. Validar que el doctor no tenga una sesión grupal a esa hora
+            if horarios_dia[0]['cupo_ocupado']:
+                cupo = self.cupos_solapados().first()
                 raise ValidationError({
-                    'fecha': f'El doctor no está disponible en esta fecha ({excepcion.get_motivo_display()}).'
+                    'hora_inicio': f'El doctor tiene una sesión grupal el {self.fecha} de {cupo.hora_inicio.strftime("%H:%M")} a {cupo.hora_fin.strftime("%H:%M")}.'
                 })
+            
+            # 7. Validar que el consultorio o equipo del turno esté libre
+            self.recurso_id = horario.recurso(self.fecha, self.hora_inicio)
+            if self.recurso_id and any(
+                fila['recurso_id'] == self.recurso_id and fila['recurso_ocupado'] for fila in horarios_dia
+            ):
+                raise self.error_solapamiento_recurso()
+    
+    def error_solapamiento(self):
+        """Error de validación para una cita que choca con otra del mismo doctor"""
+        conflicto = Cita.objects.filter(
+            doctor_id=self.doctor_id,
+            fecha=self.fecha,
+            estado__in=self.ESTADOS_ACTIVOS,
+            hora_inicio__lt=self.hora_fin,
+            hora_fin__gt=self.hora_inicio
+        ).exclude(pk=self.pk).first()
+        
+        if conflicto is None:
+            return ValidationError({
+                'hora_inicio': f'Ya existe una cita para este doctor el {self.fecha} en ese horario.'
+            })
+        return ValidationError({
+            'hora_inicio': f'Ya existe una cita para este doctor el {self.fecha} de {conflicto.hora_inicio.strftime("%H:%M")} a {conflicto.hora_fin.strftime("%H:%M")}.'
+        })
+    
+    def error_solapamiento_recurso(self):
+        """Error de validación para una cita que choca con otra en su consultorio o equipo"""
+        conflicto = self.citas_solapadas_recurso().select_related('recurso').first()
+        if conflicto is None:
+            return ValidationError({
+                'hora_inicio': f'El consultorio o equipo del turno está ocupado el {self.fecha} en ese horario.'
+            })
+        return ValidationError({
+            'hora_inicio': f'{conflicto.recurso} está ocupado el {self.fecha} de {conflicto.hora_inicio.strftime("%H:%M")} a {conflicto.hora_fin.strftime("%H:%M")}.'
+        })
+    
+    def error_solapamiento_paciente(self):
+        """Error de validación para una cita que choca con otra del mismo paciente"""
+        conflicto = self.citas_solapadas_paciente().select_related('doctor__usuario').first()
+        if conflicto is None:
+            return ValidationError({
+                'hora_inicio': f'El paciente ya tiene otra cita el {self.fecha} en ese horario.'
+            })
+        return ValidationError({
+            'hora_inicio': f'El paciente ya tiene una cita con {conflicto.doctor} el {self.fecha} de {conflicto.hora_inicio.strftime("%H:%M")} a {conflicto.hora_fin.strftime("%H:%M")}.'
+        })
+    
+    def puede_transicionar(self, estado):
+        """Indica si la cita puede pasar de su estado actual a `estado`"""
+        return estado in self.TRANSICIONES.get(self.estado, [])
+    
+    def transicionar(self, estado, **campos):
+        """
+        Cambia el estado con un UPDATE condicionado al estado leído, de modo
+        que dos cambios simultáneos no se pisen. Devuelve True si se aplicó y
+        False si otra petición cambió la cita antes.
+        """
+        if not self.puede_transicionar(estado):
+            raise ValidationError({
+                'estado': f'No se puede pasar una cita de "{self.get_estado_display()}" a "{dict(self.ESTADOS)[estado]}".'
+            })
+        
+        ahora = timezone.now()
+        with transaction.atomic():
+            aplicada = Cita.objects.filter(pk=self.pk, estado=self.estado).update(
+                estado=estado,
+                updated_at=ahora,
+                **campos
+            ) == 1
+            if aplicada and self.estado in self.ESTADOS_ACTIVOS and estado not in self.ESTADOS_ACTIVOS:
+                notificar_agenda(
+                    dias=[(self.doctor_id, self.fecha)],
+                    recursos=[(self.recurso_id, self.fecha)] if self.recurso_id else []
+                )
+                if self.cupo_id:
+                    # Las citas de sesiones grupales no ocupan la agenda: devuelven su lugar
+                    CupoGrupal.devolver_lugares([self.cupo_id])
+                else:
+                    notificar_ocupacion(liberadas=[(self.doctor_id, self.fecha, self.hora_inicio, self.hora_fin)])
+                    if estado == 'cancelada':
+                        notificar_cancelacion([
+                            (self.doctor_id, self.fecha, self.hora_inicio, self.hora_fin, self.paciente_id)
+                        ])
+        
+        if aplicada:
+            self.estado = estado
+            self.updated_at = ahora
+            for campo, valor in campos.items():
+                setattr(self, campo, valor)
+            if hasattr(self, '_valores_originales'):
+                self._valores_originales.update(estado=estado, updated_at=ahora, **campos)
+        return aplicada
+    
+    def campos_modificados(self):
+        """Campos que cambiaron desde que se cargó la cita (None si es nueva)"""
+        originales = getattr(self, '_valores_originales', None)
+        if originales is None or self._state.adding:
+            return None
+        return {
+            campo for campo, valor in originales.items()
+            if getattr(self, campo) != valor
+        }
+    
+    def requiere_validacion(self, modificados):
+        """
+        Indica si hay que pasar por clean: cita nueva, cambio de horario,
+        sesión o recurso, o una cita inactiva que vuelve a un estado activo
+        """
+        if modificados is None or modificados & self.CAMPOS_AGENDA:
+            return True
+        return (
+            'estado' in modificados
+            and self.estado in self.ESTADOS_ACTIVOS
+            and self._valores_originales['estado'] not in self.ESTADOS_ACTIVOS
+        )
     
     def save(self, *args, **kwargs):
         """Ejecutar validaciones antes de guardar"""
-        self.clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        modificados = self.campos_modificados()
+        
+        if self.requiere_validacion(modificados):
+            self.clean()
+        elif 'update_fields' not in kwargs:
+            # Cambio de estado o notas: UPDATE solo de las columnas modificadas
+            if not modificados:
+                return
+            kwargs['update_fields'] = modificados | {'updated_at'}
+        
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as e:
+            if 'cita_recurso_sin_solapamiento' in str(e):
+                raise self.error_solapamiento_recurso()
+            if 'cita_sin_solapamiento' not in str(e):
+                raise
+            raise self.error_solapamiento()
+        
+        self._valores_originales = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+
+class CupoGrupal(models.Model):
+    """
+    Sesión grupal (vacunación, clases prenatales): un horario del doctor que
+    comparten hasta `capacidad` pacientes, cada uno con su cita.
+
+    La sesión ocupa la agenda del doctor; sus citas no. Los lugares libres
+    se llevan en `disponibles`, que se descuenta con un UPDATE condicional
+    al reservar (ver reservas.reservar_en_cupo) en vez de contar las citas.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='cupos')
+    fecha = models.DateField()
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    tipo = models.CharField(max_length=20, choices=Cita.TIPOS, default='control')
+    descripcion = models.CharField(max_length=200)
+    capacidad = models.PositiveIntegerField()
+    disponibles = models.PositiveIntegerField(default=0, editable=False)
+    activo = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Sesión Grupal"
+        verbose_name_plural = "Sesiones Grupales"
+        ordering = ['fecha', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['doctor', 'fecha'], name='cupo_doctor_fecha_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(disponibles__lte=F('capacidad')),
+                name='cupo_disponibles_validos'
+            ),
+            # PostgreSQL rechaza dos sesiones activas del mismo doctor que se solapen
+            ExclusionConstraint(
+                name='cupo_sin_solapamiento',
+                expressions=[
+                    (F('doctor'), RangeOperators.EQUAL),
+                    (RangoCita(), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(activo=True),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Guarda los valores cargados para saber si cambió el horario"""
+        instance = super().from_db(db, field_names, values)
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+
+    def __str__(self):
+        return f"{self.descripcion} - {self.fecha} {self.hora_inicio.strftime('%H:%M')}"
+    
+    @classmethod
+    def devolver_lugares(cls, cupo_ids):
+        """Devuelve un lugar por cada cita de sesión grupal que deja de estar activa"""
+        conteo = {}
+        for cupo_id in cupo_ids:
+            conteo[cupo_id] = conteo.get(cupo_id, 0) + 1
+        for cupo_id, lugares in conteo.items():
+            cls.objects.filter(pk=cupo_id).update(disponibles=F('disponibles') + lugares)
+    
+    @classmethod
+    def tomar_lugar(cls, cupo_id):
+        """
+        Descuenta un lugar de la sesión con un solo UPDATE condicional
+        (disponibles > 0), así nunca se entregan más lugares que la capacidad.
+        """
+        if not cls.objects.filter(pk=cupo_id, activo=True, disponibles__gt=0).update(
+            disponibles=F('disponibles') - 1
+        ):
+            raise ValidationError('No quedan lugares en esta sesión grupal.')
+    
+    def validar_inscritos(self):
+        """
+        Verifica que la sesión editada siga admitiendo a sus pacientes
+        inscritos (no se mueve, no se desactiva ni baja de capacidad por
+        debajo de ellos). Devuelve cuántos hay.
+        """
+        inscritos = self.citas.filter(estado__in=Cita.ESTADOS_ACTIVOS).count()
+        originales = getattr(self, '_valores_originales', {})
+        if inscritos and any(
+            campo in originales and getattr(self, campo) != originales[campo]
+            for campo in ('doctor_id', 'fecha', 'hora_inicio', 'hora_fin', 'activo')
+        ):
+            raise ValidationError('No se puede mover ni desactivar una sesión que ya tiene pacientes inscritos.')
+        if self.capacidad is not None and inscritos > self.capacidad:
+            raise ValidationError({
+                'capacidad': f'La sesión ya tiene {inscritos} pacientes inscritos.'
+            })
+        return inscritos
+    
+    def clean(self):
+        """Validaciones personalizadas"""
+        if self.capacidad is not None and self.capacidad < 1:
+            raise ValidationError({
+                'capacidad': 'La sesión debe admitir al menos un paciente.'
+            })
+        
+        if self.pk:
+            self.validar_inscritos()
+        
+        if not self.activo:
+            return
+        
+        # Mismas reglas de horario que una cita: fecha futura, horario laboral,
+        # excepciones, cierres y otras sesiones del doctor
+        Cita(
+            doctor_id=self.doctor_id,
+            fecha=self.fecha,
+            hora_inicio=self.hora_inicio,
+            hora_fin=self.hora_fin,
+            cupo_id=self.pk
+        ).clean()
+        
+        conflicto = Cita.objects.filter(
+            doctor_id=self.doctor_id,
+            fecha=self.fecha,
+            hora_inicio__lt=self.hora_fin,
+            hora_fin__gt=self.hora_inicio,
+            estado__in=Cita.ESTADOS_ACTIVOS,
+            cupo__isnull=True
+        ).first()
+        if conflicto:
+            raise ValidationError({
+                'hora_inicio': f'Ya existe una cita para este doctor el {self.fecha} de {conflicto.hora_inicio.strftime("%H:%M")} a {conflicto.hora_fin.strftime("%H:%M")}.'
+            })
+    
+    def save(self, *args, **kwargs):
+        """
+        Valida la sesión con la agenda del doctor bloqueada. Al crearla todos
+        los lugares quedan libres; al editarla se recalculan con la fila
+        bloqueada, así no se pisa con reservas en curso.
+        """
+        from .reservas import bloquear_agenda
+        
+        with transaction.atomic():
+            bloquear_agenda(self.doctor_id, self.fecha)
+            self.clean()
+            if self._state.adding:
+                self.disponibles = self.capacidad
+            else:
+                list(CupoGrupal.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+                self.disponibles = self.capacidad - self.validar_inscritos()
+            super().save(*args, **kwargs)
+        
+        self._valores_originales = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+
+class OcupacionDia(models.Model):
+    """Bloques de 5 minutos ocupados por citas activas de un doctor en un día (ver ocupacion.py)"""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='ocupacion')
+    fecha = models.DateField()
+    bloques = models.BinaryField(max_length=36)
+
+    class Meta:
+        verbose_name = "Ocupación del Día"
+        verbose_name_plural = "Ocupación por Día"
+        unique_together = ['doctor', 'fecha']
+
+    def __str__(self):
+        return f"{self.doctor} - {self.fecha}"
+
+
+class SolicitudReserva(models.Model):
+    """
+    Resultado de un envío del formulario de reserva, para responder igual a
+    los reintentos. En modo cola (ver cola.py) guarda además los datos del
+    formulario hasta que el consumidor del doctor la procese.
+    """
+    ESTADOS = [
+        ('en_cola', 'En Cola'),
+        ('procesando', 'Procesando'),
+        ('completada', 'Completada'),
+        ('rechazada', 'Rechazada'),
+    ]
+    
+    # Estados con resultado final: las demás solicitudes nunca se purgan
+    ESTADOS_RESUELTOS = ['completada', 'rechazada']
+    
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='solicitudes_reserva')
+    clave = models.CharField(max_length=64)
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='solicitudes_reserva')
+    cita = models.ForeignKey(Cita, on_delete=models.SET_NULL, blank=True, null=True, related_name='solicitudes')
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='procesando')
+    mensaje = models.TextField(blank=True)
+    datos = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Solicitud de Reserva"
+        verbose_name_plural = "Solicitudes de Reserva"
+        unique_together = ['usuario', 'clave']
+        indexes = [
+            # Cola de cada doctor en orden de llegada
+            models.Index(fields=['doctor', 'id'], condition=Q(estado='en_cola'), name='solicitud_en_cola_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.clave} - {self.get_estado_display()}"
+
+
+class ListaEspera(models.Model):
+    """Paciente que espera un horario con un doctor o con cualquiera de una especialidad (ver espera.py)"""
+    ESTADOS = [
+        ('esperando', 'Esperando'),
+        ('asignada', 'Cita Asignada'),
+        ('cancelada', 'Cancelada'),
+        ('vencida', 'Vencida'),
+    ]
+    
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='lista_espera')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, blank=True, null=True, related_name='lista_espera')
+    especialidad = models.ForeignKey(Especialidad, on_delete=models.CASCADE, blank=True, null=True, related_name='lista_espera')
+    fecha_desde = models.DateField()
+    fecha_hasta = models.DateField()
+    tipo = models.CharField(max_length=20, choices=Cita.TIPOS, default='primera_vez')
+    motivo = models.TextField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='esperando')
+    cita = models.ForeignKey(Cita, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Lista de Espera"
+        verbose_name_plural = "Lista de Espera"
+        ordering = ['created_at']
+        indexes = [
+            # Búsqueda de quién espera el horario que se liberó (solo las entradas vigentes)
+            models.Index(
+                fields=['doctor', 'fecha_desde', 'fecha_hasta'],
+                condition=Q(estado='esperando'),
+                name='espera_doctor_idx'
+            ),
+            models.Index(
+                fields=['especialidad', 'fecha_desde', 'fecha_hasta'],
+                condition=Q(estado='esperando'),
+                name='espera_especialidad_idx'
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(doctor__isnull=False) | Q(especialidad__isnull=False),
+                name='espera_doctor_o_especialidad'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.paciente} - {self.doctor or self.especialidad} ({self.fecha_desde} a {self.fecha_hasta})"
+    
+    def clean(self):
+        """Validaciones personalizadas"""
+        if self.fecha_desde and self.fecha_hasta and self.fecha_hasta < self.fecha_desde:
+            raise ValidationError({
+                'fecha_hasta': 'La fecha final debe ser posterior a la inicial.'
+            })
+        if self.estado == 'esperando' and self.fecha_hasta and self.fecha_hasta < timezone.now().date():
+            raise ValidationError({
+                'fecha_hasta': 'No se puede esperar un horario en fechas pasadas.'
+            })
@@ -0,0 +1,190 @@
+"""
+Ocupación de la agenda en mapas de bits: un bit por bloque de 5 minutos,
+288 bits (36 bytes) por doctor y día.
+
+Cada fila de OcupacionDia guarda los bloques ocupados por citas activas y
+se actualiza dentro de la misma transacción que crea, cancela o mueve la
+cita, con la fila bloqueada, así nunca queda desfasada. Las horas que no
+caen justo en un bloque se redondean hacia afuera al ocupar.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.db import transaction, IntegrityError
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Cita, CupoGrupal, OcupacionDia
+from .signals import ocupacion_modificada
+
+BLOQUE = 5
+BLOQUES_DIA = 24 * 60 // BLOQUE
+BYTES_DIA = BLOQUES_DIA // 8
+
+
+def mascara(inicio, fin, exterior=True):
+    """
+    Bits de los bloques entre dos minutos del día. Con exterior=True incluye
+    los bloques tocados en parte (ocupación); si no, solo los completos
+    (horario laboral).
+    """
+    if exterior:
+        primero, ultimo = inicio // BLOQUE, -(-fin // BLOQUE)
+    else:
+        primero, ultimo = -(-inicio // BLOQUE), fin // BLOQUE
+    if ultimo <= primero:
+        return 0
+    return ((1 << (ultimo - primero)) - 1) << primero
+
+
+def mascara_horas(hora_inicio, hora_fin):
+    """Bits ocupados por una cita de hora_inicio a hora_fin"""
+    return mascara(
+        hora_inicio.hour * 60 + hora_inicio.minute,
+        hora_fin.hour * 60 + hora_fin.minute
+    )
+
+
+def intervalos(bitmap):
+    """Tramos seguidos de bits en 1 como [(inicio, fin), ...] en minutos"""
+    tramos = []
+    while bitmap:
+        primero = (bitmap & -bitmap).bit_length() - 1
+        desplazado = bitmap >> primero
+        largo = (desplazado ^ (desplazado + 1)).bit_length() - 1
+        tramos.append((primero * BLOQUE, (primero + largo) * BLOQUE))
+        bitmap &= ~(((1 << largo) - 1) << primero)
+    return tramos
+
+
+def a_bytes(bitmap):
+    """Bitmap del día como los 36 bytes que se guardan"""
+    return bitmap.to_bytes(BYTES_DIA, 'little')
+
+
+def de_bytes(datos):
+    """Bitmap del día a partir de los bytes guardados"""
+    return int.from_bytes(bytes(datos), 'little')
+
+
+def _alineado(hora):
+    """Indica si la hora cae justo al inicio de un bloque"""
+    return hora.minute % BLOQUE == 0 and hora.second == 0
+
+
+def _calcular(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Bits ocupados por las citas activas y las sesiones grupales activas
+    (sus citas no cuentan aparte): {(doctor_id, fecha): bitmap}
+    """
+    ocupados = defaultdict(int)
+    citas = Cita.objects.filter(
+        doctor_id__in=doctor_ids,
+        fecha__range=[fecha_inicio, fecha_fin],
+        estado__in=Cita.ESTADOS_ACTIVOS,
+        cupo__isnull=True
+    ).order_by().values_list('doctor_id', 'fecha', 'hora_inicio', 'hora_fin')
+    cupos = CupoGrupal.objects.filter(
+        doctor_id__in=doctor_ids,
+        fecha__range=[fecha_inicio, fecha_fin],
+        activo=True
+    ).order_by().values_list('doctor_id', 'fecha', 'hora_inicio', 'hora_fin')
+    for doctor_id, fecha, hora_inicio, hora_fin in citas.union(cupos, all=True):
+        ocupados[(doctor_id, fecha)] |= mascara_horas(hora_inicio, hora_fin)
+    return ocupados
+
+
+def ocupacion_por_doctor(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Bits ocupados de cada doctor y día entre las dos fechas:
+    {doctor_id: {fecha: bitmap}}.
+
+    Los días sin fila se calculan desde las citas y se guardan; si otra
+    transacción ya creó la fila, la suya es la que queda.
+    """
+    ocupacion = {doctor_id: {} for doctor_id in doctor_ids}
+    for doctor_id, fecha, bloques in OcupacionDia.objects.filter(
+        doctor_id__in=doctor_ids,
+        fecha__range=[fecha_inicio, fecha_fin]
+    ).values_list('doctor_id', 'fecha', 'bloques'):
+        ocupacion[doctor_id][fecha] = de_bytes(bloques)
+
+    dias = (fecha_fin - fecha_inicio).days + 1
+    if sum(len(fechas) for fechas in ocupacion.values()) < len(doctor_ids) * dias:
+        calculados = _calcular(doctor_ids, fecha_inicio, fecha_fin)
+        nuevas = []
+        for doctor_id, fechas in ocupacion.items():
+            for i in range(dias):
+                fecha = fecha_inicio + timedelta(days=i)
+                if fecha not in fechas:
+                    fechas[fecha] = calculados[(doctor_id, fecha)]
+                    nuevas.append(OcupacionDia(doctor_id=doctor_id, fecha=fecha, bloques=a_bytes(fechas[fecha])))
+        OcupacionDia.objects.bulk_create(nuevas, ignore_conflicts=True)
+
+    return ocupacion
+
+
+def ocupacion_recursos(recurso_ids, fecha_inicio, fecha_fin):
+    """
+    Bits ocupados de cada consultorio o equipo por las citas activas de
+    cualquier doctor entre las dos fechas: {(recurso_id, fecha): bitmap}.
+    Se calcula desde las citas con el índice (recurso, fecha, hora_inicio).
+    """
+    ocupados = defaultdict(int)
+    if not recurso_ids:
+        return ocupados
+    for recurso_id, fecha, hora_inicio, hora_fin in Cita.objects.filter(
+        recurso_id__in=recurso_ids,
+        fecha__range=[fecha_inicio, fecha_fin],
+        estado__in=Cita.ESTADOS_ACTIVOS
+    ).order_by().values_list('recurso_id', 'fecha', 'hora_inicio', 'hora_fin'):
+        ocupados[(recurso_id, fecha)] |= mascara_horas(hora_inicio, hora_fin)
+    return ocupados
+
+
+def _fila_bloqueada(doctor_id, fecha):
+    """Fila de ocupación del día bloqueada hasta el final de la transacción"""
+    fila = OcupacionDia.objects.select_for_update().filter(doctor_id=doctor_id, fecha=fecha).first()
+    if fila is None:
+        try:
+            with transaction.atomic():
+                fila = OcupacionDia.objects.create(
+                    doctor_id=doctor_id,
+                    fecha=fecha,
+                    bloques=a_bytes(_calcular([doctor_id], fecha, fecha)[(doctor_id, fecha)])
+                )
+        except IntegrityError:
+            # Otra transacción la creó a la vez
+            fila = OcupacionDia.objects.select_for_update().get(doctor_id=doctor_id, fecha=fecha)
+    return fila
+
+
+@receiver(ocupacion_modificada)
+def actualizar_ocupacion(sender, ocupadas, liberadas, **kwargs):
+    """
+    Marca y libera los bloques de las citas en las filas de sus días. Los
+    días pasados se ignoran: ya no se ofrecen y purgar_ocupacion borra sus
+    filas (así el cierre nocturno de citas vencidas no las bloquea ni las
+    vuelve a crear).
+    """
+    hoy = timezone.now().date()
+    cambios = defaultdict(lambda: ([], []))
+    for doctor_id, fecha, hora_inicio, hora_fin in ocupadas:
+        if fecha >= hoy:
+            cambios[(doctor_id, fecha)][0].append((hora_inicio, hora_fin))
+    for doctor_id, fecha, hora_inicio, hora_fin in liberadas:
+        if fecha >= hoy:
+            cambios[(doctor_id, fecha)][1].append((hora_inicio, hora_fin))
+
+    # Filas en orden fijo para no provocar deadlocks entre transacciones
+    for (doctor_id, fecha), (nuevas, quitadas) in sorted(cambios.items()):
+        fila = _fila_bloqueada(doctor_id, fecha)
+        if all(_alineado(inicio) and _alineado(fin) for inicio, fin in quitadas):
+            bitmap = de_bytes(fila.bloques)
+            for hora_inicio, hora_fin in quitadas:
+                bitmap &= ~mascara_horas(hora_inicio, hora_fin)
+        else:
+            # Un bloque partido puede ser compartido con otra cita: se recalcula
+            bitmap = _calcular([doctor_id], fecha, fecha)[(doctor_id, fecha)]
+        for hora_inicio, hora_fin in nuevas:
+            bitmap |= mascara_horas(hora_inicio, hora_fin)
+        fila.bloques = a_bytes(bitmap)
+        fila.save(update_fields=['bloques'])
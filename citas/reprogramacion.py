@@ -0,0 +1,170 @@
+"""Reprogramación en bloque de las citas que quedan dentro de una excepción del doctor"""
+import hashlib
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from doctores.models import Doctor
+from .models import Cita
+from .disponibilidad import libres_por_doctor, iterar_slots, a_minutos
+from .ocupacion import mascara
+from .reservas import bloquear_agenda, bloquear_paciente
+from .retenciones import retenido_por_otro
+
+# Días en los que se buscan horarios alternativos
+DIAS_REPROGRAMACION = 30
+
+# Cita afectada y el horario propuesto (doctor, fecha, hora_inicio, hora_fin), o None
+Propuesta = namedtuple('Propuesta', ['cita', 'doctor', 'fecha', 'hora_inicio', 'hora_fin'])
+
+
+def citas_afectadas(doctor, fecha_inicio, fecha_fin):
+    """
+    Citas activas del doctor entre las dos fechas (una sola consulta). Las
+    de sesiones grupales quedan fuera: la sesión se gestiona aparte.
+    """
+    return Cita.objects.filter(
+        doctor=doctor,
+        fecha__range=[fecha_inicio, fecha_fin],
+        estado__in=Cita.ESTADOS_ACTIVOS,
+        cupo__isnull=True
+    ).select_related('paciente__usuario').order_by('fecha', 'hora_inicio')
+
+
+def doctores_equivalentes(doctor):
+    """El doctor y los demás doctores activos que comparten alguna especialidad con él"""
+    otros = Doctor.objects.filter(
+        activo=True,
+        especialidades__in=doctor.especialidades.all()
+    ).exclude(pk=doctor.pk).select_related('usuario').distinct().order_by('pk')
+    return [doctor, *otros]
+
+
+def _duracion(cita):
+    """Duración de la cita en minutos"""
+    return a_minutos(cita.hora_fin) - a_minutos(cita.hora_inicio)
+
+
+def _citas_pacientes(citas, desde, hasta):
+    """
+    Horarios ocupados por otras citas de los pacientes afectados, para no
+    proponerles horarios que se crucen: {(paciente_id, fecha): [(inicio, fin), ...]}.
+    """
+    ocupados = defaultdict(list)
+    for paciente_id, fecha, inicio, fin in Cita.objects.filter(
+        paciente_id__in={cita.paciente_id for cita in citas},
+        fecha__range=[desde, hasta],
+        estado__in=Cita.ESTADOS_ACTIVOS
+    ).exclude(
+        pk__in=[cita.pk for cita in citas]
+    ).exclude(
+        tipo__in=Cita.tipos_solapamiento_paciente()
+    ).order_by().values_list('paciente_id', 'fecha', 'hora_inicio', 'hora_fin'):
+        ocupados[(paciente_id, fecha)].append((inicio, fin))
+    return ocupados
+
+
+def proponer_reprogramacion(doctor, citas, desde=None, dias=DIAS_REPROGRAMACION):
+    """
+    Busca un horario alternativo para cada cita con el mismo doctor o uno
+    equivalente, en una sola pasada sobre la disponibilidad.
+
+    Los horarios libres de todos los candidatos y las demás citas de los
+    pacientes se leen una vez; cada cita toma el primer horario libre que
+    no se cruce con otra de su paciente (a igual hora, su mismo doctor
+    primero) y ese horario se marca ocupado en memoria para las siguientes.
+    Devuelve [Propuesta, ...] en el orden de las citas.
+    """
+    desde = max(desde or timezone.now().date(), timezone.now().date())
+    hasta = desde + timedelta(days=dias)
+    candidatos = doctores_equivalentes(doctor)
+    libres = libres_por_doctor([candidato.pk for candidato in candidatos], desde, hasta)
+    orden = {candidato.pk: posicion for posicion, candidato in enumerate(candidatos)}
+    ocupados_paciente = _citas_pacientes(citas, desde, hasta)
+    permitidos = Cita.tipos_solapamiento_paciente()
+
+    propuestas = []
+    for cita in citas:
+        duracion = _duracion(cita)
+        mejor = None
+        for candidato in candidatos:
+            for fecha, hora_inicio, hora_fin in iterar_slots(libres[candidato.pk], desde, hasta, duracion):
+                if cita.tipo not in permitidos and any(
+                    inicio < hora_fin and fin > hora_inicio
+                    for inicio, fin in ocupados_paciente[(cita.paciente_id, fecha)]
+                ):
+                    continue
+                if retenido_por_otro(candidato.pk, fecha, hora_inicio, hora_fin, cita.paciente.usuario_id):
+                    continue
+                clave = (fecha, hora_inicio, orden[candidato.pk])
+                if mejor is None or clave < mejor[0]:
+                    mejor = (clave, Propuesta(cita, candidato, fecha, hora_inicio, hora_fin))
+                break
+
+        if mejor is None:
+            propuestas.append(Propuesta(cita, None, None, None, None))
+            continue
+
+        propuesta = mejor[1]
+        libres[propuesta.doctor.pk][propuesta.fecha] &= ~mascara(
+            a_minutos(propuesta.hora_inicio),
+            a_minutos(propuesta.hora_fin)
+        )
+        if cita.tipo not in permitidos:
+            ocupados_paciente[(cita.paciente_id, propuesta.fecha)].append((propuesta.hora_inicio, propuesta.hora_fin))
+        propuestas.append(propuesta)
+    return propuestas
+
+
+def firma_propuestas(propuestas):
+    """
+    Firma de los horarios propuestos, para comprobar al aplicarlos que son
+    los mismos que el usuario vio y confirmó
+    """
+    datos = repr([
+        (propuesta.cita.pk, propuesta.doctor and propuesta.doctor.pk, propuesta.fecha, propuesta.hora_inicio)
+        for propuesta in propuestas
+    ])
+    return hashlib.md5(datos.encode()).hexdigest()
+
+
+def aplicar_reprogramacion(propuestas):
+    """
+    Mueve las citas a los horarios propuestos en una sola transacción.
+
+    Se bloquean de una vez las agendas de destino y después los pacientes
+    en cada fecha de destino (el mismo orden que reservar_cita), y cada
+    cita se guarda en su propio savepoint: si otra reserva ganó un horario, esa cita queda
+    sin mover y el resto sigue. Devuelve (movidas, fallidas) con
+    fallidas = [(cita, mensaje), ...].
+    """
+    movidas, fallidas = [], []
+    con_destino = [propuesta for propuesta in propuestas if propuesta.doctor]
+    fallidas.extend(
+        (propuesta.cita, 'No hay horarios libres con doctores equivalentes.')
+        for propuesta in propuestas if not propuesta.doctor
+    )
+
+    with transaction.atomic():
+        # Bloqueos en orden fijo para no provocar deadlocks
+        for doctor_id, fecha in sorted({(p.doctor.pk, p.fecha) for p in con_destino}):
+            bloquear_agenda(doctor_id, fecha)
+        for paciente_id, fecha in sorted({(p.cita.paciente_id, p.fecha) for p in con_destino}):
+            bloquear_paciente(paciente_id, fecha)
+
+        for propuesta in con_destino:
+            cita = propuesta.cita
+            cita.doctor = propuesta.doctor
+            cita.fecha = propuesta.fecha
+            cita.hora_inicio = propuesta.hora_inicio
+            cita.hora_fin = propuesta.hora_fin
+            try:
+                with transaction.atomic():
+                    cita.save()
+                movidas.append(cita)
+            except ValidationError as e:
+                cita.refresh_from_db()
+                fallidas.append((cita, ' '.join(e.messages)))
+
+    return movidas, fallidas
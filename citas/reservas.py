@@ -0,0 +1,365 @@
+"""Reserva de citas serializada por doctor y día"""
+from datetime import datetime, timedelta
+from dateutil.rrule import rrule, WEEKLY, MONTHLY
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+from doctores.models import Doctor
+from pacientes.models import Paciente
+from horarios.models import Recurso
+from horarios.intervalos import cargar_indices
+from .models import Cita, CupoGrupal, SolicitudReserva
+from .disponibilidad import (
+    calcular_hora_fin, duracion_cita_doctor, libres_por_doctor, iterar_slots, verificar_slot,
+)
+from .conflictos import IndiceConflictos
+from .carga import carga_doctores
+from .retenciones import retenido_por_otro, liberar_slot
+from .signals import notificar_agenda, notificar_ocupacion
+
+# Frecuencias de las series de citas: (frecuencia rrule, intervalo)
+FRECUENCIAS = {
+    'semanal': (WEEKLY, 1),
+    'quincenal': (WEEKLY, 2),
+    'mensual': (MONTHLY, 1),
+}
+MAX_REPETICIONES = 12
+# Campos del formulario de reserva (se guardan con las solicitudes en cola)
+CAMPOS_FORMULARIO = ['fecha', 'hora_inicio', 'tipo', 'motivo', 'frecuencia', 'repeticiones']
+# Horarios que se prueban al asignar doctor automáticamente antes de rendirse
+MAX_INTENTOS_AUTOMATICOS = 5
+# Días que abarca como máximo la búsqueda de la asignación automática
+HORIZONTE_AUTOMATICO = 60
+
+
+def bloquear_agenda(doctor_id, fecha):
+    """
+    Bloquea la agenda del doctor en esa fecha hasta el final de la transacción.
+
+    En PostgreSQL usa un advisory lock (doctor, día), así solo esperan las
+    reservas del mismo doctor el mismo día y el resto sigue en paralelo.
+    En otros motores se bloquea la fila del doctor.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, %s)',
+                [doctor_id % 2147483647, fecha.toordinal()]
+            )
+    else:
+        list(Doctor.objects.select_for_update().filter(pk=doctor_id).values_list('pk'))
+
+
+def bloquear_paciente(paciente_id, fecha):
+    """
+    Bloquea las reservas del paciente en esa fecha hasta el final de la
+    transacción, para que dos reservas con doctores distintos no se crucen.
+    En PostgreSQL usa un advisory lock de una sola clave (su espacio no se
+    mezcla con el de dos claves de bloquear_agenda).
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s)',
+                [(paciente_id << 20) | fecha.toordinal()]
+            )
+    else:
+        list(Paciente.objects.select_for_update().filter(pk=paciente_id).values_list('pk'))
+
+
+def bloquear_recurso(recurso_id, fecha):
+    """
+    Bloquea las reservas en serie del consultorio o equipo esa fecha hasta
+    el final de la transacción. En PostgreSQL usa un advisory lock de dos
+    claves con el recurso en negativo, fuera del espacio (doctor, día) de
+    bloquear_agenda. En otros motores se bloquea la fila del recurso.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, %s)',
+                [-(recurso_id % 2147483647), fecha.toordinal()]
+            )
+    else:
+        list(Recurso.objects.select_for_update().filter(pk=recurso_id).values_list('pk'))
+
+
+def _insertar_serie(citas, conflictos):
+    """
+    Inserta las citas de una serie con un solo bulk_create. Si una reserva
+    individual tomó a la vez el recurso de alguna (restricción
+    cita_recurso_sin_solapamiento), se insertan una a una y las que chocan
+    pasan a conflictos. Devuelve las citas insertadas.
+    """
+    try:
+        with transaction.atomic():
+            return Cita.objects.bulk_create(citas)
+    except IntegrityError as e:
+        if 'cita_recurso_sin_solapamiento' not in str(e):
+            raise
+
+    insertadas = []
+    for cita in citas:
+        try:
+            with transaction.atomic():
+                Cita.objects.bulk_create([cita])
+            insertadas.append(cita)
+        except IntegrityError as e:
+            if 'cita_recurso_sin_solapamiento' not in str(e):
+                raise
+            conflictos.append((cita.fecha, ' '.join(cita.error_solapamiento_recurso().messages)))
+    conflictos.sort(key=lambda conflicto: conflicto[0])
+    return insertadas
+
+
+def reservar_cita(paciente, doctor, fecha, hora_inicio, tipo, motivo, duracion=None):
+    """Valida y crea una cita pendiente con la agenda del doctor bloqueada"""
+    if duracion is None:
+        duracion = duracion_cita_doctor(doctor, tipo)
+    hora_fin = calcular_hora_fin(fecha, hora_inicio, duracion)
+    if retenido_por_otro(doctor.pk, fecha, hora_inicio, hora_fin, paciente.usuario_id):
+        raise ValidationError({
+            'hora_inicio': 'Otro paciente está reservando este horario. Por favor elige otro.'
+        })
+    
+    cita = Cita(
+        paciente=paciente,
+        doctor=doctor,
+        fecha=fecha,
+        hora_inicio=hora_inicio,
+        hora_fin=hora_fin,
+        tipo=tipo,
+        motivo=motivo,
+        estado='pendiente'
+    )
+
+    with transaction.atomic():
+        bloquear_agenda(doctor.pk, fecha)
+        bloquear_paciente(paciente.pk, fecha)
+        cita.save()
+
+    # La retención del paciente se convierte en la cita
+    liberar_slot(doctor.pk, fecha, paciente.usuario_id)
+    return cita
+
+
+def reservar_en_cupo(paciente, cupo, motivo):
+    """
+    Reserva un lugar en una sesión grupal.
+
+    El lugar se descuenta con un solo UPDATE condicional (disponibles > 0):
+    la base serializa las reservas simultáneas sobre la fila del cupo y
+    nunca entrega más lugares que la capacidad. Si la cita no es válida
+    (p. ej. el paciente tiene otra a esa hora) el descuento se deshace.
+    """
+    with transaction.atomic():
+        bloquear_paciente(paciente.pk, cupo.fecha)
+        CupoGrupal.tomar_lugar(cupo.pk)
+        cita = Cita(
+            paciente=paciente,
+            doctor_id=cupo.doctor_id,
+            fecha=cupo.fecha,
+            hora_inicio=cupo.hora_inicio,
+            hora_fin=cupo.hora_fin,
+            tipo=cupo.tipo,
+            motivo=motivo,
+            cupo=cupo,
+            estado='pendiente'
+        )
+        cita.save()
+    return cita
+
+
+def fechas_recurrentes(fecha_inicio, frecuencia, repeticiones):
+    """Fechas de una serie de citas según la frecuencia (semanal, quincenal, mensual)"""
+    freq, intervalo = FRECUENCIAS[frecuencia]
+    repeticiones = max(1, min(repeticiones, MAX_REPETICIONES))
+    return [
+        ocurrencia.date()
+        for ocurrencia in rrule(freq, dtstart=fecha_inicio, interval=intervalo, count=repeticiones)
+    ]
+
+
+def reservar_serie(paciente, doctor, fechas, hora_inicio, tipo, motivo):
+    """
+    Agenda la misma hora en varias fechas (p. ej. controles semanales) en
+    una sola transacción.
+
+    Todas las fechas se validan contra una única carga del horario del
+    doctor y de las citas que pueden chocar (del doctor, del paciente y en
+    el consultorio o equipo de cada turno, ver conflictos.py), y las
+    válidas se insertan con un solo bulk_create. Devuelve
+    (citas_creadas, conflictos) con conflictos = [(fecha, mensaje), ...].
+    """
+    fechas = sorted(set(fechas))
+    creadas, conflictos = [], []
+    if not fechas:
+        return creadas, conflictos
+
+    duracion = duracion_cita_doctor(doctor, tipo)
+
+    with transaction.atomic():
+        # Bloqueos en orden de fecha para no provocar deadlocks entre series
+        for fecha in fechas:
+            bloquear_agenda(doctor.pk, fecha)
+        for fecha in fechas:
+            bloquear_paciente(paciente.pk, fecha)
+
+        horario = cargar_indices([doctor.pk], fechas[0], fechas[-1])[doctor.pk]
+        recursos = {fecha: horario.recurso(fecha, hora_inicio) for fecha in fechas}
+        # Dos series de doctores distintos en el mismo recurso se esperan
+        for recurso_id, fecha in sorted((recurso_id, fecha) for fecha, recurso_id in recursos.items() if recurso_id):
+            bloquear_recurso(recurso_id, fecha)
+        # El paciente no cuenta si el tipo de cita puede solaparse con otras suyas
+        paciente_id = None if tipo in Cita.tipos_solapamiento_paciente() else paciente.pk
+        ocupados = IndiceConflictos.cargar(
+            fechas,
+            doctor_ids=[doctor.pk],
+            paciente_ids=[paciente_id] if paciente_id else [],
+            recurso_ids=set(recursos.values()) - {None}
+        )
+
+        for fecha in fechas:
+            hora_fin = calcular_hora_fin(fecha, hora_inicio, duracion)
+            error = verificar_slot(horario, fecha, hora_inicio, hora_fin)
+            if error is None and retenido_por_otro(doctor.pk, fecha, hora_inicio, hora_fin, paciente.usuario_id):
+                error = 'Otro paciente está reservando este horario.'
+            if error is None:
+                error = ocupados.conflicto(fecha, hora_inicio, hora_fin, doctor.pk, paciente_id, recursos[fecha])
+            if error:
+                conflictos.append((fecha, error))
+                continue
+            ocupados.agregar(fecha, hora_inicio, hora_fin, doctor.pk, paciente_id, recursos[fecha])
+            creadas.append(Cita(
+                paciente=paciente,
+                doctor=doctor,
+                fecha=fecha,
+                hora_inicio=hora_inicio,
+                hora_fin=hora_fin,
+                tipo=tipo,
+                motivo=motivo,
+                recurso_id=recursos[fecha],
+                estado='pendiente'
+            ))
+
+        creadas = _insertar_serie(creadas, conflictos)
+        # bulk_create no dispara post_save
+        notificar_ocupacion(ocupadas=[
+            (doctor.pk, cita.fecha, cita.hora_inicio, cita.hora_fin) for cita in creadas
+        ])
+        notificar_agenda(
+            altas=[(doctor.pk, cita.fecha) for cita in creadas],
+            recursos=[(cita.recurso_id, cita.fecha) for cita in creadas if cita.recurso_id]
+        )
+
+    return creadas, conflictos
+
+
+def reservar_desde_formulario(paciente, doctor, datos):
+    """
+    Agenda la cita, o la serie si se eligió una frecuencia, pedida en el
+    formulario de reserva (`datos` con CAMPOS_FORMULARIO como texto).
+
+    Devuelve (mensaje, cita, avisos) con los conflictos de la serie en
+    avisos. Lanza ValidationError si no se pudo agendar ninguna cita.
+    """
+    fecha = datos.get('fecha')
+    hora_inicio = datos.get('hora_inicio')
+    tipo = datos.get('tipo') or 'primera_vez'
+    motivo = datos.get('motivo')
+    
+    # Convertir a objetos de fecha y hora
+    fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
+    hora_inicio_obj = datetime.strptime(hora_inicio, '%H:%M').time()
+    
+    # Serie de citas recurrentes (controles)
+    frecuencia = datos.get('frecuencia')
+    if frecuencia in FRECUENCIAS:
+        repeticiones = int(datos.get('repeticiones') or 1)
+        fechas = fechas_recurrentes(fecha_obj, frecuencia, repeticiones)
+        creadas, conflictos = reservar_serie(paciente, doctor, fechas, hora_inicio_obj, tipo, motivo)
+        
+        avisos = [f'{fecha_conflicto.strftime("%d/%m/%Y")}: {error}' for fecha_conflicto, error in conflictos]
+        if not creadas:
+            raise ValidationError([*avisos, 'No se pudo agendar ninguna cita de la serie.'])
+        
+        mensaje = f'¡Se agendaron {len(creadas)} citas a las {hora_inicio} a partir del {fecha}!'
+        return mensaje, creadas[0], avisos
+    
+    # Crear la cita con la agenda del doctor bloqueada para ese día
+    # (se ejecutarán las validaciones automáticamente)
+    cita = reservar_cita(paciente, doctor, fecha_obj, hora_inicio_obj, tipo, motivo)
+    return f'¡Cita agendada exitosamente para el {fecha} a las {hora_inicio}!', cita, []
+
+
+def reservar_automatica(paciente, especialidad, fecha_inicio, fecha_fin, tipo, motivo):
+    """
+    Agenda con el doctor de la especialidad que tenga menos citas en el
+    rango y un horario libre, en el primer horario libre que tenga.
+
+    La carga de cada doctor sale de los contadores en caché (ver carga.py)
+    y los horarios libres de la caché de disponibilidad.
+    """
+    doctores = list(Doctor.objects.filter(
+        activo=True,
+        especialidades=especialidad
+    ).select_related('usuario', 'especialidad_principal'))
+    doctor_ids = [doctor.pk for doctor in doctores]
+    
+    cargas = carga_doctores(doctor_ids, fecha_inicio, fecha_fin)
+    libres = libres_por_doctor(doctor_ids, fecha_inicio, fecha_fin)
+    doctores.sort(key=lambda doctor: (cargas[doctor.pk], doctor.pk))
+    
+    intentos = 0
+    for doctor in doctores:
+        # La misma duración que valida reservar_cita para ese doctor y tipo
+        duracion = duracion_cita_doctor(doctor, tipo)
+        for fecha, hora_inicio, hora_fin in iterar_slots(libres[doctor.pk], fecha_inicio, fecha_fin, duracion):
+            if retenido_por_otro(doctor.pk, fecha, hora_inicio, hora_fin, paciente.usuario_id):
+                continue
+            try:
+                return reservar_cita(paciente, doctor, fecha, hora_inicio, tipo, motivo, duracion=duracion)
+            except ValidationError:
+                # Otra reserva tomó el horario: se prueba el siguiente
+                intentos += 1
+                if intentos >= MAX_INTENTOS_AUTOMATICOS:
+                    raise
+    
+    raise ValidationError(
+        f'No hay horarios libres de {especialidad.nombre} entre el {fecha_inicio} y el {fecha_fin}.'
+    )
+
+
+def registrar_solicitud(clave, usuario, doctor):
+    """
+    Registra un envío del formulario de reserva identificado por `clave`.
+
+    Devuelve (solicitud, nueva). Si la clave ya se usó dentro del TTL se
+    devuelve la solicitud guardada para repetir su resultado sin volver a
+    validar la cita.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.CITAS_IDEMPOTENCIA_TTL)
+    SolicitudReserva.objects.filter(
+        usuario=usuario,
+        clave=clave,
+        created_at__lt=limite,
+        estado__in=SolicitudReserva.ESTADOS_RESUELTOS
+    ).delete()
+
+    try:
+        with transaction.atomic():
+            solicitud = SolicitudReserva.objects.create(usuario=usuario, clave=clave, doctor=doctor)
+        return solicitud, True
+    except IntegrityError:
+        return SolicitudReserva.objects.get(usuario=usuario, clave=clave), False
+
+
+def finalizar_solicitud(solicitud, estado, mensaje, cita=None):
+    """Guarda el resultado de la reserva para los reintentos con la misma clave"""
+    if solicitud is None:
+        return
+    solicitud.estado = estado
+    solicitud.mensaje = mensaje
+    solicitud.cita = cita
+    solicitud.save(update_fields=['estado', 'mensaje', 'cita'])
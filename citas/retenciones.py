@@ -0,0 +1,135 @@
+"""
+Retenciones temporales de slots mientras el paciente completa la reserva.
+
+Las retenciones de un doctor en un día se guardan juntas en una clave de
+caché como {usuario_id: (inicio, fin, vence)}, con las horas en minutos, así
+un slot se oculta si se cruza con uno retenido aunque empiece a otra hora
+(las duraciones cambian según el tipo de cita).
+"""
+import time as reloj
+from datetime import date
+from django.conf import settings
+from django.core.cache import cache
+from horarios.intervalos import IndiceIntervalos, a_minutos
+
+# Segundos que dura el candado de escritura de las retenciones de un día y
+# reintentos para tomarlo antes de darse por vencido
+CANDADO_TTL = 5
+CANDADO_REINTENTOS = 50
+
+
+def clave_retenciones(doctor_id, fecha):
+    """Clave de caché de las retenciones del doctor en la fecha"""
+    return f'citas:retencion:{doctor_id}:{fecha.isoformat()}'
+
+
+def clave_retencion_usuario(usuario_id, doctor_id):
+    """Clave de caché con la fecha del slot que el usuario retiene con el doctor"""
+    return f'citas:retencion:usuario:{usuario_id}:{doctor_id}'
+
+
+def _vigentes(retenciones):
+    """Retenciones que todavía no vencieron"""
+    ahora = reloj.time()
+    return {usuario_id: tramo for usuario_id, tramo in (retenciones or {}).items() if tramo[2] > ahora}
+
+
+def _modificar(doctor_id, fecha, cambio):
+    """
+    Aplica cambio(retenciones) a las retenciones del día con un candado en
+    caché, para que dos usuarios no retengan a la vez horarios que se cruzan.
+    Devuelve lo que devuelva cambio, o False si no se pudo tomar el candado.
+    """
+    clave = clave_retenciones(doctor_id, fecha)
+    candado = f'{clave}:candado'
+    for _ in range(CANDADO_REINTENTOS):
+        if cache.add(candado, True, CANDADO_TTL):
+            break
+        reloj.sleep(0.01)
+    else:
+        return False
+    try:
+        retenciones = _vigentes(cache.get(clave))
+        resultado = cambio(retenciones)
+        if retenciones:
+            cache.set(clave, retenciones, settings.CITAS_RETENCION_TTL)
+        else:
+            cache.delete(clave)
+        return resultado
+    finally:
+        cache.delete(candado)
+
+
+def _ocupado_por_otro(retenciones, inicio, fin, usuario_id):
+    """Indica si [inicio, fin) en minutos se cruza con la retención de otro usuario"""
+    return any(
+        otro != usuario_id and tramo[0] < fin and inicio < tramo[1]
+        for otro, tramo in retenciones.items()
+    )
+
+
+def retener_slot(doctor_id, fecha, hora_inicio, hora_fin, usuario_id):
+    """
+    Retiene el horario para el usuario durante CITAS_RETENCION_TTL segundos.
+    Devuelve False si se cruza con el que retiene otro usuario.
+
+    Cada usuario retiene un solo horario por doctor: al tomar uno nuevo se
+    libera el anterior, así cambiar de hora no va ocultando más horarios.
+    Volver a elegirlo renueva el plazo.
+    """
+    inicio, fin = a_minutos(hora_inicio), a_minutos(hora_fin)
+
+    def retener(retenciones):
+        if _ocupado_por_otro(retenciones, inicio, fin, usuario_id):
+            return False
+        retenciones[usuario_id] = (inicio, fin, reloj.time() + settings.CITAS_RETENCION_TTL)
+        return True
+
+    if not _modificar(doctor_id, fecha, retener):
+        return False
+    puntero = clave_retencion_usuario(usuario_id, doctor_id)
+    anterior = cache.get(puntero)
+    cache.set(puntero, fecha.isoformat(), settings.CITAS_RETENCION_TTL)
+    if anterior and anterior != fecha.isoformat():
+        _modificar(doctor_id, date.fromisoformat(anterior), lambda retenciones: retenciones.pop(usuario_id, None))
+    return True
+
+
+def liberar_slot(doctor_id, fecha, usuario_id):
+    """Libera la retención del usuario con el doctor en la fecha, si la tiene"""
+    _modificar(doctor_id, fecha, lambda retenciones: retenciones.pop(usuario_id, None))
+    puntero = clave_retencion_usuario(usuario_id, doctor_id)
+    if cache.get(puntero) == fecha.isoformat():
+        cache.delete(puntero)
+
+
+def retenido_por_otro(doctor_id, fecha, hora_inicio, hora_fin, usuario_id):
+    """Indica si el horario se cruza con el que retiene otro usuario"""
+    retenciones = _vigentes(cache.get(clave_retenciones(doctor_id, fecha)))
+    return _ocupado_por_otro(retenciones, a_minutos(hora_inicio), a_minutos(hora_fin), usuario_id)
+
+
+def quitar_retenidos(doctor_id, disponibilidad, usuario_id):
+    """
+    Quita de la disponibilidad los slots que se cruzan con los retenidos
+    por otros usuarios (una lectura de caché)
+    """
+    claves = {clave_retenciones(doctor_id, fecha): fecha for fecha in disponibilidad}
+    retenidos = {}
+    for clave, retenciones in cache.get_many(claves).items():
+        tramos = [tramo[:2] for otro, tramo in _vigentes(retenciones).items() if otro != usuario_id]
+        if tramos:
+            retenidos[claves[clave]] = IndiceIntervalos(tramos)
+    if not retenidos:
+        return disponibilidad
+
+    resultado = {}
+    for fecha, slots in disponibilidad.items():
+        indice = retenidos.get(fecha)
+        libres = [
+            (inicio, fin) for inicio, fin in slots
+            if not indice or not indice.solapado(a_minutos(inicio), a_minutos(fin))
+        ]
+        if libres:
+            resultado[fecha] = libres
+    return resultado
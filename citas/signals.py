@@ -0,0 +1,205 @@
+"""Señales de la agenda: avisan qué días de qué doctores cambiaron"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import Signal
+
+# Se envía tras el commit cuando cambia la agenda de uno o varios doctores.
+#   dias:     {(doctor_id, fecha), ...} con cambios que obligan a recalcular
+#   altas:    [(doctor_id, fecha), ...] con una cita activa nueva cada una
+#   doctores: {doctor_id, ...} cuyo horario semanal, excepciones o especialidades cambiaron
+#   cierres:  True si cambió el calendario de cierres de la clínica
+#   recursos: {(recurso_id, fecha), ...} de consultorios o equipos cuyas citas cambiaron
+agenda_modificada = Signal()
+
+# Se envía dentro de la transacción con las citas activas que empiezan o
+# dejan de ocupar la agenda, como (doctor_id, fecha, hora_inicio, hora_fin).
+ocupacion_modificada = Signal()
+
+# Se envía tras el commit con las citas canceladas, como
+# (doctor_id, fecha, hora_inicio, hora_fin, paciente_id), para ofrecer sus
+# horarios a la lista de espera.
+citas_canceladas = Signal()
+
+
+def notificar_agenda(dias=(), altas=(), doctores=(), cierres=False, recursos=()):
+    """Envía agenda_modificada cuando se confirme la transacción en curso"""
+    dias, altas, doctores, recursos = set(dias), list(altas), set(doctores), set(recursos)
+    if dias or altas or doctores or cierres or recursos:
+        transaction.on_commit(
+            lambda: agenda_modificada.send(
+                sender='citas.Cita',
+                dias=dias,
+                altas=altas,
+                doctores=doctores,
+                cierres=cierres,
+                recursos=recursos
+            )
+        )
+
+
+def notificar_ocupacion(ocupadas=(), liberadas=()):
+    """Envía ocupacion_modificada en la transacción en curso"""
+    ocupadas, liberadas = list(ocupadas), list(liberadas)
+    if ocupadas or liberadas:
+        ocupacion_modificada.send(sender='citas.Cita', ocupadas=ocupadas, liberadas=liberadas)
+
+
+def notificar_cancelacion(canceladas):
+    """Envía citas_canceladas cuando se confirme la transacción en curso"""
+    canceladas = list(canceladas)
+    if canceladas:
+        transaction.on_commit(
+            lambda: citas_canceladas.send(sender='citas.Cita', canceladas=canceladas)
+        )
+
+
+def _rango_activo(valores, estados_activos):
+    """
+    (doctor_id, fecha, hora_inicio, hora_fin) si los valores son de una cita
+    activa que ocupa la agenda (las de una sesión grupal no: la ocupa el cupo)
+    """
+    if valores.get('estado') not in estados_activos or valores.get('cupo_id'):
+        return None
+    return tuple(valores.get(campo) for campo in ('doctor_id', 'fecha', 'hora_inicio', 'hora_fin'))
+
+
+def _rango_cupo(valores):
+    """(doctor_id, fecha, hora_inicio, hora_fin) si los valores son de una sesión grupal activa"""
+    if not valores.get('activo'):
+        return None
+    return tuple(valores.get(campo) for campo in ('doctor_id', 'fecha', 'hora_inicio', 'hora_fin'))
+
+
+def _cupo_activo(valores, estados_activos):
+    """Sesión grupal en la que la cita ocupa un lugar (si está activa), o None"""
+    if valores.get('estado') not in estados_activos:
+        return None
+    return valores.get('cupo_id')
+
+
+def _recurso_activo(valores, estados_activos):
+    """(recurso_id, fecha) si los valores son de una cita activa en un consultorio o equipo"""
+    if valores.get('estado') not in estados_activos or not valores.get('recurso_id'):
+        return None
+    return valores['recurso_id'], valores.get('fecha')
+
+
+def cita_guardada(sender, instance, created, **kwargs):
+    """Avisa los días afectados al crear o modificar una cita con save()"""
+    actual = _rango_activo(instance.__dict__, instance.ESTADOS_ACTIVOS)
+    recursos = {_recurso_activo(instance.__dict__, instance.ESTADOS_ACTIVOS)}
+    if created:
+        if actual:
+            notificar_ocupacion(ocupadas=[actual])
+        if instance.estado in instance.ESTADOS_ACTIVOS:
+            notificar_agenda(altas=[(instance.doctor_id, instance.fecha)], recursos=recursos - {None})
+        return
+
+    dias = {(instance.doctor_id, instance.fecha)}
+    originales = getattr(instance, '_valores_originales', {})
+    if 'doctor_id' in originales and 'fecha' in originales:
+        dias.add((originales['doctor_id'], originales['fecha']))
+
+    anterior = _rango_activo(originales, instance.ESTADOS_ACTIVOS)
+    if anterior != actual:
+        notificar_ocupacion(
+            ocupadas=[actual] if actual else [],
+            liberadas=[anterior] if anterior else []
+        )
+    recursos.add(_recurso_activo(originales, instance.ESTADOS_ACTIVOS))
+    notificar_agenda(dias=dias, recursos=recursos - {None})
+
+    # Una cancelación hecha con save() (admin, formularios) ofrece el horario
+    # a la lista de espera, como transicionar
+    if anterior and instance.estado not in instance.ESTADOS_ACTIVOS:
+        notificar_cancelacion([(*anterior, instance.paciente_id)])
+
+    # Un cambio de estado o de sesión hecho con save() (p. ej. desde el
+    # admin) devuelve o toma el lugar, como transicionar y reservar_en_cupo
+    cupo_anterior = _cupo_activo(originales, instance.ESTADOS_ACTIVOS)
+    cupo_actual = _cupo_activo(instance.__dict__, instance.ESTADOS_ACTIVOS)
+    if 'estado' in originales and cupo_anterior != cupo_actual:
+        CupoGrupal = instance._meta.get_field('cupo').related_model
+        if cupo_anterior:
+            CupoGrupal.devolver_lugares([cupo_anterior])
+        if cupo_actual:
+            CupoGrupal.tomar_lugar(cupo_actual)
+
+
+def cita_eliminada(sender, instance, **kwargs):
+    """Avisa el día afectado al eliminar una cita"""
+    anterior = _rango_activo(instance.__dict__, instance.ESTADOS_ACTIVOS)
+    if anterior:
+        notificar_ocupacion(liberadas=[anterior])
+    elif instance.cupo_id and instance.estado in instance.ESTADOS_ACTIVOS:
+        instance._meta.get_field('cupo').related_model.devolver_lugares([instance.cupo_id])
+    recurso = _recurso_activo(instance.__dict__, instance.ESTADOS_ACTIVOS)
+    notificar_agenda(dias=[(instance.doctor_id, instance.fecha)], recursos=[recurso] if recurso else [])
+
+
+def cupo_guardado(sender, instance, created, **kwargs):
+    """Ocupa y libera la agenda del doctor al crear, mover o desactivar una sesión grupal"""
+    actual = _rango_cupo(instance.__dict__)
+    originales = {} if created else getattr(instance, '_valores_originales', {})
+    anterior = _rango_cupo(originales)
+    if anterior != actual:
+        notificar_ocupacion(
+            ocupadas=[actual] if actual else [],
+            liberadas=[anterior] if anterior else []
+        )
+    dias = {(instance.doctor_id, instance.fecha)}
+    if 'doctor_id' in originales and 'fecha' in originales:
+        dias.add((originales['doctor_id'], originales['fecha']))
+    notificar_agenda(dias=dias)
+
+
+def cupo_eliminado(sender, instance, **kwargs):
+    """Libera la agenda del doctor al eliminar una sesión grupal"""
+    anterior = _rango_cupo(instance.__dict__)
+    if anterior:
+        notificar_ocupacion(liberadas=[anterior])
+    notificar_agenda(dias=[(instance.doctor_id, instance.fecha)])
+
+
+def recordar_doctor_anterior(sender, instance, **kwargs):
+    """Guarda el doctor previo de un horario o excepción que se va a modificar"""
+    if instance.pk and not instance._state.adding:
+        instance._doctor_anterior = sender.objects.filter(pk=instance.pk).values_list('doctor_id', flat=True).first()
+
+
+def horario_modificado(sender, instance, **kwargs):
+    """Avisa el doctor afectado al guardar o eliminar un horario o una excepción"""
+    doctores = {instance.doctor_id, getattr(instance, '_doctor_anterior', None)} - {None}
+    notificar_agenda(doctores=doctores)
+
+
+def especialidades_modificadas(sender, instance, action, reverse, pk_set, **kwargs):
+    """Avisa los doctores cuyas especialidades cambiaron (afectan a los cierres)"""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Cambio desde la especialidad: pk_set son doctores (None al vaciarla)
+        doctores = pk_set or instance.doctores.values_list('pk', flat=True)
+    else:
+        doctores = [instance.pk]
+    notificar_agenda(doctores=doctores)
+
+
+def cierre_modificado(sender, **kwargs):
+    """Avisa que cambió el calendario de cierres"""
+    notificar_agenda(cierres=True)
+
+
+post_save.connect(cita_guardada, sender='citas.Cita')
+post_delete.connect(cita_eliminada, sender='citas.Cita')
+post_save.connect(cupo_guardado, sender='citas.CupoGrupal')
+post_delete.connect(cupo_eliminado, sender='citas.CupoGrupal')
+
+for modelo in ('horarios.Horario', 'horarios.Excepcion'):
+    pre_save.connect(recordar_doctor_anterior, sender=modelo)
+    post_save.connect(horario_modificado, sender=modelo)
+    post_delete.connect(horario_modificado, sender=modelo)
+
+m2m_changed.connect(especialidades_modificadas, sender='doctores.Doctor_especialidades')
+post_save.connect(cierre_modificado, sender='horarios.Cierre')
+post_delete.connect(cierre_modificado, sender='horarios.Cierre')
@@ -0,0 +1,72 @@
+from datetime import date, time, timedelta
+from celery import shared_task
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+from .models import SolicitudReserva, OcupacionDia, ListaEspera
+
+
+@shared_task
+def cerrar_citas_vencidas(estado='no_asistio'):
+    """Tarea nocturna: cierra las citas pasadas que quedaron abiertas"""
+    call_command('cerrar_citas_vencidas', estado=estado)
+
+
+@shared_task
+def recuperar_solicitudes_reserva():
+    """Rechaza las solicitudes de reserva abandonadas y despierta las colas (ver cola.py)"""
+    from .cola import recuperar_solicitudes
+    recuperar_solicitudes()
+
+
+@shared_task
+def purgar_solicitudes_reserva():
+    """
+    Borra las solicitudes de reserva resueltas cuyo TTL de reintento ya
+    venció. Antes rechaza las abandonadas para que también se borren; las
+    que siguen en cola o procesándose se conservan.
+    """
+    from .cola import recuperar_solicitudes
+    recuperar_solicitudes()
+    limite = timezone.now() - timedelta(seconds=settings.CITAS_IDEMPOTENCIA_TTL)
+    SolicitudReserva.objects.filter(
+        created_at__lt=limite,
+        estado__in=SolicitudReserva.ESTADOS_RESUELTOS
+    ).delete()
+
+
+@shared_task
+def purgar_ocupacion():
+    """Borra los mapas de ocupación de días pasados"""
+    OcupacionDia.objects.filter(fecha__lt=timezone.now().date()).delete()
+
+
+@shared_task
+def procesar_cola_reservas(doctor_id):
+    """Consumidor de la cola de reservas del doctor (ver cola.py)"""
+    from .cola import procesar_cola
+    procesar_cola(doctor_id)
+
+
+@shared_task
+def rellenar_huecos(huecos):
+    """
+    Ofrece a la lista de espera los horarios de citas canceladas, dados como
+    [(doctor_id, fecha, hora_inicio, hora_fin, paciente_id), ...] en ISO.
+    El paciente que canceló no recibe de vuelta su propio horario.
+    """
+    from .espera import rellenar_hueco
+    for doctor_id, fecha, hora_inicio, hora_fin, paciente_id in huecos:
+        rellenar_hueco(
+            doctor_id,
+            date.fromisoformat(fecha),
+            time.fromisoformat(hora_inicio),
+            time.fromisoformat(hora_fin),
+            excluir_paciente=paciente_id
+        )
+
+
+@shared_task
+def vencer_lista_espera():
+    """Marca como vencidas las entradas de la lista de espera cuyo rango ya pasó"""
+    ListaEspera.objects.filter(estado='esperando', fecha_hasta__lt=timezone.now().date()).update(estado='vencida')
@@ -1,3 +1,523 @@
-from django.test import TestCase
+import threading
+import unittest
+from unittest import mock
+from datetime import date, time, timedelta
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from usuarios.models import Usuario
+from pacientes.models import Paciente
+from doctores.models import Doctor
+from especialidades.models import Especialidad
+from horarios.models import Horario, Excepcion, Recurso
+from horarios.cierres import limpiar_calendario
+from .disponibilidad import proximo_slot_por_doctor
+from .cola import (
+    SOLICITUD_ABANDONADA, COLA_ESPERA_MAXIMA, clave_candado, encolar_reserva, procesar_cola, recuperar_solicitudes,
+)
+from .models import Cita, CupoGrupal, SolicitudReserva, ListaEspera
+from .ocupacion import BLOQUES_DIA, mascara, intervalos
+from .reservas import (
+    reservar_cita, reservar_automatica, reservar_serie, reservar_en_cupo, reservar_desde_formulario,
+    fechas_recurrentes, registrar_solicitud,
+)
+from .retenciones import retener_slot, liberar_slot, retenido_por_otro, quitar_retenidos
 
-# Create your tests here.
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Requiere PostgreSQL')
+class ReservaConcurrenteTest(TransactionTestCase):
+    """Muchas reservas simultáneas para el mismo doctor y día"""
+
+    RESERVAS = 24
+
+    def setUp(self):
+        especialidad = Especialidad.objects.create(nombre='Cardiología', duracion_cita=30)
+        usuario = Usuario.objects.create_user('doctor', password='x', rol='doctor')
+        self.doctor = Doctor.objects.create(usuario=usuario, licencia_medica='CMP-1')
+        self.doctor.especialidades.add(especialidad)
+
+        self.fecha = timezone.now().date() + timedelta(days=1)
+        Horario.objects.create(
+            doctor=self.doctor,
+            dia_semana=self.fecha.weekday(),
+            hora_inicio=time(8, 0),
+            hora_fin=time(12, 0)
+        )
+
+        self.pacientes = []
+        for i in range(self.RESERVAS):
+            usuario = Usuario.objects.create_user(f'paciente{i}', password='x')
+            self.pacientes.append(Paciente.objects.create(usuario=usuario, dni=f'{i:08d}'))
+
+    def test_reservas_simultaneas_sin_solapamientos(self):
+        # Inicios cada 10 minutos: la mayoría de las citas de 30 minutos se pisan
+        inicios = [time(8 + (i * 10) // 60, (i * 10) % 60) for i in range(self.RESERVAS)]
+        barrera = threading.Barrier(self.RESERVAS)
+        rechazadas = []
+
+        def reservar(paciente, hora_inicio):
+            try:
+                barrera.wait()
+                reservar_cita(paciente, self.doctor, self.fecha, hora_inicio, 'primera_vez', 'Control')
+            except ValidationError:
+                rechazadas.append(hora_inicio)
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=reservar, args=(paciente, hora_inicio))
+            for paciente, hora_inicio in zip(self.pacientes, inicios)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        citas = list(Cita.objects.filter(
+            doctor=self.doctor,
+            fecha=self.fecha,
+            estado__in=Cita.ESTADOS_ACTIVOS
+        ).order_by('hora_inicio'))
+
+        self.assertTrue(citas)
+        self.assertEqual(len(citas) + len(rechazadas), self.RESERVAS)
+        for anterior, siguiente in zip(citas, citas[1:]):
+            self.assertLessEqual(anterior.hora_fin, siguiente.hora_inicio)
+
+
+class MascaraTest(SimpleTestCase):
+    """Bits de bloques de 5 minutos y su vuelta a tramos"""
+
+    def test_exterior_incluye_bloques_tocados_en_parte(self):
+        # 8:02 a 8:11 toca los bloques 8:00, 8:05 y 8:10
+        self.assertEqual(mascara(482, 491), 0b111 << 96)
+
+    def test_interior_solo_bloques_completos(self):
+        # De 8:02 a 8:11 solo el bloque 8:05 está completo
+        self.assertEqual(mascara(482, 491, exterior=False), 1 << 97)
+        self.assertEqual(mascara(482, 488, exterior=False), 0)
+
+    def test_limites_alineados(self):
+        self.assertEqual(mascara(480, 490), mascara(480, 490, exterior=False))
+        self.assertEqual(mascara(0, 24 * 60), (1 << BLOQUES_DIA) - 1)
+
+    def test_vacia_si_fin_no_supera_inicio(self):
+        self.assertEqual(mascara(480, 480), 0)
+        self.assertEqual(mascara(490, 480), 0)
+
+    def test_intervalos(self):
+        self.assertEqual(intervalos(0), [])
+        self.assertEqual(intervalos(mascara(480, 490) | mascara(500, 505)), [(480, 490), (500, 505)])
+        # Tramos pegados se leen como uno solo
+        self.assertEqual(intervalos(mascara(480, 490) | mascara(490, 500)), [(480, 500)])
+        self.assertEqual(intervalos(mascara(0, 24 * 60)), [(0, 24 * 60)])
+
+    def test_ida_y_vuelta(self):
+        for inicio, fin in [(0, 5), (480, 720), (1435, 1440)]:
+            self.assertEqual(intervalos(mascara(inicio, fin)), [(inicio, fin)])
+
+
+
+class RecuperarSolicitudesTest(TestCase):
+    """Solicitudes de reserva que un consumidor caído dejó sin resolver"""
+
+    def setUp(self):
+        usuario = Usuario.objects.create_user('doctor', password='x', rol='doctor')
+        self.doctor = Doctor.objects.create(usuario=usuario, licencia_medica='CMP-1')
+        self.usuario = Usuario.objects.create_user('paciente', password='x')
+        cache.delete(clave_candado(self.doctor.pk))
+
+    def solicitud(self, clave, estado, segundos):
+        """Solicitud creada hace `segundos` segundos"""
+        solicitud = SolicitudReserva.objects.create(
+            usuario=self.usuario, clave=clave, doctor=self.doctor, estado=estado
+        )
+        SolicitudReserva.objects.filter(pk=solicitud.pk).update(
+            created_at=timezone.now() - timedelta(seconds=segundos)
+        )
+        return solicitud
+
+    def estado(self, solicitud):
+        return SolicitudReserva.objects.get(pk=solicitud.pk).estado
+
+    @mock.patch('citas.tasks.procesar_cola_reservas.delay')
+    def test_rechaza_abandonadas_y_despierta_la_cola(self, delay):
+        abandonada = self.solicitud('a', 'procesando', SOLICITUD_ABANDONADA + 60)
+        reciente = self.solicitud('b', 'procesando', 10)
+        vencida = self.solicitud('c', 'en_cola', COLA_ESPERA_MAXIMA + 60)
+        en_cola = self.solicitud('d', 'en_cola', 10)
+
+        self.assertEqual(recuperar_solicitudes(), 2)
+        self.assertEqual(self.estado(abandonada), 'rechazada')
+        self.assertEqual(self.estado(reciente), 'procesando')
+        self.assertEqual(self.estado(vencida), 'rechazada')
+        self.assertEqual(self.estado(en_cola), 'en_cola')
+        delay.assert_called_once_with(self.doctor.pk)
+
+    @mock.patch('citas.tasks.procesar_cola_reservas.delay')
+    def test_respeta_al_consumidor_activo(self, delay):
+        abandonada = self.solicitud('a', 'procesando', SOLICITUD_ABANDONADA + 60)
+        self.solicitud('b', 'en_cola', 10)
+        cache.set(clave_candado(self.doctor.pk), True)
+        try:
+            self.assertEqual(recuperar_solicitudes(), 0)
+        finally:
+            cache.delete(clave_candado(self.doctor.pk))
+        self.assertEqual(self.estado(abandonada), 'procesando')
+        delay.assert_not_called()
+
+
+class RetencionesTest(SimpleTestCase):
+    """Retenciones de horarios por rango, una por usuario y doctor"""
+
+    DOCTOR = 1
+    FECHA = date(2026, 10, 19)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rango_que_se_cruza_con_uno_retenido(self):
+        self.assertTrue(retener_slot(self.DOCTOR, self.FECHA, time(8, 0), time(8, 45), 1))
+        # Empieza a otra hora pero se cruza con 8:00-8:45
+        self.assertTrue(retenido_por_otro(self.DOCTOR, self.FECHA, time(8, 30), time(9, 0), 2))
+        self.assertFalse(retener_slot(self.DOCTOR, self.FECHA, time(8, 30), time(9, 0), 2))
+        # Pegado al retenido no se cruza
+        self.assertFalse(retenido_por_otro(self.DOCTOR, self.FECHA, time(8, 45), time(9, 15), 2))
+        self.assertTrue(retener_slot(self.DOCTOR, self.FECHA, time(8, 45), time(9, 15), 2))
+        # El titular no se bloquea a sí mismo
+        self.assertFalse(retenido_por_otro(self.DOCTOR, self.FECHA, time(8, 0), time(8, 30), 1))
+
+    def test_una_retencion_por_usuario_y_doctor(self):
+        manana = self.FECHA + timedelta(days=1)
+        self.assertTrue(retener_slot(self.DOCTOR, self.FECHA, time(8, 0), time(8, 30), 1))
+        self.assertTrue(retener_slot(self.DOCTOR, self.FECHA, time(9, 0), time(9, 30), 1))
+        self.assertFalse(retenido_por_otro(self.DOCTOR, self.FECHA, time(8, 0), time(8, 30), 2))
+        # Otro día libera también el anterior
+        self.assertTrue(retener_slot(self.DOCTOR, manana, time(9, 0), time(9, 30), 1))
+        self.assertFalse(retenido_por_otro(self.DOCTOR, self.FECHA, time(9, 0), time(9, 30), 2))
+        self.assertTrue(retenido_por_otro(self.DOCTOR, manana, time(9, 0), time(9, 30), 2))
+        liberar_slot(self.DOCTOR, manana, 1)
+        self.assertFalse(retenido_por_otro(self.DOCTOR, manana, time(9, 0), time(9, 30), 2))
+
+    def test_quitar_retenidos(self):
+        retener_slot(self.DOCTOR, self.FECHA, time(8, 10), time(8, 40), 1)
+        disponibilidad = {self.FECHA: [(time(8, 0), time(8, 20)), (time(8, 40), time(9, 0))]}
+        self.assertEqual(
+            quitar_retenidos(self.DOCTOR, disponibilidad, 2),
+            {self.FECHA: [(time(8, 40), time(9, 0))]}
+        )
+        self.assertEqual(quitar_retenidos(self.DOCTOR, disponibilidad, 1), disponibilidad)
+
+
+class AgendaTestCase(TestCase):
+    """Un doctor de Cardiología que atiende mañana de 8:00 a 10:00 y un paciente"""
+
+    def setUp(self):
+        cache.clear()
+        limpiar_calendario()
+        self.especialidad = Especialidad.objects.create(nombre='Cardiología', duracion_cita=30)
+        usuario = Usuario.objects.create_user('doctor', password='x', rol='doctor')
+        self.doctor = Doctor.objects.create(usuario=usuario, licencia_medica='CMP-1')
+        self.doctor.especialidades.add(self.especialidad)
+        self.fecha = timezone.localdate() + timedelta(days=1)
+        Horario.objects.create(
+            doctor=self.doctor,
+            dia_semana=self.fecha.weekday(),
+            hora_inicio=time(8, 0),
+            hora_fin=time(10, 0)
+        )
+        self.paciente = self.crear_paciente('paciente', '00000001')
+
+    def crear_paciente(self, username, dni):
+        usuario = Usuario.objects.create_user(username, password='x')
+        return Paciente.objects.create(usuario=usuario, dni=dni)
+
+    def crear_cita(self, hora_inicio, hora_fin, paciente=None, **campos):
+        campos.setdefault('fecha', self.fecha)
+        return Cita.objects.create(
+            paciente=paciente or self.paciente,
+            doctor=self.doctor,
+            hora_inicio=hora_inicio,
+            hora_fin=hora_fin,
+            motivo='Control',
+            **campos
+        )
+
+
+class ReservaAutomaticaTest(AgendaTestCase):
+    """Asignación automática con la duración propia de cada doctor"""
+
+    def test_usa_la_duracion_del_doctor_para_el_tipo(self):
+        self.doctor.duraciones = {'control': 45}
+        self.doctor.save()
+        self.crear_cita(time(8, 0), time(8, 30))
+
+        otro = self.crear_paciente('otro', '00000002')
+        cita = reservar_automatica(otro, self.especialidad, self.fecha, self.fecha, 'control', 'Control')
+        self.assertEqual((cita.hora_inicio, cita.hora_fin), (time(8, 30), time(9, 15)))
+
+    def test_sin_horarios_libres(self):
+        self.crear_cita(time(8, 0), time(10, 0))
+        otro = self.crear_paciente('otro', '00000002')
+        with self.assertRaisesRegex(ValidationError, 'No hay horarios libres'):
+            reservar_automatica(otro, self.especialidad, self.fecha, self.fecha, 'control', 'Control')
+        self.assertEqual(Cita.objects.count(), 1)
+
+
+class ValidacionAlGuardarTest(AgendaTestCase):
+    """Cita.save valida de nuevo solo cuando hace falta"""
+
+    def test_cambio_de_estado_activo_no_revalida(self):
+        cita = self.crear_cita(time(8, 0), time(8, 30))
+        Excepcion.objects.create(doctor=self.doctor, fecha_inicio=self.fecha, fecha_fin=self.fecha, motivo='vacaciones')
+        cita = Cita.objects.get(pk=cita.pk)
+        cita.estado = 'confirmada'
+        cita.save()
+        self.assertEqual(Cita.objects.get(pk=cita.pk).estado, 'confirmada')
+
+    def test_reactivar_valida_el_horario(self):
+        cita = self.crear_cita(time(8, 0), time(8, 30), estado='cancelada')
+        Excepcion.objects.create(doctor=self.doctor, fecha_inicio=self.fecha, fecha_fin=self.fecha, motivo='vacaciones')
+        cita = Cita.objects.get(pk=cita.pk)
+        cita.estado = 'pendiente'
+        with self.assertRaisesRegex(ValidationError, 'no está disponible'):
+            cita.save()
+        self.assertEqual(Cita.objects.get(pk=cita.pk).estado, 'cancelada')
+
+    def test_reactivar_valida_el_cruce_del_paciente(self):
+        cancelada = self.crear_cita(time(8, 0), time(8, 30), estado='cancelada')
+        self.crear_cita(time(8, 0), time(8, 30), tipo='control')
+        cancelada = Cita.objects.get(pk=cancelada.pk)
+        cancelada.estado = 'pendiente'
+        with self.assertRaisesRegex(ValidationError, 'El paciente ya tiene una cita'):
+            cancelada.save()
+
+    def test_cambio_de_recurso_revalida(self):
+        cita = self.crear_cita(time(8, 0), time(8, 30))
+        cita = Cita.objects.get(pk=cita.pk)
+        cita.recurso = Recurso.objects.create(nombre='Consultorio 1')
+        cita.save()
+        # clean vuelve a asignar el recurso del turno (ninguno)
+        self.assertIsNone(Cita.objects.get(pk=cita.pk).recurso_id)
+
+
+class ProximoSlotTest(AgendaTestCase):
+    """Primer horario libre de cada doctor"""
+
+    def test_primer_slot_despues_de_las_citas(self):
+        self.crear_cita(time(8, 0), time(8, 30))
+        self.crear_cita(time(8, 30), time(9, 0), paciente=self.crear_paciente('otro', '00000002'))
+        self.assertEqual(proximo_slot_por_doctor([self.doctor], 30), {self.doctor.pk: (self.fecha, time(9, 0))})
+
+    def test_sin_lugar_para_la_duracion(self):
+        self.crear_cita(time(8, 30), time(10, 0))
+        self.assertEqual(proximo_slot_por_doctor([self.doctor], 60, dias=1), {self.doctor.pk: None})
+
+
+class ReprogramacionTest(AgendaTestCase):
+    """Reprogramación en bloque de las citas dentro de una excepción"""
+
+    def setUp(self):
+        super().setUp()
+        self.cita = self.crear_cita(time(8, 0), time(8, 30))
+        self.excepcion = Excepcion.objects.create(
+            doctor=self.doctor, fecha_inicio=self.fecha, fecha_fin=self.fecha, motivo='emergencia'
+        )
+        self.url = reverse('impacto_excepcion', args=[self.excepcion.pk])
+        self.client.force_login(self.doctor.usuario)
+
+    def test_aplica_los_horarios_confirmados(self):
+        firma = self.client.get(self.url).context['firma']
+        self.client.post(self.url, {'firma': firma})
+        cita = Cita.objects.get(pk=self.cita.pk)
+        self.assertEqual((cita.fecha, cita.hora_inicio), (self.fecha + timedelta(days=7), time(8, 0)))
+
+    def test_rechaza_si_la_propuesta_cambio(self):
+        firma = self.client.get(self.url).context['firma']
+        # Otro paciente toma el horario propuesto antes de confirmar
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear_cita(
+                time(8, 0), time(8, 30),
+                paciente=self.crear_paciente('otro', '00000002'),
+                fecha=self.fecha + timedelta(days=7)
+            )
+        respuesta = self.client.post(self.url, {'firma': firma}, follow=True)
+        self.assertContains(respuesta, 'Los horarios disponibles cambiaron')
+        self.assertEqual(Cita.objects.get(pk=self.cita.pk).fecha, self.fecha)
+
+
+class ListaEsperaTest(AgendaTestCase):
+    """Horarios cancelados que se ofrecen a la lista de espera"""
+
+    def setUp(self):
+        super().setUp()
+        self.cita = self.crear_cita(time(8, 0), time(8, 30))
+        self.otro = self.crear_paciente('otro', '00000002')
+        self.entrada = ListaEspera.objects.create(
+            paciente=self.otro,
+            doctor=self.doctor,
+            fecha_desde=self.fecha,
+            fecha_hasta=self.fecha,
+            tipo='control',
+            motivo='Control'
+        )
+
+    def test_cancelar_con_save_rellena_el_hueco(self):
+        cita = Cita.objects.get(pk=self.cita.pk)
+        cita.estado = 'cancelada'
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.save()
+        self.entrada.refresh_from_db()
+        self.assertEqual(self.entrada.estado, 'asignada')
+        self.assertEqual((self.entrada.cita.paciente, self.entrada.cita.hora_inicio), (self.otro, time(8, 0)))
+
+    def test_cancelar_con_transicionar_rellena_el_hueco(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.cita.transicionar('cancelada'))
+        self.entrada.refresh_from_db()
+        self.assertEqual(self.entrada.estado, 'asignada')
+
+    def test_no_asigna_un_hueco_mas_corto_que_la_cita(self):
+        self.doctor.duraciones = {'control': 45}
+        self.doctor.save()
+        self.crear_cita(time(8, 30), time(9, 0), paciente=self.crear_paciente('tercero', '00000003'))
+        cita = Cita.objects.get(pk=self.cita.pk)
+        cita.estado = 'cancelada'
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.save()
+        self.entrada.refresh_from_db()
+        self.assertEqual(self.entrada.estado, 'esperando')
+        self.assertFalse(Cita.objects.filter(paciente=self.otro).exists())
+
+
+class ReservaCitaTest(AgendaTestCase):
+    """Reserva de una cita con la agenda bloqueada"""
+
+    def test_la_reserva_libera_la_retencion_del_paciente(self):
+        retener_slot(self.doctor.pk, self.fecha, time(8, 0), time(8, 30), self.paciente.usuario_id)
+        cita = reservar_cita(self.paciente, self.doctor, self.fecha, time(8, 0), 'control', 'Control')
+        self.assertEqual(cita.hora_fin, time(8, 30))
+        self.assertFalse(retenido_por_otro(self.doctor.pk, self.fecha, time(8, 0), time(8, 30), 0))
+
+    def test_rechaza_un_horario_retenido_por_otro(self):
+        otro = self.crear_paciente('otro', '00000002')
+        retener_slot(self.doctor.pk, self.fecha, time(8, 0), time(8, 30), otro.usuario_id)
+        with self.assertRaisesRegex(ValidationError, 'Otro paciente está reservando'):
+            reservar_cita(self.paciente, self.doctor, self.fecha, time(8, 15), 'control', 'Control')
+        self.assertFalse(Cita.objects.exists())
+
+    def test_rechaza_fuera_del_horario_sin_guardar_nada(self):
+        with self.assertRaisesRegex(ValidationError, 'fuera del horario laboral'):
+            reservar_cita(self.paciente, self.doctor, self.fecha, time(11, 0), 'control', 'Control')
+        self.assertFalse(Cita.objects.exists())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Requiere PostgreSQL')
+    def test_la_base_rechaza_citas_solapadas_del_doctor(self):
+        self.crear_cita(time(8, 0), time(8, 30))
+        otro = self.crear_paciente('otro', '00000002')
+        with self.assertRaisesRegex(ValidationError, 'Ya existe una cita para este doctor'):
+            reservar_cita(otro, self.doctor, self.fecha, time(8, 15), 'control', 'Control')
+        self.assertEqual(Cita.objects.count(), 1)
+
+
+class ReservaSerieTest(AgendaTestCase):
+    """Series de citas: cada fecha se valida y las válidas se guardan juntas"""
+
+    def setUp(self):
+        super().setUp()
+        self.fechas = fechas_recurrentes(self.fecha, 'semanal', 4)
+
+    def test_conflictos_por_fecha(self):
+        Excepcion.objects.create(
+            doctor=self.doctor, fecha_inicio=self.fechas[1], fecha_fin=self.fechas[1], motivo='vacaciones'
+        )
+        self.crear_cita(time(8, 0), time(8, 30), paciente=self.crear_paciente('otro', '00000002'), fecha=self.fechas[2])
+
+        creadas, conflictos = reservar_serie(self.paciente, self.doctor, self.fechas, time(8, 0), 'control', 'Control')
+        self.assertEqual([cita.fecha for cita in creadas], [self.fechas[0], self.fechas[3]])
+        self.assertEqual([fecha for fecha, error in conflictos], self.fechas[1:3])
+        self.assertIn('Vacaciones', conflictos[0][1])
+        self.assertIn('Ya existe una cita para este doctor', conflictos[1][1])
+        self.assertEqual(Cita.objects.filter(paciente=self.paciente).count(), 2)
+
+    def test_sin_ninguna_fecha_valida_no_guarda_nada(self):
+        datos = {'fecha': self.fecha.isoformat(), 'hora_inicio': '11:00', 'tipo': 'control',
+                 'motivo': 'Control', 'frecuencia': 'semanal', 'repeticiones': '4'}
+        with self.assertRaisesRegex(ValidationError, 'No se pudo agendar ninguna cita de la serie'):
+            reservar_desde_formulario(self.paciente, self.doctor, datos)
+        self.assertFalse(Cita.objects.exists())
+
+
+class ReservaEnCupoTest(AgendaTestCase):
+    """Lugares de una sesión grupal"""
+
+    def setUp(self):
+        super().setUp()
+        self.cupo = CupoGrupal.objects.create(
+            doctor=self.doctor,
+            fecha=self.fecha,
+            hora_inicio=time(9, 0),
+            hora_fin=time(10, 0),
+            descripcion='Vacunación',
+            capacidad=1
+        )
+
+    def disponibles(self):
+        return CupoGrupal.objects.get(pk=self.cupo.pk).disponibles
+
+    def test_no_entrega_mas_lugares_que_la_capacidad(self):
+        reservar_en_cupo(self.paciente, self.cupo, 'Vacuna')
+        self.assertEqual(self.disponibles(), 0)
+        with self.assertRaisesRegex(ValidationError, 'No quedan lugares'):
+            reservar_en_cupo(self.crear_paciente('otro', '00000002'), self.cupo, 'Vacuna')
+        self.assertEqual(Cita.objects.filter(cupo=self.cupo).count(), 1)
+
+    def test_devuelve_el_lugar_si_la_cita_no_es_valida(self):
+        # El paciente ya tiene otra cita a esa hora con otro doctor
+        usuario = Usuario.objects.create_user('doctor2', password='x', rol='doctor')
+        otro_doctor = Doctor.objects.create(usuario=usuario, licencia_medica='CMP-2')
+        Horario.objects.create(
+            doctor=otro_doctor, dia_semana=self.fecha.weekday(), hora_inicio=time(9, 0), hora_fin=time(10, 0)
+        )
+        Cita.objects.create(
+            paciente=self.paciente, doctor=otro_doctor, fecha=self.fecha,
+            hora_inicio=time(9, 0), hora_fin=time(9, 30), motivo='Control'
+        )
+        with self.assertRaisesRegex(ValidationError, 'El paciente ya tiene una cita'):
+            reservar_en_cupo(self.paciente, self.cupo, 'Vacuna')
+        self.assertEqual(self.disponibles(), 1)
+        self.assertFalse(Cita.objects.filter(cupo=self.cupo).exists())
+
+
+class ColaReservasTest(AgendaTestCase):
+    """Solicitudes en cola aplicadas por el consumidor del doctor"""
+
+    def encolar(self, paciente, clave, hora_inicio):
+        solicitud, nueva = registrar_solicitud(clave, paciente.usuario, self.doctor)
+        encolar_reserva(solicitud, {
+            'fecha': self.fecha.isoformat(), 'hora_inicio': hora_inicio, 'tipo': 'control', 'motivo': 'Control'
+        })
+        return solicitud
+
+    def test_aplica_en_orden_y_guarda_el_resultado(self):
+        primera = self.encolar(self.paciente, 'a', '08:00')
+        segunda = self.encolar(self.crear_paciente('otro', '00000002'), 'b', '11:00')
+
+        self.assertEqual(procesar_cola(self.doctor.pk), 2)
+        primera.refresh_from_db()
+        segunda.refresh_from_db()
+        self.assertEqual(primera.estado, 'completada')
+        self.assertEqual(primera.cita.hora_inicio, time(8, 0))
+        self.assertEqual(segunda.estado, 'rechazada')
+        self.assertIn('fuera del horario laboral', segunda.mensaje)
+        self.assertEqual(Cita.objects.count(), 1)
+
+    def test_no_procesa_si_otro_consumidor_tiene_el_candado(self):
+        solicitud = self.encolar(self.paciente, 'a', '08:00')
+        cache.set(clave_candado(self.doctor.pk), True)
+        self.assertEqual(procesar_cola(self.doctor.pk), 0)
+        solicitud.refresh_from_db()
+        self.assertEqual(solicitud.estado, 'en_cola')
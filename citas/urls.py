@@ -5,8 +5,16 @@ urlpatterns = [
     path('especialidades/', views.lista_especialidades, name='lista_especialidades'),
     path('doctores/', views.lista_doctores, name='lista_doctores'),
     path('doctores/especialidad/<int:especialidad_id>/', views.lista_doctores, name='lista_doctores_especialidad'),
+    path('especialidad/<int:especialidad_id>/agendar/', views.agendar_automatico, name='agendar_automatico'),
     path('doctor/<int:doctor_id>/disponibilidad/', views.disponibilidad_doctor, name='disponibilidad_doctor'),
+    path('doctor/<int:doctor_id>/retener/', views.retener_horario, name='retener_horario'),
     path('doctor/<int:doctor_id>/agendar/', views.agendar_cita, name='agendar_cita'),
+    path('doctor/<int:doctor_id>/lista-espera/', views.unirse_lista_espera, name='lista_espera_doctor'),
+    path('especialidad/<int:especialidad_id>/lista-espera/', views.unirse_lista_espera, name='lista_espera_especialidad'),
+    path('lista-espera/<int:entrada_id>/salir/', views.salir_lista_espera, name='salir_lista_espera'),
+    path('sesion/<int:cupo_id>/reservar/', views.reservar_cupo, name='reservar_cupo'),
+    path('solicitud/<int:solicitud_id>/', views.solicitud_reserva, name='solicitud_reserva'),
+    path('solicitud/<int:solicitud_id>/estado/', views.estado_solicitud, name='estado_solicitud'),
     path('mis-citas/', views.mis_citas, name='mis_citas'),
     path('cita/<int:cita_id>/', views.detalle_cita, name='detalle_cita'),
     path('cita/<int:cita_id>/cancelar/', views.cancelar_cita, name='cancelar_cita'),
@@ -1,9 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import Cita
+import uuid
+from .models import Cita, CupoGrupal, ListaEspera, SolicitudReserva
+from .disponibilidad import (
+    calcular_disponibilidad, primeros_slots_libres, proximo_slot_por_doctor, duracion_cita_doctor,
+    duraciones_por_tipo, calcular_hora_fin, DURACION_POR_DEFECTO,
+)
+from .reservas import (
+    reservar_desde_formulario, reservar_automatica, reservar_en_cupo, registrar_solicitud, finalizar_solicitud,
+    HORIZONTE_AUTOMATICO,
+)
+from .cola import encolar_reserva
+from .retenciones import retener_slot, quitar_retenidos
 from doctores.models import Doctor
 from especialidades.models import Especialidad
 from pacientes.models import Paciente
@@ -23,43 +37,161 @@ def lista_doctores(request, especialidad_id=None):
     """Muestra doctores filtrados por especialidad"""
     doctores = Doctor.objects.filter(activo=True)
     especialidad = None
+    primeros_slots = []
+    orden = request.GET.get('orden')
     
     if especialidad_id:
         especialidad = get_object_or_404(Especialidad, id=especialidad_id)
         doctores = doctores.filter(especialidades=especialidad)
     
+    if especialidad or orden == 'disponibilidad':
+        doctores = list(doctores.select_related('usuario'))
+        duracion = especialidad.duracion_cita if especialidad else DURACION_POR_DEFECTO
+        
+        # Primeros horarios libres entre todos los doctores de la especialidad
+        if especialidad:
+            primeros_slots = primeros_slots_libres(doctores, duracion, 5)
+        
+        # Ordenar por el próximo horario libre de cada doctor
+        if orden == 'disponibilidad':
+            proximos = proximo_slot_por_doctor(doctores, duracion)
+            for doctor in doctores:
+                doctor.proximo_slot = proximos[doctor.pk]
+            doctores.sort(key=lambda doctor: (doctor.proximo_slot is None, doctor.proximo_slot or ()))
+    
     return render(request, 'citas/lista_doctores.html', {
         'doctores': doctores,
-        'especialidad': especialidad
+        'especialidad': especialidad,
+        'primeros_slots': primeros_slots,
+        'orden': orden,
     })
 
 @login_required
 def disponibilidad_doctor(request, doctor_id):
     """Muestra la disponibilidad del doctor y permite agendar"""
-    doctor = get_object_or_404(Doctor, id=doctor_id)
+    doctor = get_object_or_404(Doctor.objects.select_related('usuario', 'especialidad_principal'), id=doctor_id)
     
     # Obtener horarios del doctor
     horarios = Horario.objects.filter(doctor=doctor, activo=True)
     
-    # Obtener citas ya agendadas (próximos 30 días)
+    # Calcular los horarios libres (próximos 30 días) con la duración de sus
+    # citas y, para el selector de hora, con la de cada tipo de cita
     fecha_inicio = timezone.now().date()
     fecha_fin = fecha_inicio + timedelta(days=30)
-    citas_agendadas = Cita.objects.filter(
+    duracion_base = duracion_cita_doctor(doctor)
+    duraciones = duraciones_por_tipo(doctor, dict(Cita.TIPOS))
+    por_duracion = {
+        duracion: quitar_retenidos(
+            doctor.id,
+            calcular_disponibilidad(doctor, fecha_inicio, fecha_fin, duracion),
+            request.user.id
+        )
+        for duracion in {duracion_base, *duraciones.values()}
+    }
+    disponibilidad = por_duracion[duracion_base]
+    
+    # Slots por tipo de cita y fecha para el selector de hora del formulario
+    slots_por_tipo = {
+        tipo: {
+            fecha.isoformat(): [inicio.strftime('%H:%M') for inicio, fin in slots]
+            for fecha, slots in por_duracion[duracion].items()
+        }
+        for tipo, duracion in duraciones.items()
+    }
+    
+    # Sesiones grupales con lugares libres
+    cupos = CupoGrupal.objects.filter(
         doctor=doctor,
-        fecha__range=[fecha_inicio, fecha_fin]
-    ).exclude(estado='cancelada')
+        activo=True,
+        fecha__range=[fecha_inicio, fecha_fin],
+        disponibles__gt=0
+    )
     
     return render(request, 'citas/disponibilidad_doctor.html', {
         'doctor': doctor,
         'horarios': horarios,
-        'citas_agendadas': citas_agendadas,
+        'cupos': cupos,
+        'disponibilidad': sorted(disponibilidad.items()),
+        'slots_por_tipo': slots_por_tipo,
+        'clave_idempotencia': uuid.uuid4().hex,
         'today': timezone.now().date(), 
     })
 
+@login_required
+@require_POST
+def retener_horario(request, doctor_id):
+    """
+    Retiene por unos minutos el horario elegido mientras se completa el
+    formulario, con la duración del tipo de cita elegido
+    """
+    doctor = get_object_or_404(Doctor.objects.select_related('especialidad_principal'), id=doctor_id)
+    
+    try:
+        fecha = datetime.strptime(request.POST.get('fecha', ''), '%Y-%m-%d').date()
+        hora_inicio = datetime.strptime(request.POST.get('hora_inicio', ''), '%H:%M').time()
+    except ValueError:
+        return JsonResponse({'retenido': False, 'error': 'Fecha u hora inválida.'}, status=400)
+    
+    tipo = request.POST.get('tipo')
+    duracion = duracion_cita_doctor(doctor, tipo if tipo in dict(Cita.TIPOS) else None)
+    hora_fin = calcular_hora_fin(fecha, hora_inicio, duracion)
+    retenido = retener_slot(doctor.id, fecha, hora_inicio, hora_fin, request.user.id)
+    return JsonResponse({
+        'retenido': retenido,
+        'segundos': settings.CITAS_RETENCION_TTL if retenido else 0,
+    })
+
+def responder_solicitud_repetida(request, solicitud):
+    """Repite la respuesta de una reserva ya enviada con la misma clave"""
+    if solicitud.estado == 'completada':
+        # Primera línea: la cita agendada; el resto, conflictos de la serie
+        mensaje, *avisos = solicitud.mensaje.splitlines()
+        for aviso in avisos:
+            messages.warning(request, aviso)
+        messages.success(request, mensaje)
+        return redirect('mis_citas')
+    
+    if solicitud.estado == 'en_cola':
+        return redirect('solicitud_reserva', solicitud_id=solicitud.id)
+    
+    if solicitud.estado == 'rechazada':
+        for error in solicitud.mensaje.splitlines():
+            messages.error(request, error)
+        return redirect('disponibilidad_doctor', doctor_id=solicitud.doctor_id)
+    
+    messages.info(request, 'Tu solicitud de cita se está procesando.')
+    return redirect('mis_citas')
+
+@login_required
+def solicitud_reserva(request, solicitud_id):
+    """Espera el resultado de una reserva en cola y luego lo muestra"""
+    solicitud = get_object_or_404(SolicitudReserva, id=solicitud_id, usuario=request.user)
+    
+    if solicitud.estado in ['en_cola', 'procesando']:
+        return render(request, 'citas/solicitud_reserva.html', {
+            'solicitud': solicitud,
+        })
+    return responder_solicitud_repetida(request, solicitud)
+
+@login_required
+def estado_solicitud(request, solicitud_id):
+    """Estado de una reserva en cola, para la consulta periódica del cliente"""
+    solicitud = get_object_or_404(SolicitudReserva, id=solicitud_id, usuario=request.user)
+    
+    return JsonResponse({
+        'estado': solicitud.estado,
+        'resuelta': solicitud.estado in SolicitudReserva.ESTADOS_RESUELTOS,
+        'posicion': SolicitudReserva.objects.filter(
+            doctor_id=solicitud.doctor_id,
+            estado='en_cola',
+            id__lte=solicitud.id
+        ).count() if solicitud.estado == 'en_cola' else 0,
+    })
+
 @login_required
 def agendar_cita(request, doctor_id):
     """Procesa el formulario para agendar una cita"""
-    doctor = get_object_or_404(Doctor, id=doctor_id)
+    doctor = get_object_or_404(Doctor.objects.select_related('usuario', 'especialidad_principal'), id=doctor_id)
     
     # Verificar que el usuario tenga un perfil de paciente
     try:
@@ -69,61 +201,201 @@ def agendar_cita(request, doctor_id):
         return redirect('home')
     
     if request.method == 'POST':
-        fecha = request.POST.get('fecha')
-        hora_inicio = request.POST.get('hora_inicio')
-        motivo = request.POST.get('motivo')
-        tipo = request.POST.get('tipo', 'primera_vez')
+        en_cola = getattr(settings, 'CITAS_RESERVA_EN_COLA', False)
+        
+        # Un reintento del mismo formulario repite el resultado guardado
+        solicitud = None
+        clave = request.POST.get('clave_idempotencia') or request.headers.get('Idempotency-Key')
+        if en_cola and not clave:
+            clave = uuid.uuid4().hex
+        if clave:
+            solicitud, nueva = registrar_solicitud(clave, request.user, doctor)
+            if not nueva:
+                return responder_solicitud_repetida(request, solicitud)
+        
+        # Modo cola: el consumidor del doctor aplica la reserva y el cliente
+        # espera el resultado en la página de la solicitud
+        if en_cola:
+            encolar_reserva(solicitud, request.POST)
+            return redirect('solicitud_reserva', solicitud_id=solicitud.id)
         
         try:
-            # Convertir a objetos de fecha y hora
-            fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
-            hora_inicio_obj = datetime.strptime(hora_inicio, '%H:%M').time()
-            
-            # Calcular hora_fin (sumar duración de la especialidad)
-            duracion = doctor.especialidades.first().duracion_cita if doctor.especialidades.exists() else 30
-            hora_fin_obj = (datetime.combine(fecha_obj, hora_inicio_obj) + timedelta(minutes=duracion)).time()
+            mensaje, cita, avisos = reservar_desde_formulario(paciente, doctor, request.POST)
             
-            # Crear la cita (se ejecutarán las validaciones automáticamente)
-            cita = Cita(
-                paciente=paciente,
-                doctor=doctor,
-                fecha=fecha_obj,
-                hora_inicio=hora_inicio_obj,
-                hora_fin=hora_fin_obj,
-                tipo=tipo,
-                motivo=motivo,
-                estado='pendiente'
-            )
-            
-            # Validar antes de guardar
-            cita.clean()
-            cita.save()
-            
-            messages.success(request, f'¡Cita agendada exitosamente para el {fecha} a las {hora_inicio}!')
+            for aviso in avisos:
+                messages.warning(request, aviso)
+            # Igual que en cola.py: los avisos van tras el mensaje para los reintentos
+            finalizar_solicitud(solicitud, 'completada', '\n'.join([mensaje, *avisos]), cita)
+            messages.success(request, mensaje)
             return redirect('mis_citas')
             
         except ValidationError as e:
             # Mostrar errores de validación
-            for field, errors in e.message_dict.items():
-                for error in errors:
-                    messages.error(request, error)
+            finalizar_solicitud(solicitud, 'rechazada', '\n'.join(e.messages))
+            for error in e.messages:
+                messages.error(request, error)
             return redirect('disponibilidad_doctor', doctor_id=doctor.id)
         
         except Exception as e:
-            messages.error(request, f'Error al agendar la cita: {str(e)}')
+            mensaje = f'Error al agendar la cita: {str(e)}'
+            finalizar_solicitud(solicitud, 'rechazada', mensaje)
+            messages.error(request, mensaje)
             return redirect('disponibilidad_doctor', doctor_id=doctor.id)
     
     return redirect('disponibilidad_doctor', doctor_id=doctor.id)
 
+@login_required
+def agendar_automatico(request, especialidad_id):
+    """Agenda con cualquier doctor de la especialidad: el menos cargado con horario libre"""
+    especialidad = get_object_or_404(Especialidad, id=especialidad_id)
+    
+    if request.method != 'POST':
+        return redirect('lista_doctores_especialidad', especialidad_id=especialidad.id)
+    
+    # Recepción agenda para un paciente por su DNI; el paciente, para sí mismo
+    dni = request.POST.get('dni')
+    if dni and (request.user.is_staff or request.user.rol == 'recepcionista'):
+        paciente = Paciente.objects.filter(dni=dni).first()
+    else:
+        paciente = getattr(request.user, 'paciente', None)
+    
+    if paciente is None:
+        messages.error(request, 'No se encontró el perfil de paciente para la cita.')
+        return redirect('lista_doctores_especialidad', especialidad_id=especialidad.id)
+    
+    try:
+        fecha_inicio = datetime.strptime(request.POST.get('fecha_inicio'), '%Y-%m-%d').date()
+        fecha_fin_param = request.POST.get('fecha_fin')
+        if fecha_fin_param:
+            fecha_fin = datetime.strptime(fecha_fin_param, '%Y-%m-%d').date()
+        else:
+            fecha_fin = fecha_inicio + timedelta(days=14)
+        # La búsqueda empieza hoy como pronto y abarca a lo sumo HORIZONTE_AUTOMATICO días
+        fecha_inicio = max(fecha_inicio, timezone.now().date())
+        fecha_fin = min(fecha_fin, fecha_inicio + timedelta(days=HORIZONTE_AUTOMATICO))
+        
+        cita = reservar_automatica(
+            paciente,
+            especialidad,
+            fecha_inicio,
+            fecha_fin,
+            request.POST.get('tipo', 'primera_vez'),
+            request.POST.get('motivo')
+        )
+        
+        messages.success(
+            request,
+            f'¡Cita agendada con {cita.doctor} el {cita.fecha} a las {cita.hora_inicio.strftime("%H:%M")}!'
+        )
+        if paciente.usuario_id == request.user.id:
+            return redirect('mis_citas')
+    
+    except ValidationError as e:
+        for error in e.messages:
+            messages.error(request, error)
+    
+    except Exception as e:
+        messages.error(request, f'Error al agendar la cita: {str(e)}')
+    
+    return redirect('lista_doctores_especialidad', especialidad_id=especialidad.id)
+
+@login_required
+@require_POST
+def reservar_cupo(request, cupo_id):
+    """Reserva un lugar en una sesión grupal"""
+    cupo = get_object_or_404(CupoGrupal, id=cupo_id)
+    
+    paciente = getattr(request.user, 'paciente', None)
+    if paciente is None:
+        messages.error(request, 'Debes tener un perfil de paciente para agendar citas.')
+        return redirect('home')
+    
+    try:
+        reservar_en_cupo(paciente, cupo, request.POST.get('motivo') or cupo.descripcion)
+    except ValidationError as e:
+        for error in e.messages:
+            messages.error(request, error)
+        return redirect('disponibilidad_doctor', doctor_id=cupo.doctor_id)
+    
+    messages.success(request, f'¡Lugar reservado en {cupo.descripcion} el {cupo.fecha} a las {cupo.hora_inicio.strftime("%H:%M")}!')
+    return redirect('mis_citas')
+
+@login_required
+@require_POST
+def unirse_lista_espera(request, doctor_id=None, especialidad_id=None):
+    """Anota al paciente en la lista de espera de un doctor o de cualquier doctor de una especialidad"""
+    doctor = get_object_or_404(Doctor, id=doctor_id) if doctor_id else None
+    especialidad = get_object_or_404(Especialidad, id=especialidad_id) if especialidad_id else None
+    if doctor:
+        volver = redirect('disponibilidad_doctor', doctor_id=doctor.id)
+    else:
+        volver = redirect('lista_doctores_especialidad', especialidad_id=especialidad.id)
+    
+    paciente = getattr(request.user, 'paciente', None)
+    if paciente is None:
+        messages.error(request, 'Debes tener un perfil de paciente para anotarte en la lista de espera.')
+        return volver
+    
+    try:
+        fecha_desde = datetime.strptime(request.POST.get('fecha_desde') or request.POST.get('fecha_inicio', ''), '%Y-%m-%d').date()
+        fecha_hasta_param = request.POST.get('fecha_hasta') or request.POST.get('fecha_fin')
+        if fecha_hasta_param:
+            fecha_hasta = datetime.strptime(fecha_hasta_param, '%Y-%m-%d').date()
+        else:
+            fecha_hasta = fecha_desde + timedelta(days=14)
+        
+        entrada = ListaEspera(
+            paciente=paciente,
+            doctor=doctor,
+            especialidad=especialidad,
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            tipo=request.POST.get('tipo', 'primera_vez'),
+            motivo=request.POST.get('motivo')
+        )
+        entrada.full_clean()
+        entrada.save()
+    
+    except ValueError:
+        messages.error(request, 'Fecha inválida.')
+        return volver
+    
+    except ValidationError as e:
+        for error in e.messages:
+            messages.error(request, error)
+        return volver
+    
+    messages.success(request, 'Te anotamos en la lista de espera. Si se libera un horario te agendaremos la cita automáticamente.')
+    return redirect('mis_citas')
+
+@login_required
+def salir_lista_espera(request, entrada_id):
+    """Saca al paciente de la lista de espera"""
+    entrada = get_object_or_404(ListaEspera, id=entrada_id)
+    
+    if not hasattr(request.user, 'paciente') or entrada.paciente != request.user.paciente:
+        messages.error(request, 'No tienes permiso para modificar esta entrada.')
+        return redirect('home')
+    
+    if ListaEspera.objects.filter(pk=entrada.pk, estado='esperando').update(estado='cancelada'):
+        messages.success(request, 'Saliste de la lista de espera.')
+    else:
+        messages.error(request, 'Esta entrada ya no está en espera.')
+    return redirect('mis_citas')
+
 @login_required
 def mis_citas(request):
     """Muestra las citas del paciente"""
     try:
         paciente = request.user.paciente
         citas = Cita.objects.filter(paciente=paciente).order_by('-fecha', '-hora_inicio')
+        lista_espera = paciente.lista_espera.filter(estado='esperando').select_related(
+            'doctor__usuario', 'especialidad'
+        )
         
         return render(request, 'citas/mis_citas.html', {
-            'citas': citas
+            'citas': citas,
+            'lista_espera': lista_espera,
         })
     except:
         messages.error(request, 'No tienes un perfil de paciente.')
@@ -150,9 +422,7 @@ def cancelar_cita(request, cita_id):
     
     # Verificar que el usuario sea el dueño de la cita
     if hasattr(request.user, 'paciente') and cita.paciente == request.user.paciente:
-        if cita.estado in ['pendiente', 'confirmada']:
-            cita.estado = 'cancelada'
-            cita.save()
+        if cita.estado in ['pendiente', 'confirmada'] and cita.transicionar('cancelada'):
             messages.success(request, 'Cita cancelada exitosamente.')
         else:
             messages.error(request, 'No se puede cancelar esta cita.')
@@ -0,0 +1,14 @@
+"""
+Configuración de Celery para las tareas en segundo plano.
+
+Worker y programador de tareas (beat):
+    celery -A config worker -B -l info
+"""
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
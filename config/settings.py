@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Apps del proyecto
     'usuarios',
@@ -176,6 +178,64 @@ LOGIN_URL = '/usuarios/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/usuarios/login/'
 
+# Caché compartida: Redis en producción, memoria local en desarrollo y pruebas
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Citas
+# Segundos durante los que un reintento del formulario de reserva repite el resultado guardado
+CITAS_IDEMPOTENCIA_TTL = 600
+# Segundos que un slot queda retenido para el paciente que lo eligió
+CITAS_RETENCION_TTL = 300
+# Tipos de cita que pueden solaparse con otras citas del mismo paciente
+CITAS_TIPOS_SOLAPAMIENTO_PACIENTE = ['telemedicina']
+# Encolar las reservas por doctor y aplicarlas con un solo consumidor por
+# doctor (para horas pico); el formulario espera el resultado consultándolo
+CITAS_RESERVA_EN_COLA = os.environ.get('CITAS_RESERVA_EN_COLA', 'False') == 'True'
+
+# Celery (tareas en segundo plano)
+CELERY_BROKER_URL = REDIS_URL or 'redis://localhost:6379/0'
+CELERY_TIMEZONE = TIME_ZONE
+# Sin Redis (desarrollo) las tareas se ejecutan en el mismo proceso
+CELERY_TASK_ALWAYS_EAGER = not REDIS_URL
+CELERY_BEAT_SCHEDULE = {
+    # Todas las noches se cierran las citas de días pasados que quedaron abiertas
+    'cerrar-citas-vencidas': {
+        'task': 'citas.tasks.cerrar_citas_vencidas',
+        'schedule': crontab(hour=1, minute=0),
+    },
+    # Solicitudes de reserva que un consumidor caído dejó sin resolver
+    'recuperar-solicitudes-reserva': {
+        'task': 'citas.tasks.recuperar_solicitudes_reserva',
+        'schedule': crontab(minute='*/5'),
+    },
+    'purgar-solicitudes-reserva': {
+        'task': 'citas.tasks.purgar_solicitudes_reserva',
+        'schedule': crontab(minute=0),
+    },
+    'purgar-ocupacion': {
+        'task': 'citas.tasks.purgar_ocupacion',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'vencer-lista-espera': {
+        'task': 'citas.tasks.vencer_lista_espera',
+        'schedule': crontab(hour=1, minute=45),
+    },
+}
+
 # Configuraciones de seguridad para producción
 if not DEBUG:
     # Railway maneja HTTPS en el proxy, no forzar redirect
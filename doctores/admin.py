@@ -3,7 +3,8 @@ from .models import Doctor
 
 @admin.register(Doctor)
 class DoctorAdmin(admin.ModelAdmin):
-    list_display = ['get_nombre', 'licencia_medica', 'anos_experiencia', 'activo']
+    list_display = ['get_nombre', 'licencia_medica', 'especialidad_principal', 'anos_experiencia', 'activo']
+    list_select_related = ['usuario', 'especialidad_principal']
     list_filter = ['activo', 'especialidades']
     search_fields = ['usuario__first_name', 'usuario__last_name', 'licencia_medica']
     filter_horizontal = ['especialidades']
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DoctoresConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'doctores'
+
+    def ready(self):
+        # Registrar el ajuste de la especialidad principal
+        from . import signals  # noqa: F401
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def asignar_especialidad_principal(apps, schema_editor):
+    """La especialidad principal de cada doctor es la primera por nombre (la que se usaba antes)"""
+    Doctor = apps.get_model('doctores', 'Doctor')
+    for doctor in Doctor.objects.filter(especialidad_principal__isnull=True):
+        principal = doctor.especialidades.order_by('nombre').first()
+        if principal:
+            doctor.especialidad_principal = principal
+            doctor.save(update_fields=['especialidad_principal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctores', '0002_initial'),
+        ('especialidades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='duraciones',
+            field=models.JSONField(blank=True, default=dict, help_text='Duración en minutos por tipo de cita, p. ej. {"primera_vez": 45}'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='especialidad_principal',
+            field=models.ForeignKey(blank=True, help_text='Define la duración de sus citas', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='doctores_principales', to='especialidades.especialidad'),
+        ),
+        migrations.RunPython(asignar_especialidad_principal, migrations.RunPython.noop),
+    ]
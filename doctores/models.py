@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from usuarios.models import Usuario
 from especialidades.models import Especialidad
@@ -5,6 +6,19 @@ from especialidades.models import Especialidad
 class Doctor(models.Model):
     usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, related_name='doctor')
     especialidades = models.ManyToManyField(Especialidad, related_name='doctores')
+    especialidad_principal = models.ForeignKey(
+        Especialidad,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='doctores_principales',
+        help_text="Define la duración de sus citas"
+    )
+    duraciones = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Duración en minutos por tipo de cita, p. ej. {\"primera_vez\": 45}"
+    )
     licencia_medica = models.CharField(max_length=50, unique=True)
     biografia = models.TextField(blank=True, null=True)
     anos_experiencia = models.IntegerField(default=0)
@@ -17,4 +31,12 @@ class Doctor(models.Model):
         verbose_name_plural = "Doctores"
 
     def __str__(self):
-        return f"Dr. {self.usuario.get_full_name()}"
\ No newline at end of file
+        return f"Dr. {self.usuario.get_full_name()}"
+
+    def clean(self):
+        if not isinstance(self.duraciones, dict) or not all(
+            isinstance(minutos, int) and minutos > 0 for minutos in self.duraciones.values()
+        ):
+            raise ValidationError({
+                'duraciones': 'Las duraciones deben ser minutos enteros positivos por tipo de cita.'
+            })
\ No newline at end of file
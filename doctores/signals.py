@@ -0,0 +1,28 @@
+"""Mantiene la especialidad principal del doctor entre sus especialidades"""
+from django.db.models.signals import m2m_changed
+from .models import Doctor
+
+
+def ajustar_especialidad_principal(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Asigna la primera especialidad como principal a los doctores que no
+    tienen una y la reemplaza si se les quita.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        doctores = Doctor.objects.filter(pk__in=pk_set) if pk_set else instance.doctores.all()
+        if action != 'post_add':
+            doctores = Doctor.objects.filter(especialidad_principal=instance)
+    else:
+        doctores = [instance]
+
+    for doctor in doctores:
+        if doctor.especialidad_principal_id and doctor.especialidades.filter(pk=doctor.especialidad_principal_id).exists():
+            continue
+        principal = doctor.especialidades.order_by('nombre').values_list('pk', flat=True).first()
+        Doctor.objects.filter(pk=doctor.pk).update(especialidad_principal_id=principal)
+        doctor.especialidad_principal_id = principal
+
+
+m2m_changed.connect(ajustar_especialidad_principal, sender=Doctor.especialidades.through)
@@ -6,7 +6,9 @@ from datetime import datetime, timedelta
 from django.db.models import Q, Count
 from .models import Doctor
 from citas.models import Cita
-from horarios.models import Horario, Excepcion
+from horarios.models import Recurso, Horario, Excepcion
+from horarios.reglas import REGLAS_PREDEFINIDAS, DIAS_RRULE, CAMPOS_REGLA, se_cruzan
+from citas.reprogramacion import citas_afectadas, proponer_reprogramacion, aplicar_reprogramacion, firma_propuestas
 from pacientes.models import Paciente
 from django.db.models import Q
 
@@ -142,14 +144,22 @@ def atender_cita(request, cita_id):
         diagnostico = request.POST.get('diagnostico')
         tratamiento = request.POST.get('tratamiento')
         
+        if not cita.puede_transicionar('completada'):
+            messages.error(request, f'No se puede atender una cita {cita.get_estado_display().lower()}.')
+            return redirect('dashboard_doctor')
+        
         # Actualizar cita
-        cita.notas = notas
-        cita.diagnostico = diagnostico
-        cita.tratamiento = tratamiento
-        cita.estado = 'completada'
-        cita.save()
+        atendida = cita.transicionar(
+            'completada',
+            notas=notas,
+            diagnostico=diagnostico,
+            tratamiento=tratamiento
+        )
         
-        messages.success(request, 'Cita atendida exitosamente.')
+        if atendida:
+            messages.success(request, 'Cita atendida exitosamente.')
+        else:
+            messages.error(request, 'La cita cambió de estado mientras se atendía. Revisa su estado actual.')
         return redirect('dashboard_doctor')
     
     return render(request, 'doctores/atender_cita.html', {'cita': cita})
@@ -236,14 +246,43 @@ def gestionar_horarios(request):
         hora_inicio = request.POST.get('hora_inicio')
         hora_fin = request.POST.get('hora_fin')
         
-        # Validar que no exista conflicto
-        conflicto = Horario.objects.filter(
-            doctor=doctor,
-            dia_semana=dia_semana,
-            activo=True
-        ).filter(
-            Q(hora_inicio__lt=hora_fin, hora_fin__gt=hora_inicio)
-        ).exists()
+        if dia_semana not in ('0', '1', '2', '3', '4', '5', '6'):
+            messages.error(request, 'Día de la semana inválido.')
+            return redirect('gestionar_horarios')
+        
+        # Repetición distinta de "todas las semanas" (regla RRULE). La regla
+        # se cuenta desde la semana elegida (p. ej. la otra semana de un
+        # turno alterno); por defecto desde hoy
+        regla, regla_desde = '', None
+        repeticion = request.POST.get('repeticion')
+        if repeticion in REGLAS_PREDEFINIDAS:
+            regla = REGLAS_PREDEFINIDAS[repeticion][1].format(dia=DIAS_RRULE[int(dia_semana)])
+            try:
+                regla_desde = datetime.strptime(request.POST.get('regla_desde', ''), '%Y-%m-%d').date()
+            except ValueError:
+                regla_desde = timezone.now().date()
+        
+        # Consultorio o equipo del turno (opcional)
+        recurso = Recurso.objects.filter(pk=request.POST.get('recurso') or None, activo=True).first()
+        
+        # Validar que no exista conflicto: mismas horas el mismo día y, si
+        # alguno tiene regla, alguna fecha en común
+        nuevo = {
+            'dia_semana': int(dia_semana),
+            'regla': regla,
+            'regla_desde': regla_desde,
+            'created_at': timezone.now(),
+        }
+        conflicto = any(
+            se_cruzan(nuevo, existente, timezone.now().date())
+            for existente in Horario.objects.filter(
+                doctor=doctor,
+                dia_semana=dia_semana,
+                activo=True
+            ).filter(
+                Q(hora_inicio__lt=hora_fin, hora_fin__gt=hora_inicio)
+            ).values(*CAMPOS_REGLA)
+        )
         
         if conflicto:
             messages.error(request, 'Ya existe un horario que se solapa con este.')
@@ -253,19 +292,24 @@ def gestionar_horarios(request):
                 dia_semana=dia_semana,
                 hora_inicio=hora_inicio,
                 hora_fin=hora_fin,
+                regla=regla,
+                regla_desde=regla_desde,
+                recurso=recurso,
                 activo=True
             )
             messages.success(request, 'Horario agregado exitosamente.')
         
         return redirect('gestionar_horarios')
     
-    horarios = Horario.objects.filter(doctor=doctor).order_by('dia_semana', 'hora_inicio')
+    horarios = Horario.objects.filter(doctor=doctor).select_related('recurso').order_by('dia_semana', 'hora_inicio')
     excepciones = Excepcion.objects.filter(doctor=doctor).order_by('-fecha_inicio')
     
     context = {
         'doctor': doctor,
         'horarios': horarios,
         'excepciones': excepciones,
+        'reglas_predefinidas': [(clave, nombre) for clave, (nombre, regla) in REGLAS_PREDEFINIDAS.items()],
+        'recursos': Recurso.objects.filter(activo=True),
     }
     
     return render(request, 'doctores/gestionar_horarios.html', context)
@@ -301,7 +345,7 @@ def agregar_excepcion(request):
         motivo = request.POST.get('motivo')
         descripcion = request.POST.get('descripcion')
         
-        Excepcion.objects.create(
+        excepcion = Excepcion.objects.create(
             doctor=doctor,
             fecha_inicio=fecha_inicio,
             fecha_fin=fecha_fin,
@@ -310,10 +354,52 @@ def agregar_excepcion(request):
         )
         
         messages.success(request, 'Excepción agregada exitosamente.')
+        
+        # Si quedaron citas dentro de la excepción, mostrar cómo reprogramarlas
+        if citas_afectadas(doctor, excepcion.fecha_inicio, excepcion.fecha_fin).exists():
+            return redirect('impacto_excepcion', excepcion_id=excepcion.id)
         return redirect('gestionar_horarios')
     
     return redirect('gestionar_horarios')
 
+@login_required
+def impacto_excepcion(request, excepcion_id):
+    """Citas afectadas por una excepción y reprogramación de todas en bloque"""
+    excepcion = get_object_or_404(Excepcion.objects.select_related('doctor__usuario'), id=excepcion_id)
+    
+    # El doctor de la excepción o recepción
+    es_recepcion = request.user.is_staff or request.user.rol == 'recepcionista'
+    if not es_recepcion and getattr(request.user, 'doctor', None) != excepcion.doctor:
+        messages.error(request, 'No tienes permiso para ver esta excepción.')
+        return redirect('home')
+    
+    citas = list(citas_afectadas(excepcion.doctor, excepcion.fecha_inicio, excepcion.fecha_fin))
+    propuestas = proponer_reprogramacion(excepcion.doctor, citas, desde=excepcion.fecha_inicio)
+    
+    if request.method == 'POST':
+        # Solo se aplican los horarios que el usuario confirmó
+        if request.POST.get('firma') != firma_propuestas(propuestas):
+            messages.warning(request, 'Los horarios disponibles cambiaron. Revisa la nueva propuesta antes de confirmar.')
+            return redirect('impacto_excepcion', excepcion_id=excepcion.id)
+        movidas, fallidas = aplicar_reprogramacion(propuestas)
+        if movidas:
+            messages.success(request, f'{len(movidas)} cita(s) reprogramada(s).')
+        for cita, error in fallidas:
+            messages.warning(
+                request,
+                f'No se pudo reprogramar la cita de {cita.paciente} del {cita.fecha} a las {cita.hora_inicio.strftime("%H:%M")}: {error}'
+            )
+        return redirect('impacto_excepcion', excepcion_id=excepcion.id)
+    
+    context = {
+        'excepcion': excepcion,
+        'propuestas': propuestas,
+        'firma': firma_propuestas(propuestas),
+        'sin_horario': sum(1 for propuesta in propuestas if propuesta.doctor is None),
+    }
+    
+    return render(request, 'doctores/impacto_excepcion.html', context)
+
 @login_required
 def confirmar_cita(request, cita_id):
     """Confirmar una cita pendiente"""
@@ -321,12 +407,10 @@ def confirmar_cita(request, cita_id):
     
     try:
         if cita.doctor == request.user.doctor:
-            if cita.estado == 'pendiente':
-                cita.estado = 'confirmada'
-                cita.save()
+            if cita.estado == 'pendiente' and cita.transicionar('confirmada'):
                 messages.success(request, 'Cita confirmada exitosamente.')
             else:
-                messages.info(request, 'La cita ya ha sido confirmada.')
+                messages.info(request, 'La cita ya no está pendiente de confirmación.')
         else:
             messages.error(request, 'No tienes permiso para confirmar esta cita.')
     except:
@@ -341,9 +425,10 @@ def marcar_no_asistio(request, cita_id):
     
     try:
         if cita.doctor == request.user.doctor:
-            cita.estado = 'no_asistio'
-            cita.save()
-            messages.success(request, 'Cita marcada como "No asistió".')
+            if cita.puede_transicionar('no_asistio') and cita.transicionar('no_asistio'):
+                messages.success(request, 'Cita marcada como "No asistió".')
+            else:
+                messages.error(request, f'No se puede marcar como "No asistió" una cita {cita.get_estado_display().lower()}.')
         else:
             messages.error(request, 'No tienes permiso para modificar esta cita.')
     except:
@@ -351,6 +436,46 @@ def marcar_no_asistio(request, cita_id):
     
     return redirect('dashboard_doctor')
 
+@login_required
+def confirmar_citas_dia(request):
+    """
+    Confirmar todas las citas pendientes de un día: el doctor su propia
+    agenda, o recepción la del doctor indicado en doctor_id
+    """
+    es_recepcion = request.user.is_staff or request.user.rol == 'recepcionista'
+    if es_recepcion and request.POST.get('doctor_id'):
+        doctor_id = request.POST['doctor_id']
+        doctor = Doctor.objects.filter(pk=doctor_id).first() if doctor_id.isdigit() else None
+        volver = 'lista_doctores'
+        if doctor is None:
+            messages.error(request, 'Doctor no encontrado.')
+            return redirect(volver)
+    else:
+        try:
+            doctor = request.user.doctor
+        except:
+            messages.error(request, 'No tienes un perfil de doctor.')
+            return redirect('home')
+        volver = 'agenda_doctor'
+    
+    if request.method == 'POST':
+        try:
+            fecha = datetime.strptime(request.POST.get('fecha', ''), '%Y-%m-%d').date()
+        except ValueError:
+            messages.error(request, 'Fecha inválida.')
+            return redirect(volver)
+        
+        # Un solo UPDATE para toda la agenda del día
+        confirmadas = Cita.objects.filter(
+            doctor=doctor,
+            fecha=fecha,
+            estado='pendiente'
+        ).transicionar('confirmada')
+        
+        messages.success(request, f'{confirmadas} cita(s) confirmada(s) de {doctor} para el {fecha}.')
+    
+    return redirect(volver)
+
 
 @login_required
 def buscar_doctores(request):
@@ -1,10 +1,17 @@
 from django.contrib import admin
-from .models import Horario, Excepcion
+from .models import Recurso, Horario, Excepcion, Cierre
+
+@admin.register(Recurso)
+class RecursoAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'tipo', 'activo']
+    list_filter = ['tipo', 'activo']
+    search_fields = ['nombre']
 
 @admin.register(Horario)
 class HorarioAdmin(admin.ModelAdmin):
-    list_display = ['doctor', 'get_dia', 'hora_inicio', 'hora_fin', 'activo']
-    list_filter = ['dia_semana', 'activo']
+    list_display = ['doctor', 'get_dia', 'hora_inicio', 'hora_fin', 'regla', 'recurso', 'activo']
+    list_filter = ['dia_semana', 'recurso', 'activo']
+    list_select_related = ['doctor__usuario', 'recurso']
     search_fields = ['doctor__usuario__first_name', 'doctor__usuario__last_name']
     
     def get_dia(self, obj):
@@ -15,4 +22,10 @@ class HorarioAdmin(admin.ModelAdmin):
 class ExcepcionAdmin(admin.ModelAdmin):
     list_display = ['doctor', 'motivo', 'fecha_inicio', 'fecha_fin']
     list_filter = ['motivo']
-    search_fields = ['doctor__usuario__first_name', 'doctor__usuario__last_name']
\ No newline at end of file
+    search_fields = ['doctor__usuario__first_name', 'doctor__usuario__last_name']
+
+@admin.register(Cierre)
+class CierreAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'especialidad', 'fecha_inicio', 'fecha_fin']
+    list_filter = ['especialidad']
+    search_fields = ['nombre']
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HorariosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'horarios'
+
+    def ready(self):
+        # Registrar la limpieza del calendario de cierres
+        from . import cierres  # noqa: F401
@@ -0,0 +1,95 @@
+"""
+Calendario de cierres de la clínica (feriados, cierres por especialidad).
+
+Cambia muy poco, así que cada proceso lo guarda en memoria junto con la
+versión compartida del calendario (la misma que lleva la caché de
+disponibilidad). Al guardar o borrar un Cierre esa versión se borra tras el
+commit y cada proceso vuelve a leer el calendario en su siguiente uso, así
+nadie calcula disponibilidad nueva con un calendario viejo.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from .models import Cierre
+
+# Vida máxima de la versión compartida; si vence, todos releen el calendario
+VERSION_TTL = 24 * 3600
+
+_calendario = {'cierres': None, 'version': None}
+
+
+def clave_version_cierres():
+    """Clave de la versión compartida del calendario de cierres"""
+    return 'citas:disponibilidad:v:cierres'
+
+
+def version_cierres():
+    """Versión vigente del calendario de cierres; la crea si no existe"""
+    clave = clave_version_cierres()
+    version = cache.get(clave)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(clave, version, VERSION_TTL):
+            # Otro proceso la creó a la vez: se usa la suya
+            version = cache.get(clave, version)
+    return version
+
+
+def calendario_cierres():
+    """
+    Cierres vigentes agrupados por especialidad (None = toda la clínica).
+    La versión se lee antes que los cierres: si el calendario cambia
+    mientras tanto, la copia queda con la versión vieja y se relee.
+    """
+    version = version_cierres()
+    if _calendario['cierres'] is None or _calendario['version'] != version:
+        cierres = defaultdict(list)
+        for especialidad_id, inicio, fin, nombre in Cierre.objects.filter(
+            fecha_fin__gte=timezone.now().date() - timedelta(days=1)
+        ).values_list('especialidad_id', 'fecha_inicio', 'fecha_fin', 'nombre'):
+            cierres[especialidad_id].append((inicio, fin, nombre))
+        _calendario['cierres'] = dict(cierres)
+        _calendario['version'] = version
+    return _calendario['cierres']
+
+
+def limpiar_calendario():
+    """Descarta el calendario en memoria del proceso"""
+    _calendario['cierres'] = None
+
+
+def cierre_modificado(sender, **kwargs):
+    """Descarta el calendario cuando se confirme el cambio de un cierre"""
+    transaction.on_commit(limpiar_calendario)
+
+
+def hay_cierres_por_especialidad(fecha_inicio, fecha_fin):
+    """Indica si algún cierre de especialidad toca el rango de fechas"""
+    return any(
+        inicio <= fecha_fin and fin >= fecha_inicio
+        for especialidad_id, cierres in calendario_cierres().items()
+        if especialidad_id is not None
+        for inicio, fin, nombre in cierres
+    )
+
+
+def cierres_en(fecha_inicio, fecha_fin, especialidad_ids=()):
+    """
+    Cierres de toda la clínica y de las especialidades dadas que tocan el
+    rango: [(fecha_inicio, fecha_fin, nombre), ...] con fechas incluidas.
+    """
+    calendario = calendario_cierres()
+    return [
+        (inicio, fin, nombre)
+        for especialidad_id in [None, *especialidad_ids]
+        for inicio, fin, nombre in calendario.get(especialidad_id, [])
+        if inicio <= fecha_fin and fin >= fecha_inicio
+    ]
+
+
+post_save.connect(cierre_modificado, sender=Cierre)
+post_delete.connect(cierre_modificado, sender=Cierre)
@@ -0,0 +1,237 @@
+"""Índices de intervalos para consultar horarios y excepciones en memoria"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import time, timedelta
+from doctores.models import Doctor
+from .models import Horario, Excepcion
+from .cierres import cierres_en, hay_cierres_por_especialidad
+from .reglas import CAMPOS_REGLA, expandir_reglas
+
+
+def a_minutos(hora):
+    """Convierte un time en minutos desde la medianoche"""
+    return hora.hour * 60 + hora.minute
+
+
+def a_hora(minutos):
+    """Convierte minutos desde la medianoche en un time"""
+    return time(minutos // 60, minutos % 60)
+
+
+class IndiceIntervalos:
+    """
+    Intervalos semiabiertos [inicio, fin) ordenados y fusionados, con
+    búsqueda binaria. Sirve para cualquier valor ordenable (minutos, fechas).
+    Cada intervalo puede llevar un dato; al fusionar se conserva el primero.
+    """
+
+    def __init__(self, intervalos=()):
+        self.inicios, self.fines, self.datos = [], [], []
+        for intervalo in sorted(intervalos, key=lambda intervalo: intervalo[:2]):
+            inicio, fin = intervalo[:2]
+            dato = intervalo[2] if len(intervalo) > 2 else None
+            if inicio >= fin:
+                continue
+            if self.fines and inicio <= self.fines[-1]:
+                self.fines[-1] = max(self.fines[-1], fin)
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+                self.datos.append(dato)
+
+    def __bool__(self):
+        return bool(self.inicios)
+
+    def __iter__(self):
+        return iter(zip(self.inicios, self.fines))
+
+    def _posicion(self, punto):
+        """Índice del intervalo que contiene el punto, o None"""
+        i = bisect_right(self.inicios, punto) - 1
+        if i >= 0 and punto < self.fines[i]:
+            return i
+        return None
+
+    def contiene(self, punto):
+        """Indica si el punto cae dentro de algún intervalo"""
+        return self._posicion(punto) is not None
+
+    def solapado(self, inicio, fin):
+        """Primer intervalo (inicio, fin) que se cruza con [inicio, fin), o None"""
+        i = bisect_right(self.inicios, inicio) - 1
+        if i >= 0 and inicio < self.fines[i]:
+            return self.inicios[i], self.fines[i]
+        if i + 1 < len(self.inicios) and self.inicios[i + 1] < fin:
+            return self.inicios[i + 1], self.fines[i + 1]
+        return None
+
+    def dato(self, punto):
+        """Dato del intervalo que contiene el punto, o None"""
+        i = self._posicion(punto)
+        return None if i is None else self.datos[i]
+
+    def siguiente(self, punto, largo):
+        """
+        Primer tramo (inicio, inicio + largo) que empieza en el punto o después
+        y cabe en un intervalo, o None. Los tramos se cuentan desde el
+        comienzo de cada intervalo, como los slots de dividir_en_slots.
+        """
+        i = max(bisect_right(self.inicios, punto) - 1, 0)
+        for inicio, fin in zip(self.inicios[i:], self.fines[i:]):
+            if punto > inicio:
+                inicio += -(-(punto - inicio) // largo) * largo
+            if inicio + largo <= fin:
+                return inicio, inicio + largo
+        return None
+
+
+class IndiceHorario:
+    """Turnos (en minutos) con su recurso, excepciones y cierres (por fecha) de un doctor"""
+
+    def __init__(self, turnos=(), excepciones=(), cierres=(), turnos_fecha=()):
+        """
+        turnos:       [(dia_semana, hora_inicio, hora_fin[, recurso_id]), ...] semanales
+        excepciones:  [(fecha_inicio, fecha_fin, motivo), ...] con fechas incluidas
+        cierres:      [(fecha_inicio, fecha_fin, nombre), ...] con fechas incluidas
+        turnos_fecha: [(fecha, hora_inicio, hora_fin[, recurso_id]), ...] de horarios con regla
+        """
+        por_dia = defaultdict(list)
+        for dia_semana, hora_inicio, hora_fin, *recurso in turnos:
+            por_dia[dia_semana].append((a_minutos(hora_inicio), a_minutos(hora_fin), *recurso[:1]))
+        por_fecha = defaultdict(list)
+        for fecha, hora_inicio, hora_fin, *recurso in turnos_fecha:
+            por_fecha[fecha].append((a_minutos(hora_inicio), a_minutos(hora_fin), *recurso[:1]))
+        # Los turnos con fecha se suman a los semanales de ese día
+        for fecha, intervalos in por_fecha.items():
+            intervalos.extend(por_dia.get(fecha.weekday(), []))
+        self.turnos = {dia: IndiceIntervalos(intervalos) for dia, intervalos in por_dia.items()}
+        self.turnos_fecha = {fecha: IndiceIntervalos(intervalos) for fecha, intervalos in por_fecha.items()}
+        # Los recursos se guardan aparte: dos turnos seguidos en consultorios
+        # distintos se fusionan en el índice de turnos pero no aquí
+        self.recursos = {
+            dia: [(inicio, fin, resto[0]) for inicio, fin, *resto in intervalos if resto and resto[0]]
+            for dia, intervalos in por_dia.items()
+        }
+        self.recursos_fecha = {
+            fecha: [(inicio, fin, resto[0]) for inicio, fin, *resto in intervalos if resto and resto[0]]
+            for fecha, intervalos in por_fecha.items()
+        }
+        self.excepciones = IndiceIntervalos(
+            (inicio, fin + timedelta(days=1), motivo) for inicio, fin, motivo in excepciones
+        )
+        self.cierres = IndiceIntervalos(
+            (inicio, fin + timedelta(days=1), nombre) for inicio, fin, nombre in cierres
+        )
+
+    def turnos_en(self, fecha):
+        """Índice de los turnos de la fecha (vacío si no trabaja)"""
+        if fecha in self.turnos_fecha:
+            return self.turnos_fecha[fecha]
+        return self.turnos.get(fecha.weekday(), IndiceIntervalos())
+
+    def recursos_en(self, fecha):
+        """Turnos de la fecha que usan un recurso: [(inicio, fin, recurso_id), ...] en minutos"""
+        if fecha in self.recursos_fecha:
+            return self.recursos_fecha[fecha]
+        return self.recursos.get(fecha.weekday(), [])
+
+    def recurso(self, fecha, hora):
+        """Recurso del turno en el que cae la hora ese día, o None"""
+        minutos = a_minutos(hora)
+        for inicio, fin, recurso_id in self.recursos_en(fecha):
+            if inicio <= minutos < fin:
+                return recurso_id
+        return None
+
+    def trabaja(self, fecha):
+        """Indica si el doctor tiene turnos en la fecha"""
+        return bool(self.turnos_en(fecha))
+
+    def en_turno(self, fecha, hora):
+        """Indica si la hora cae dentro de un turno del doctor ese día"""
+        return self.turnos_en(fecha).contiene(a_minutos(hora))
+
+    def excepcion(self, fecha):
+        """Motivo de la excepción que bloquea la fecha, o None"""
+        return self.excepciones.dato(fecha)
+
+    def cierre(self, fecha):
+        """Nombre del cierre de la clínica o la especialidad en la fecha, o None"""
+        return self.cierres.dato(fecha)
+
+
+def especialidades_por_doctor(doctor_ids):
+    """Especialidades de cada doctor: {doctor_id: [especialidad_id, ...]}"""
+    especialidades = defaultdict(list)
+    for doctor_id, especialidad_id in Doctor.especialidades.through.objects.filter(
+        doctor_id__in=doctor_ids
+    ).values_list('doctor_id', 'especialidad_id'):
+        especialidades[doctor_id].append(especialidad_id)
+    return especialidades
+
+
+def cierres_por_doctor(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Cierres del calendario (cierres.py) que afectan a cada doctor en el rango.
+    Solo consulta las especialidades de los doctores si hay algún cierre de
+    especialidad en esas fechas.
+    """
+    especialidades = {}
+    if hay_cierres_por_especialidad(fecha_inicio, fecha_fin):
+        especialidades = especialidades_por_doctor(doctor_ids)
+    return {
+        doctor_id: cierres_en(fecha_inicio, fecha_fin, especialidades.get(doctor_id, []))
+        for doctor_id in doctor_ids
+    }
+
+
+def separar_horarios(horarios, fecha_inicio, fecha_fin):
+    """
+    Separa filas de Horario (dicts con CAMPOS_REGLA) en turnos semanales
+    {doctor_id: [(dia_semana, hora_inicio, hora_fin, recurso_id), ...]} y
+    turnos con fecha de las reglas expandidas
+    {doctor_id: [(fecha, hora_inicio, hora_fin, recurso_id), ...]}.
+    """
+    semanales = defaultdict(list)
+    con_regla = []
+    for horario in horarios:
+        if horario['regla']:
+            con_regla.append(horario)
+        else:
+            semanales[horario['doctor_id']].append(
+                (horario['dia_semana'], horario['hora_inicio'], horario['hora_fin'], horario['recurso_id'])
+            )
+    return semanales, expandir_reglas(con_regla, fecha_inicio, fecha_fin)
+
+
+def cargar_indices(doctor_ids, fecha_inicio, fecha_fin):
+    """
+    Índices de horario de varios doctores en dos consultas: turnos activos y
+    excepciones que tocan el rango de fechas, más los cierres del calendario
+    en memoria y las reglas expandidas en caché. Devuelve {doctor_id: IndiceHorario}.
+    """
+    turnos, turnos_fecha = separar_horarios(
+        Horario.objects.filter(doctor_id__in=doctor_ids, activo=True).values(*CAMPOS_REGLA),
+        fecha_inicio,
+        fecha_fin
+    )
+
+    excepciones = defaultdict(list)
+    for doctor_id, inicio, fin, motivo in Excepcion.objects.filter(
+        doctor_id__in=doctor_ids,
+        fecha_inicio__lte=fecha_fin,
+        fecha_fin__gte=fecha_inicio
+    ).values_list('doctor_id', 'fecha_inicio', 'fecha_fin', 'motivo'):
+        excepciones[doctor_id].append((inicio, fin, motivo))
+
+    cierres = cierres_por_doctor(doctor_ids, fecha_inicio, fecha_fin)
+
+    return {
+        doctor_id: IndiceHorario(
+            turnos[doctor_id],
+            excepciones[doctor_id],
+            cierres[doctor_id],
+            turnos_fecha[doctor_id]
+        )
+        for doctor_id in doctor_ids
+    }
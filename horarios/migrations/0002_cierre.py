@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('especialidades', '0001_initial'),
+        ('horarios', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cierre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('fecha_inicio', models.DateField()),
+                ('fecha_fin', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('especialidad', models.ForeignKey(blank=True, help_text='Vacío para toda la clínica', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cierres', to='especialidades.especialidad')),
+            ],
+            options={
+                'verbose_name': 'Cierre',
+                'verbose_name_plural': 'Cierres',
+                'ordering': ['fecha_inicio'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('horarios', '0002_cierre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='horario',
+            name='regla',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='horario',
+            name='regla_desde',
+            field=models.DateField(blank=True, help_text='Fecha desde la que se cuenta la regla', null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('horarios', '0003_horario_regla'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recurso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('tipo', models.CharField(choices=[('consultorio', 'Consultorio'), ('equipo', 'Equipo')], default='consultorio', max_length=20)),
+                ('descripcion', models.TextField(blank=True, null=True)),
+                ('activo', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Recurso',
+                'verbose_name_plural': 'Recursos',
+                'ordering': ['tipo', 'nombre'],
+            },
+        ),
+        migrations.AddField(
+            model_name='horario',
+            name='recurso',
+            field=models.ForeignKey(blank=True, help_text='Consultorio o equipo que usa el doctor en este turno', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='horarios', to='horarios.recurso'),
+        ),
+    ]
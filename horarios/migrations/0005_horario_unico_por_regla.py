@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctores', '0003_especialidad_principal_duraciones'),
+        ('horarios', '0004_recursos'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='horario',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='horario',
+            constraint=models.UniqueConstraint(condition=models.Q(('regla', '')), fields=('doctor', 'dia_semana', 'hora_inicio'), name='horario_unico_semanal'),
+        ),
+        migrations.AddConstraint(
+            model_name='horario',
+            constraint=models.UniqueConstraint(condition=models.Q(('regla', ''), _negated=True), fields=('doctor', 'dia_semana', 'hora_inicio', 'regla', 'regla_desde'), name='horario_unico_por_regla'),
+        ),
+    ]
@@ -1,5 +1,30 @@
 from django.db import models
+from django.core.exceptions import ValidationError
 from doctores.models import Doctor
+from especialidades.models import Especialidad
+
+
+class Recurso(models.Model):
+    """Consultorio o equipo que comparten los doctores (ver citas/conflictos.py)"""
+    TIPOS = [
+        ('consultorio', 'Consultorio'),
+        ('equipo', 'Equipo'),
+    ]
+    
+    nombre = models.CharField(max_length=100, unique=True)
+    tipo = models.CharField(max_length=20, choices=TIPOS, default='consultorio')
+    descripcion = models.TextField(blank=True, null=True)
+    activo = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Recurso"
+        verbose_name_plural = "Recursos"
+        ordering = ['tipo', 'nombre']
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.nombre}"
+
 
 class Horario(models.Model):
     DIAS_SEMANA = [
@@ -16,6 +41,18 @@ class Horario(models.Model):
     dia_semana = models.IntegerField(choices=DIAS_SEMANA)
     hora_inicio = models.TimeField()
     hora_fin = models.TimeField()
+    # Regla RRULE (RFC 5545) para turnos que no son semanales, p. ej.
+    # "FREQ=WEEKLY;INTERVAL=2" o "FREQ=MONTHLY;BYDAY=+1SA". Vacía = todas las semanas
+    regla = models.CharField(max_length=255, blank=True, default='')
+    regla_desde = models.DateField(blank=True, null=True, help_text="Fecha desde la que se cuenta la regla")
+    recurso = models.ForeignKey(
+        Recurso,
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+        related_name='horarios',
+        help_text="Consultorio o equipo que usa el doctor en este turno"
+    )
     activo = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -23,11 +60,32 @@ class Horario(models.Model):
     class Meta:
         verbose_name = "Horario"
         verbose_name_plural = "Horarios"
-        unique_together = ['doctor', 'dia_semana', 'hora_inicio']
+        constraints = [
+            # Un solo turno semanal por doctor, día y hora de inicio
+            models.UniqueConstraint(
+                fields=['doctor', 'dia_semana', 'hora_inicio'],
+                condition=models.Q(regla=''),
+                name='horario_unico_semanal'
+            ),
+            # Dos reglas complementarias (semanas alternas) comparten día y hora
+            models.UniqueConstraint(
+                fields=['doctor', 'dia_semana', 'hora_inicio', 'regla', 'regla_desde'],
+                condition=~models.Q(regla=''),
+                name='horario_unico_por_regla'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.doctor} - {self.get_dia_semana_display()} {self.hora_inicio}-{self.hora_fin}"
 
+    def clean(self):
+        """Validar que la regla de recurrencia se pueda interpretar"""
+        if self.regla:
+            from .reglas import validar_regla
+            error = validar_regla(self.regla)
+            if error:
+                raise ValidationError({'regla': f'Regla de recurrencia inválida: {error}'})
+
 
 class Excepcion(models.Model):
     TIPOS = [
@@ -49,4 +107,29 @@ class Excepcion(models.Model):
         verbose_name_plural = "Excepciones de Horario"
 
     def __str__(self):
-        return f"{self.doctor} - {self.get_motivo_display()} ({self.fecha_inicio} - {self.fecha_fin})"
\ No newline at end of file
+        return f"{self.doctor} - {self.get_motivo_display()} ({self.fecha_inicio} - {self.fecha_fin})"
+
+
+class Cierre(models.Model):
+    """Día o rango en que no atiende toda la clínica o una especialidad (feriados, cierres)"""
+    nombre = models.CharField(max_length=100)
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField()
+    especialidad = models.ForeignKey(
+        Especialidad,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='cierres',
+        help_text="Vacío para toda la clínica"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Cierre"
+        verbose_name_plural = "Cierres"
+        ordering = ['fecha_inicio']
+
+    def __str__(self):
+        alcance = self.especialidad or 'Toda la clínica'
+        return f"{self.nombre} - {alcance} ({self.fecha_inicio} - {self.fecha_fin})"
@@ -0,0 +1,128 @@
+"""
+Horarios con regla de recurrencia (RRULE): expansión en turnos con fecha.
+
+La expansión de las reglas de un doctor se guarda en caché por mes. La
+clave lleva una firma de sus horarios con regla (incluido updated_at), así
+que editar, agregar o borrar uno deja de usar la expansión anterior.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from dateutil.rrule import rrulestr
+from django.core.cache import cache
+
+REGLAS_TTL = 24 * 3600
+# Días hacia adelante en que se comparan las fechas de dos reglas para
+# saber si se cruzan (cubre los patrones semanales y mensuales)
+HORIZONTE_CRUCE = 366
+
+# Días de la semana en formato RRULE, en el orden de Horario.DIAS_SEMANA
+DIAS_RRULE = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+# Reglas predefinidas que ofrece el formulario de horarios ({dia} = día RRULE)
+REGLAS_PREDEFINIDAS = {
+    'alterna': ('Semana por medio', 'FREQ=WEEKLY;INTERVAL=2'),
+    'primera_del_mes': ('Primera del mes', 'FREQ=MONTHLY;BYDAY=+1{dia}'),
+    'ultima_del_mes': ('Última del mes', 'FREQ=MONTHLY;BYDAY=-1{dia}'),
+}
+
+# Columnas de Horario que necesita la expansión
+CAMPOS_REGLA = (
+    'pk', 'doctor_id', 'dia_semana', 'hora_inicio', 'hora_fin',
+    'regla', 'regla_desde', 'recurso_id', 'created_at', 'updated_at',
+)
+
+
+def validar_regla(regla):
+    """Mensaje de error si la regla no se puede interpretar, o None"""
+    try:
+        rrulestr(regla, dtstart=datetime(2000, 1, 1))
+    except (ValueError, TypeError) as e:
+        return str(e)
+    return None
+
+
+def fechas_regla(horario, fecha_inicio, fecha_fin):
+    """
+    Fechas entre las dos dadas (incluidas) en que toca el turno. `horario`
+    es un dict con CAMPOS_REGLA. La regla se ancla en el primer día de la
+    semana del turno a partir de regla_desde (o de su creación).
+    """
+    desde = horario['regla_desde'] or horario['created_at'].date()
+    ancla = desde + timedelta(days=(horario['dia_semana'] - desde.weekday()) % 7)
+    regla = rrulestr(horario['regla'], dtstart=datetime.combine(ancla, datetime.min.time()))
+    return [
+        ocurrencia.date()
+        for ocurrencia in regla.between(
+            datetime.combine(fecha_inicio, datetime.min.time()),
+            datetime.combine(fecha_fin, datetime.min.time()),
+            inc=True
+        )
+    ]
+
+
+def se_cruzan(horario, otro, desde):
+    """
+    Indica si dos turnos del mismo día de la semana con horas que se solapan
+    (dicts con CAMPOS_REGLA) caen alguna fecha en común a partir de `desde`.
+    Un turno semanal cae todas las semanas y choca con cualquiera; dos con
+    regla (p. ej. semanas alternas, primera y última del mes) se comparan
+    por sus fechas expandidas.
+    """
+    if not horario['regla'] or not otro['regla']:
+        return True
+    hasta = desde + timedelta(days=HORIZONTE_CRUCE)
+    return not set(fechas_regla(horario, desde, hasta)).isdisjoint(fechas_regla(otro, desde, hasta))
+
+
+def _meses(fecha_inicio, fecha_fin):
+    """Primer día de cada mes que toca el rango"""
+    mes = fecha_inicio.replace(day=1)
+    while mes <= fecha_fin:
+        yield mes
+        mes = (mes + timedelta(days=32)).replace(day=1)
+
+
+def _firma(horarios):
+    """Firma de los horarios con regla de un doctor"""
+    datos = repr(sorted(tuple(horario[campo] for campo in CAMPOS_REGLA) for horario in horarios))
+    return hashlib.md5(datos.encode()).hexdigest()
+
+
+def expandir_reglas(horarios, fecha_inicio, fecha_fin):
+    """
+    Turnos con fecha de los horarios con regla entre las dos fechas:
+    {doctor_id: [(fecha, hora_inicio, hora_fin, recurso_id), ...]}.
+
+    Cada (doctor, mes) se expande una vez y se guarda en caché; las
+    lecturas siguientes solo filtran por fecha.
+    """
+    por_doctor = defaultdict(list)
+    for horario in horarios:
+        por_doctor[horario['doctor_id']].append(horario)
+
+    claves = {}
+    for doctor_id, horarios_doctor in por_doctor.items():
+        firma = _firma(horarios_doctor)
+        for mes in _meses(fecha_inicio, fecha_fin):
+            claves[f'horarios:reglas:{doctor_id}:{mes:%Y-%m}:{firma}'] = (doctor_id, mes)
+
+    meses = cache.get_many(claves)
+    faltantes = {}
+    for clave, (doctor_id, mes) in claves.items():
+        if clave not in meses:
+            fin_mes = (mes + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            faltantes[clave] = meses[clave] = sorted(
+                (fecha, horario['hora_inicio'], horario['hora_fin'], horario['recurso_id'])
+                for horario in por_doctor[doctor_id]
+                for fecha in fechas_regla(horario, mes, fin_mes)
+            )
+    if faltantes:
+        cache.set_many(faltantes, REGLAS_TTL)
+
+    turnos = defaultdict(list)
+    for clave, (doctor_id, mes) in claves.items():
+        turnos[doctor_id].extend(
+            turno for turno in meses[clave] if fecha_inicio <= turno[0] <= fecha_fin
+        )
+    return turnos
@@ -1,3 +1,154 @@
-from django.test import TestCase
+from datetime import date, datetime, time
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+from usuarios.models import Usuario
+from doctores.models import Doctor
+from .intervalos import IndiceIntervalos
+from .models import Horario
+from .reglas import fechas_regla, se_cruzan
 
-# Create your tests here.
+
+class IndiceIntervalosTest(SimpleTestCase):
+    """Fusión de intervalos semiabiertos y búsquedas"""
+
+    def test_fusiona_solapados_y_pegados(self):
+        indice = IndiceIntervalos([(30, 40), (0, 10), (10, 20), (35, 50), (60, 60)])
+        self.assertEqual(list(indice), [(0, 20), (30, 50)])
+
+    def test_conserva_el_primer_dato(self):
+        indice = IndiceIntervalos([(10, 20, 'b'), (0, 10, 'a'), (15, 30, 'c')])
+        self.assertEqual(list(indice), [(0, 30)])
+        self.assertEqual(indice.dato(25), 'a')
+        self.assertIsNone(indice.dato(30))
+
+    def test_vacio(self):
+        indice = IndiceIntervalos()
+        self.assertFalse(indice)
+        self.assertFalse(indice.contiene(0))
+        self.assertIsNone(indice.solapado(0, 10))
+
+    def test_contiene_es_semiabierto(self):
+        indice = IndiceIntervalos([(10, 20)])
+        self.assertTrue(indice.contiene(10))
+        self.assertTrue(indice.contiene(19))
+        self.assertFalse(indice.contiene(20))
+        self.assertFalse(indice.contiene(9))
+
+    def test_solapado_en_los_bordes(self):
+        indice = IndiceIntervalos([(10, 20), (30, 40)])
+        # Tocar un borde no es solaparse
+        self.assertIsNone(indice.solapado(0, 10))
+        self.assertIsNone(indice.solapado(20, 30))
+        self.assertIsNone(indice.solapado(40, 50))
+        self.assertEqual(indice.solapado(19, 21), (10, 20))
+        self.assertEqual(indice.solapado(25, 31), (30, 40))
+        self.assertEqual(indice.solapado(0, 100), (10, 20))
+        self.assertEqual(indice.solapado(12, 15), (10, 20))
+
+    def test_fechas(self):
+        indice = IndiceIntervalos([(date(2026, 1, 1), date(2026, 1, 3), 'Año nuevo')])
+        self.assertEqual(indice.dato(date(2026, 1, 2)), 'Año nuevo')
+        self.assertIsNone(indice.dato(date(2026, 1, 3)))
+
+    def test_siguiente_en_la_grilla_del_intervalo(self):
+        indice = IndiceIntervalos([(480, 600), (660, 720)])
+        self.assertEqual(indice.siguiente(0, 30), (480, 510))
+        self.assertEqual(indice.siguiente(480, 30), (480, 510))
+        # Los tramos se cuentan desde las 8:00: después de 8:01 sigue 8:30
+        self.assertEqual(indice.siguiente(481, 30), (510, 540))
+        self.assertEqual(indice.siguiente(570, 30), (570, 600))
+
+    def test_siguiente_salta_al_intervalo_donde_cabe(self):
+        indice = IndiceIntervalos([(480, 600), (660, 720)])
+        self.assertEqual(indice.siguiente(571, 30), (660, 690))
+        self.assertEqual(indice.siguiente(600, 30), (660, 690))
+        self.assertEqual(indice.siguiente(0, 90), (480, 570))
+        self.assertEqual(indice.siguiente(500, 90), None)
+        self.assertIsNone(indice.siguiente(700, 30))
+        self.assertIsNone(IndiceIntervalos().siguiente(0, 30))
+
+
+class FechasReglaTest(SimpleTestCase):
+    """Expansión de reglas de recurrencia ancladas en regla_desde"""
+
+    def horario(self, regla, regla_desde=None, dia_semana=0):
+        return {
+            'dia_semana': dia_semana,
+            'regla': regla,
+            'regla_desde': regla_desde,
+            'created_at': datetime(2026, 10, 14, 9, 30),
+        }
+
+    def test_semana_por_medio_desde_el_primer_dia_del_turno(self):
+        # Miércoles 14/10: la primera semana es la del lunes 19/10
+        horario = self.horario('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 14))
+        self.assertEqual(
+            fechas_regla(horario, date(2026, 10, 1), date(2026, 11, 30)),
+            [date(2026, 10, 19), date(2026, 11, 2), date(2026, 11, 16), date(2026, 11, 30)]
+        )
+
+    def test_otra_ancla_da_las_semanas_complementarias(self):
+        horario = self.horario('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 26))
+        self.assertEqual(
+            fechas_regla(horario, date(2026, 10, 1), date(2026, 11, 30)),
+            [date(2026, 10, 26), date(2026, 11, 9), date(2026, 11, 23)]
+        )
+
+    def test_sin_regla_desde_usa_la_creacion(self):
+        horario = self.horario('FREQ=WEEKLY;INTERVAL=2')
+        self.assertEqual(
+            fechas_regla(horario, date(2026, 10, 19), date(2026, 10, 19)),
+            [date(2026, 10, 19)]
+        )
+
+    def test_primera_del_mes(self):
+        # El lunes 5/10 es anterior al ancla (lunes 12/10) y no cuenta
+        horario = self.horario('FREQ=MONTHLY;BYDAY=+1MO', date(2026, 10, 6))
+        self.assertEqual(
+            fechas_regla(horario, date(2026, 10, 1), date(2026, 12, 31)),
+            [date(2026, 11, 2), date(2026, 12, 7)]
+        )
+
+    def test_ultima_del_mes(self):
+        horario = self.horario('FREQ=MONTHLY;BYDAY=-1FR', date(2026, 10, 1), dia_semana=4)
+        self.assertEqual(
+            fechas_regla(horario, date(2026, 10, 1), date(2026, 12, 31)),
+            [date(2026, 10, 30), date(2026, 11, 27), date(2026, 12, 25)]
+        )
+
+    def test_se_cruzan(self):
+        semanal = self.horario('')
+        par = self.horario('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 19))
+        impar = self.horario('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 26))
+        self.assertTrue(se_cruzan(semanal, par, date(2026, 10, 18)))
+        self.assertTrue(se_cruzan(par, par, date(2026, 10, 18)))
+        self.assertFalse(se_cruzan(par, impar, date(2026, 10, 18)))
+
+
+class HorarioUnicoTest(TestCase):
+    """Unicidad de turnos semanales y con regla en la base de datos"""
+
+    def setUp(self):
+        usuario = Usuario.objects.create_user('doctor', password='x', rol='doctor')
+        self.doctor = Doctor.objects.create(usuario=usuario, licencia_medica='CMP-1')
+
+    def crear(self, regla='', regla_desde=None):
+        return Horario.objects.create(
+            doctor=self.doctor,
+            dia_semana=0,
+            hora_inicio=time(8, 0),
+            hora_fin=time(12, 0),
+            regla=regla,
+            regla_desde=regla_desde
+        )
+
+    def test_rechaza_turno_semanal_duplicado(self):
+        self.crear()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.crear()
+
+    def test_reglas_complementarias_el_mismo_dia_y_hora(self):
+        self.crear('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 19))
+        self.crear('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 26))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.crear('FREQ=WEEKLY;INTERVAL=2', date(2026, 10, 19))
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('dashboard/', views.dashboard_admin, name='dashboard_admin'),
+    path('estadisticas/', views.dashboard_estadisticas, name='dashboard_estadisticas'),
     path('citas/', views.reporte_citas, name='reporte_citas'),
     path('doctores/', views.reporte_doctores, name='reporte_doctores'),
     path('pacientes/', views.reporte_pacientes, name='reporte_pacientes'),
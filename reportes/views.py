@@ -20,8 +20,13 @@ def es_admin(user):
 
 @login_required
 @user_passes_test(es_admin)
-def dashboard_admin(request):
-    """Dashboard principal de administración con estadísticas"""
+def dashboard_estadisticas(request):
+    """
+    Dashboard de estadísticas del periodo. Los conteos por estado salen de
+    una sola consulta con agregación condicional y los rankings de un
+    GROUP BY por especialidad y por doctor ordenado en SQL, así el número
+    de consultas no crece con los doctores ni las especialidades.
+    """
     
     # Fechas para filtros
     hoy = timezone.now().date()
@@ -51,11 +56,19 @@ def dashboard_admin(request):
         fecha__range=[fecha_inicio, fecha_fin]
     )
     
-    total_citas = citas_periodo.count()
-    citas_completadas = citas_periodo.filter(estado='completada').count()
-    citas_pendientes = citas_periodo.filter(estado__in=['pendiente', 'confirmada']).count()
-    citas_canceladas = citas_periodo.filter(estado='cancelada').count()
-    citas_no_asistio = citas_periodo.filter(estado='no_asistio').count()
+    # Conteos por estado en una sola consulta
+    conteos = citas_periodo.aggregate(
+        total=Count('id'),
+        completadas=Count('id', filter=Q(estado='completada')),
+        pendientes=Count('id', filter=Q(estado__in=['pendiente', 'confirmada'])),
+        canceladas=Count('id', filter=Q(estado='cancelada')),
+        no_asistio=Count('id', filter=Q(estado='no_asistio')),
+    )
+    total_citas = conteos['total']
+    citas_completadas = conteos['completadas']
+    citas_pendientes = conteos['pendientes']
+    citas_canceladas = conteos['canceladas']
+    citas_no_asistio = conteos['no_asistio']
     
     # Porcentajes
     if total_citas > 0:
@@ -67,31 +80,26 @@ def dashboard_admin(request):
         tasa_canceladas = 0
         tasa_no_asistio = 0
     
-    # Citas por especialidad (Top 5)
-    citas_por_especialidad = []
-    especialidades = Especialidad.objects.filter(activo=True)
-    for esp in especialidades:
-        total = citas_periodo.filter(doctor__especialidades=esp).count()
-        if total > 0:
-            citas_por_especialidad.append({
-                'nombre': esp.nombre,
-                'total': total
-            })
-    citas_por_especialidad.sort(key=lambda x: x['total'], reverse=True)
-    citas_por_especialidad = citas_por_especialidad[:5]
-    
-    # Doctores más solicitados (Top 5)
-    doctores_mas_solicitados = []
-    doctores = Doctor.objects.filter(activo=True)[:10]
-    for doc in doctores:
-        total = citas_periodo.filter(doctor=doc).count()
-        if total > 0:
-            doctores_mas_solicitados.append({
-                'nombre': doc.usuario.get_full_name(),
-                'total': total
-            })
-    doctores_mas_solicitados.sort(key=lambda x: x['total'], reverse=True)
-    doctores_mas_solicitados = doctores_mas_solicitados[:5]
+    # Citas por especialidad (Top 5): GROUP BY especialidad ordenado en SQL
+    citas_por_especialidad = Especialidad.objects.filter(
+        activo=True
+    ).annotate(
+        total=Count('doctores__citas', filter=Q(doctores__citas__fecha__range=[fecha_inicio, fecha_fin]))
+    ).filter(
+        total__gt=0
+    ).order_by('-total', 'nombre').values('nombre', 'total')[:5]
+    
+    # Doctores más solicitados (Top 5 entre todos los doctores activos)
+    doctores_mas_solicitados = [
+        {'nombre': doctor.usuario.get_full_name(), 'total': doctor.total}
+        for doctor in Doctor.objects.filter(
+            activo=True
+        ).annotate(
+            total=Count('citas', filter=Q(citas__fecha__range=[fecha_inicio, fecha_fin]))
+        ).filter(
+            total__gt=0
+        ).select_related('usuario').order_by('-total', 'pk')[:5]
+    ]
     
     # Citas por mes (últimos 6 meses)
     hace_6_meses = hoy - timedelta(days=180)
@@ -140,7 +148,7 @@ def dashboard_admin(request):
         'fecha_fin': fecha_fin,
     }
     
-    return render(request, 'reportes/dashboard_admin.html', context)
+    return render(request, 'reportes/dashboard_estadisticas.html', context)
 
 @login_required
 @user_passes_test(es_admin)
@@ -334,18 +342,19 @@ def dashboard_admin(request):
     total_doctores = Doctor.objects.filter(activo=True).count()
     total_especialidades = Especialidad.objects.filter(activo=True).count()
     
-    # Citas del mes actual
-    citas_mes = Cita.objects.filter(
-        fecha__year=hoy.year,
-        fecha__month=hoy.month
+    # Citas del mes actual y pendientes desde hoy en una sola consulta
+    del_mes = Q(fecha__year=hoy.year, fecha__month=hoy.month)
+    pendientes = Q(fecha__gte=hoy, estado__in=['pendiente', 'confirmada'])
+    conteos = Cita.objects.filter(del_mes | pendientes).aggregate(
+        total_mes=Count('id', filter=del_mes),
+        completadas=Count('id', filter=del_mes & Q(estado='completada')),
+        canceladas=Count('id', filter=del_mes & Q(estado='cancelada')),
+        pendientes=Count('id', filter=pendientes),
     )
     
-    total_citas_mes = citas_mes.count()
+    total_citas_mes = conteos['total_mes']
     citas_hoy = Cita.objects.filter(fecha=hoy).exclude(estado='cancelada').order_by('hora_inicio')
-    citas_pendientes = Cita.objects.filter(
-        fecha__gte=hoy,
-        estado__in=['pendiente', 'confirmada']
-    ).count()
+    citas_pendientes = conteos['pendientes']
     
     # Preparar datos para el calendario (próximos 3 meses)
     from datetime import timedelta
@@ -357,8 +366,8 @@ def dashboard_admin(request):
     ).select_related('paciente__usuario', 'doctor__usuario').order_by('fecha', 'hora_inicio')
     
     # Estadísticas rápidas
-    citas_completadas = citas_mes.filter(estado='completada').count()
-    citas_canceladas = citas_mes.filter(estado='cancelada').count()
+    citas_completadas = conteos['completadas']
+    citas_canceladas = conteos['canceladas']
     
     context = {
         'total_pacientes': total_pacientes,